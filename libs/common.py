@@ -1,6 +1,6 @@
 # @Time    : 2016/11/21 12:15
 # @Author  : lixintong
-from keywords import keyword, get_var, get_field, call
+from keywords import keyword, get_var, call, ref, plan, view_tree
 from primary import get_view
 from solo import InstrumentationRegistry
 
@@ -42,12 +42,17 @@ def get_current_progress(index=0):
     """
     seekbar_id = "com.ifeng.newvideo:id/control_seekBar"
     solo = get_var("solo")
-    view = solo.get_view(res_id=seekbar_id, index=index)
-    mSeekBarView = get_field(view, "mSeekBarView")
-    progress = call(mSeekBarView, "getProgress")
+    view = ref(solo).call("getView", seekbar_id, index) if index else ref(solo).call("getView", seekbar_id)
+    progress = view.get_field("mSeekBarView").call("getProgress").value()
     return progress
 
 
+@plan
+def video_state_plan(p, solo):
+    video_skin = p.call(solo, "getView", "com.ifeng.newvideo:id/video_skin")
+    p.call(video_skin, "getContentDescription")
+
+
 @keyword("check_video_state")
 def check_video_state(state):
     """
@@ -56,8 +61,7 @@ def check_video_state(state):
     :return:
     """
     solo = get_var("solo")
-    video_skin = solo.get_view("com.ifeng.newvideo:id/video_skin")
-    description = call(video_skin, "getContentDescription")
+    description = video_state_plan(solo)
     assert description == state, "视频状态非{}".format(state)
 
 
@@ -86,10 +90,8 @@ def get_group_child_count(view_group):
 
 @keyword("get_soft_input_state")
 def get_soft_input_state(edit_text_view):
-    solo = get_var("solo")
-    context = call(edit_text_view, "getContext")
-    input_manager = call(context, "getSystemService", "input_method")
-    return call(input_manager, "isActive")
+    input_manager = ref(edit_text_view).call("getContext").call("getSystemService", "input_method")
+    return input_manager.call("isActive").value()
 
 
 @keyword("assert_string_empty")
@@ -114,16 +116,27 @@ def assert_exist_text(text):
         raise AssertionError('%s is exist' % text)
 
 
+def is_shown(view):
+    """
+    View.isShown, answered from view tree snapshot if the view is in it
+    """
+    tree = view_tree()
+    node = tree.get(view.hash) if tree else None
+    if node:
+        return node.is_shown
+    return call(view, "isShown")
+
+
 @keyword("assert_view_is_show")
 def assert_view_hidden(view):
-    isShown = call(view, "isShown")
+    isShown = is_shown(view)
     if not isShown:
         raise AssertionError('%s is not show' % view)
 
 
 @keyword("assert_view_not_show")
 def assert_view_not_show(view):
-    isShown = call(view, "isShown")
+    isShown = is_shown(view)
     if isShown:
         raise AssertionError('%s is show' % view)
 
@@ -1,8 +1,50 @@
 import socket
+import functools
+import threading
+from collections.abc import MutableMapping
 
 kw_func = {}
 
-var_cache = {}
+
+class ThreadVarCache(MutableMapping):
+    """
+    Values set in a thread are read back by that thread, every device runs cases in its own thread.
+    A thread which never set a name gets the last value set by any thread, like context.agent.
+    """
+
+    def __init__(self):
+        self._local = threading.local()
+        self._shared = {}
+
+    def _values(self):
+        values = getattr(self._local, 'values', None)
+        if values is None:
+            values = self._local.values = {}
+        return values
+
+    def __getitem__(self, name):
+        values = self._values()
+        if name in values:
+            return values[name]
+        return self._shared[name]
+
+    def __setitem__(self, name, value):
+        self._values()[name] = value
+        self._shared[name] = value
+
+    def __delitem__(self, name):
+        found = self._values().pop(name, self) is not self
+        if self._shared.pop(name, self) is self and not found:
+            raise KeyError(name)
+
+    def __iter__(self):
+        return iter(set(self._shared) | set(self._values()))
+
+    def __len__(self):
+        return len(set(self._shared) | set(self._values()))
+
+
+var_cache = ThreadVarCache()
 
 STRING = '01'
 INT = '02'
@@ -10,6 +52,12 @@ CLASS = '03'
 OBJECT = '04'
 FLOAT = '05'
 BOOL = '06'
+NULL = '09'
+LONG = '10'
+DOUBLE = '11'
+BYTE = '12'
+ARRAY = '13'
+LIST = '14'
 
 
 def keyword(name):
@@ -42,6 +90,20 @@ def call_static(remote_class, method, *args):
     return var_cache['reflection'].remote_call_static(remote_class, method, *args)
 
 
+def call_cached(remote_object, method, *args):
+    """
+    call whose result is cached while the agent is connected. Only for results which never change
+    """
+    return var_cache['reflection'].remote_call_cached(remote_object, method, *args)
+
+
+def call_static_cached(remote_class, method, *args):
+    """
+    call_static whose result is cached while the agent is connected, e.g. singleton getters
+    """
+    return var_cache['reflection'].remote_call_static_cached(remote_class, method, *args)
+
+
 def new(remote_class, *args):
     return var_cache['reflection'].remote_new(remote_class, *args)
 
@@ -58,6 +120,100 @@ def get_field(remote_object, field_name):
     return var_cache['reflection'].remote_get_field(remote_object, field_name)
 
 
+def batch(*calls):
+    """
+    Run independent reflection calls in one round trip.
+    e.g. batch(('get', view, 'mText'), ('call', view, 'isShown'))
+    """
+    return var_cache['reflection'].remote_batch(*calls)
+
+
+def prefetch(objects, *names):
+    """
+    Fetch attrs of lazy remote objects in one round trip, e.g. prefetch(items, 'text')
+    """
+    var_cache['reflection'].prefetch(objects, *names)
+
+
+def set_prefetch_hint(class_name, *names):
+    """
+    Prefetch attrs of class_name objects whenever a call returns a list of them
+    """
+    var_cache['reflection'].set_prefetch_hint(class_name, *names)
+
+
+def plan(build):
+    """
+    Compile a block of reflection calls into a remote plan, it runs in one round trip.
+    Plan is compiled at its first run. e.g.
+
+    @plan
+    def click_id_plan(p, solo, view_id):
+        view = p.call(solo, 'getView', view_id)
+        p.call(solo, 'clickOnView', view)
+
+    click_id_plan(get_var('solo'), 'com.ifeng.newvideo:id/title')
+    """
+    compiled = []
+
+    @functools.wraps(build)
+    def run(*params):
+        if not compiled:
+            compiled.append(var_cache['reflection'].remote_plan(build))
+        return compiled[0](*params)
+    return run
+
+
+def ref(remote_object):
+    """
+    Lazy call chain, sent in one round trip when value() is called.
+    e.g. ref(view).get_field('mSeekBarView').call('getProgress').value()
+    """
+    return var_cache['reflection'].remote_ref(remote_object)
+
+
+def supports_events():
+    return var_cache['reflection'].supports_events()
+
+
+def subscribe(name, match=None, replay_last=False):
+    """
+    Subscribe ui event pushed by agent, e.g. 'activity', 'view_appeared', 'toast_shown', 'dialog'
+    """
+    return var_cache['reflection'].subscribe(name, match=match, replay_last=replay_last)
+
+
+def wait_ui(name, match=None, check=None, timeout=20, replay_last=False):
+    """
+    Wait until ui is ready: event of name matches or check() passes, whichever comes first.
+    check runs once after subscribing, so a ui which is already ready is not missed.
+    :return: True if ready before timeout
+    """
+    with subscribe(name, match=match, replay_last=replay_last) as subscription:
+        if subscription.done() or (check and check()):
+            return True
+        try:
+            subscription.wait(timeout)
+            return True
+        except TimeoutError:
+            return False
+
+
+def view_tree():
+    """
+    Snapshot of current window views, None if agent can't send it.
+    It answers view queries without round trips until a ui mutating action, see view_tree.ViewTree
+    """
+    return var_cache['proxy'].get_view_tree()
+
+
+def snapshot_view(node):
+    """
+    :return: RemoteObject of a view tree node, usable in reflection calls
+    """
+    return RemoteObject.from_dict(node.to_dict())
+
+
 def set_var(name, value):
     var_cache[name] = value
 
@@ -150,6 +306,12 @@ class RemoteObject:
     def __init__(self):
         self.remote_type = OBJECT
 
+    def __getattr__(self, name):
+        # attrs of lazy remote objects are fetched on first access
+        if name.startswith('_') or 'reflection' not in var_cache:
+            raise AttributeError(name)
+        return var_cache['reflection'].lazy_attr(self, name)
+
     @classmethod
     def from_dict(cls, attr_dict):
         obj = cls()
@@ -185,6 +347,32 @@ class RemoteObject:
         obj.value = bool_input
         return obj
 
+    @classmethod
+    def from_long(cls, long_input):
+        obj = cls()
+        obj.remote_type = LONG
+        obj.value = long_input
+        return obj
+
+    @classmethod
+    def from_double(cls, double_input):
+        obj = cls()
+        obj.remote_type = DOUBLE
+        obj.value = double_input
+        return obj
+
+    @classmethod
+    def from_array(cls, element_type, values):
+        """
+        Primitive array, e.g. RemoteObject.from_array(FLOAT, [x1, y1, x2, y2]) is float[].
+        Needs an agent which supports typed args
+        """
+        obj = cls()
+        obj.remote_type = ARRAY
+        obj.element_type = element_type
+        obj.values = values
+        return obj
+
     def set_field(self, field, value):
         set_field(self, field, value)
 
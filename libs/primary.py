@@ -1,13 +1,23 @@
 # @Time    : 2016/11/18 16:32
-from keywords import get_var, keyword, call
+from keywords import get_var, keyword, call, plan, view_tree, snapshot_view
+
+
+@plan
+def click_id_plan(p, solo, view_id, index):
+    view = p.call(solo, "getView", view_id, index)
+    p.call(solo, "clickOnView", view)
+
+
+@plan
+def get_view_text_plan(p, solo, view_id, index):
+    view = p.call(solo, "getView", view_id, index)
+    p.call(view, "getText")
 
 
 @keyword("click_id")
 def click_id(view_id, index=0):
     solo = get_var("solo")
-    # solo.sleep(3000)
-    view = get_view(view_id, index)
-    click_view(view)
+    click_id_plan(solo, view_id, index)
 
 
 @keyword("click_text")
@@ -24,6 +34,10 @@ def click_view(view):
 
 @keyword("get_view")
 def get_view(view_id, index=0):
+    tree = view_tree()
+    node = tree.find_by_id(view_id, index, shown_only=True) if tree else None
+    if node:
+        return snapshot_view(node)
     solo = get_var("solo")
     return solo.get_view(res_id=view_id, index=index)
 
@@ -31,8 +45,7 @@ def get_view(view_id, index=0):
 @keyword("get_view_text")
 def get_text(view_id, index=0):
     solo = get_var("solo")
-    view = solo.get_view(res_id=view_id, index=index)
-    return call(view, "getText")
+    return get_view_text_plan(solo, view_id, index)
 
 
 @keyword("sleep")
@@ -96,6 +109,11 @@ def get_text_from_parent(view, text, index=0):
     :param index:
     :return:
     """
+    tree = view_tree()
+    parent = tree.get(view.hash) if tree else None
+    node = tree.find_by_text(text, index, parent=parent, shown_only=True) if parent else None
+    if node:
+        return snapshot_view(node)
     solo = get_var("solo")
     view = solo.get_text_from_parent(view, text, index)
     return view
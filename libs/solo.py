@@ -1,4 +1,5 @@
-from keywords import keyword, new, call, call_static, RemoteObject
+import re
+from keywords import keyword, new, call, call_cached, call_static_cached, RemoteObject, supports_events, wait_ui
 
 instrument_registry = 'android.support.test.InstrumentationRegistry'
 instrumentation_class_name = 'android.app.Instrumentation'
@@ -20,7 +21,7 @@ class Intent(RemoteObject):
 
 class Context(RemoteObject):
     def get_package_manager(self):
-        obj = call(self, 'getPackageManager')
+        obj = call_cached(self, 'getPackageManager')
         return PackageManager.from_object(obj)
 
     def start_activity(self, intent):
@@ -43,11 +44,11 @@ class Instrumentation(RemoteObject):
         return Activity.from_object(obj)
 
     def get_context(self):
-        obj = call(self, 'getContext')
+        obj = call_cached(self, 'getContext')
         return Context.from_object(obj)
 
     def get_target_context(self):
-        obj = call(self, 'getTargetContext')
+        obj = call_cached(self, 'getTargetContext')
         return Context.from_object(obj)
 
 
@@ -55,7 +56,7 @@ class InstrumentationRegistry(RemoteObject):
     @staticmethod
     def get_instrumentation():
         instrument_registry_class = RemoteObject.from_class_name(instrument_registry)
-        remote_obj = call_static(instrument_registry_class, "getInstrumentation")
+        remote_obj = call_static_cached(instrument_registry_class, "getInstrumentation")
         return Instrumentation.from_object(remote_obj)
 
 
@@ -81,22 +82,34 @@ class Solo(RemoteObject):
                 return call(self, "getView", RemoteObject.from_class_name(class_name), index)
             return call(self, "getView", RemoteObject.from_class_name(class_name))
 
-    def wait_for_text(self, text):
+    def wait_for_text(self, text, timeout=20):
         """
         Waits for the specified text to appear. Default timeout is 20 seconds.
+        Agent which pushes events returns as soon as the text appears.
         @param text the text to wait for, specified as a regular expression
         @return {@code true} if text is displayed and {@code false} if it is not displayed before the timeout
         """
-        return call(self, "waitForText", text)
+        if not supports_events():
+            return call(self, "waitForText", text)
+        pattern = re.compile(text)
+        return wait_ui('view_appeared',
+                       match=lambda data: pattern.search(data.get('text') or ''),
+                       check=lambda: call(self, "searchText", text, True),
+                       timeout=timeout)
 
-    def wait_for_view(self, class_name):
+    def wait_for_view(self, class_name, timeout=20):
         """
         Waits for a View matching the specified class. Default timeout is 20 seconds.
+        Agent which pushes events returns as soon as the view appears.
         :param class_name:viewClass the {@link View} class to wait for
         :return:{@code true} if the {@link View} is displayed and {@code false} if it is not displayed before the timeout
         """
-
-        return call(self, "waitForView", RemoteObject.from_class_name(class_name))
+        if not supports_events():
+            return call(self, "waitForView", RemoteObject.from_class_name(class_name))
+        return wait_ui('view_appeared',
+                       match=lambda data: data.get('class_name') == class_name,
+                       check=lambda: call(self, "waitForView", RemoteObject.from_class_name(class_name), 1, 0),
+                       timeout=timeout)
 
     def get_current_activity(self):
         """
@@ -112,19 +125,25 @@ class Solo(RemoteObject):
         """
         return call(self, "assertMemoryNotLow")
 
-    def wait_for_dialog_to_open(self):
+    def wait_for_dialog_to_open(self, timeout=20):
         """
         Waits for a Dialog to open. Default timeout is 20 seconds.
         :return: {@code true} if the {@link android.app.Dialog} is opened before the timeout and {@code false} if it is not opened
         """
-        return call(self, "waitForDialogToOpen")
+        if not supports_events():
+            return call(self, "waitForDialogToOpen")
+        return wait_ui('dialog', match=lambda data: data.get('open'),
+                       check=lambda: call(self, "waitForDialogToOpen", 0), timeout=timeout, replay_last=True)
 
-    def wait_for_dialog_to_close(self):
+    def wait_for_dialog_to_close(self, timeout=20):
         """
         Waits for a Dialog to close. Default timeout is 20 seconds.
         :return: @return {@code true} if the {@link android.app.Dialog} is closed before the timeout and {@code false} if it is not closed
         """
-        return call(self, "waitForDialogToClose")
+        if not supports_events():
+            return call(self, "waitForDialogToClose")
+        return wait_ui('dialog', match=lambda data: not data.get('open'),
+                       check=lambda: call(self, "waitForDialogToClose", 0), timeout=timeout, replay_last=True)
 
     def go_back(self):
         """
@@ -261,13 +280,18 @@ class Solo(RemoteObject):
         """
         return call(self, "unlockScreen")
 
-    def wait_for_activity(self, name):
+    def wait_for_activity(self, name, timeout=20):
         """
         Waits for an Activity matching the specified name. Default timeout is 20 seconds.
         :param name: the name of the {@code Activity} to wait for. Example is: {@code "MyActivity"}
         :return: {@code true} if {@code Activity} appears before the timeout and {@code false} if it does not
         """
-        return call(self, "waitForActivity", name)
+        if not supports_events():
+            return call(self, "waitForActivity", name)
+        return wait_ui('activity',
+                       match=lambda data: data.get('name', '').split('.')[-1] == name,
+                       check=lambda: self.get_current_activity().class_name.split('.')[-1] == name,
+                       timeout=timeout, replay_last=True)
 
     def wait_for_fragment_by_tag(self, tag):
         """
@@ -399,7 +423,7 @@ class UIDevice(RemoteObject):
     def get_instance(cls, instrumentation):
         instrumentation.class_name = instrumentation_class_name
         ui_device_class = RemoteObject.from_class_name(ui_device_class_name)
-        return UIDevice.from_object(call_static(ui_device_class, "getInstance", instrumentation))
+        return UIDevice.from_object(call_static_cached(ui_device_class, "getInstance", instrumentation))
 
     def press_home(self):
         call(self, "pressHome")
@@ -0,0 +1,78 @@
+"""
+Microbenchmark of KWCore._parse_line, not collected by unittest.
+Parses kw lines found in tests/kw scripts plus typical case lines, prints lines/sec.
+
+python -m tests.test_manager.bench_kw_parse [repeat]
+"""
+import ast
+import os
+import re
+import sys
+import time
+from uitester.test_manager import kw_runner
+
+KW_TESTS_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir, 'kw')
+
+# typical lines of data driven cases
+CASE_LINES = [
+    'import primary',
+    'import common',
+    'launch_app "com.ifeng.newvideo"',
+    'get_view com.ifeng.newvideo:id/title 2 as title',
+    'click_view $title',
+    'enter_text $title "user name with spaces"',
+    'assert_equal $title.text "Hello world"',
+    'check $data.user_name $title.text',
+    'sleep 1000',
+    'swipe 100 200 300 -400 20',
+    '# comment line',
+]
+
+
+def kw_lines():
+    """
+    :return: kw script lines in string literals of tests/kw scripts, and CASE_LINES
+    """
+    lines = list(CASE_LINES)
+    for name in sorted(os.listdir(KW_TESTS_DIR)):
+        if not name.endswith('.py'):
+            continue
+        with open(os.path.join(KW_TESTS_DIR, name), encoding='utf-8') as f:
+            tree = ast.parse(f.read())
+        for node in ast.walk(tree):
+            text = _string_of(node)
+            if text and text.strip() and '\n' not in text:
+                lines.append(text.strip())
+    return lines
+
+
+def _string_of(node):
+    # ast.Str before python 3.8, ast.Constant since
+    value = node.value if type(node).__name__ == 'Constant' else getattr(node, 's', None)
+    return value if isinstance(value, str) else None
+
+
+def bench(lines, repeat):
+    core = kw_runner.KWCore()
+    # define every var used by lines, so they parse
+    for name in re.findall(r'\$(\w+)', '\n'.join(lines)):
+        core.kw_var[name] = None
+    valid = []
+    for line in lines:
+        try:
+            core._parse_line(line)
+            valid.append(line)
+        except ValueError:
+            pass
+    start = time.perf_counter()
+    for _ in range(repeat):
+        for line in valid:
+            core._parse_line(line)
+    seconds = time.perf_counter() - start
+    return len(valid) * repeat / seconds, len(valid)
+
+
+if __name__ == '__main__':
+    repeat = int(sys.argv[1]) if len(sys.argv) > 1 else 20000
+    lines_per_sec, count = bench(kw_lines(), repeat)
+    print('{} lines x {} repeat: {:.0f} lines/sec'.format(count, repeat, lines_per_sec))
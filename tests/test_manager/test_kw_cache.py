@@ -0,0 +1,84 @@
+import os
+import sys
+import importlib
+import shutil
+import tempfile
+import unittest
+from uitester.test_manager import kw_cache, kw_runner, kw_registry
+
+
+class CountCore(kw_runner.KWCore):
+    parsed = []
+
+    def _parse_line(self, kw_line, line_number=0):
+        self.parsed.append(kw_line)
+        return super()._parse_line(kw_line, line_number)
+
+
+class ProgramCacheTest(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp_dir = tempfile.mkdtemp()
+        self.path = os.path.join(self.tmp_dir, 'kw_cache.json')
+        self.old_programs = kw_cache.programs
+        kw_cache.configure(path=self.path)
+        CountCore.parsed = []
+
+    def tearDown(self):
+        kw_cache.programs = self.old_programs
+        shutil.rmtree(self.tmp_dir)
+
+    def test_lru(self):
+        cache = kw_cache.ProgramCache(size=2)
+        cache.put('a', 1)
+        cache.put('b', 2)
+        cache.get('a')
+        cache.put('c', 3)
+        self.assertIsNone(cache.get('b'))
+        self.assertEqual((cache.get('a'), cache.get('c')), (1, 3))
+        self.assertEqual((cache.hits, cache.misses), (3, 1))
+
+    def test_compile_cached(self):
+        script = 'assert_equal $data.a 1 as r\nassert_true $r'
+        program = CountCore().compile(script, with_data=True)
+        self.assertIs(CountCore().compile(script, with_data=True), program)
+        self.assertEqual(len(CountCore.parsed), 2)
+        # $data is not defined without data rows, so it is another program
+        with self.assertRaises(ValueError):
+            CountCore().compile(script)
+
+    def test_persist(self):
+        script = 'assert_equal $data.a 1 as r\nassert_true $r'
+        program = CountCore().compile(script, with_data=True)
+        kw_cache.programs.save()
+
+        kw_cache.configure(path=self.path)
+        loaded = CountCore().compile(script, with_data=True)
+        self.assertEqual(len(CountCore.parsed), 2)
+        self.assertEqual([line.items for line in loaded.lines], [line.items for line in program.lines])
+        self.assertEqual(loaded.var_names, program.var_names)
+        self.assertEqual(loaded.lines[0].func.__name__, 'assert_equal')
+
+    def test_lib_changed(self):
+        # copy of a lib in a temp libs dir, real libs are never touched
+        libs_dir = os.path.join(self.tmp_dir, 'libs')
+        os.mkdir(libs_dir)
+        path = os.path.join(libs_dir, 'cache_test_lib.py')
+        shutil.copy(os.path.join(kw_runner.libs_dir, 'device.py'), path)
+        old_libraries = kw_runner.libraries
+        kw_func = importlib.import_module('keywords').kw_func
+        old_kw_func = dict(kw_func)
+        sys.path.insert(0, libs_dir)
+        try:
+            kw_runner.libraries = kw_registry.LibraryRegistry(libs_dir)
+            key = kw_runner._program_key('import cache_test_lib\nsleep 1', False)
+            mtime = os.path.getmtime(path)
+            os.utime(path, (mtime + 10, mtime + 10))
+            self.assertNotEqual(kw_runner._program_key('import cache_test_lib\nsleep 1', False), key)
+        finally:
+            kw_runner.libraries = old_libraries
+            sys.path.remove(libs_dir)
+            sys.modules.pop('cache_test_lib', None)
+            # keywords of the copy replaced the ones of device.py
+            kw_func.clear()
+            kw_func.update(old_kw_func)
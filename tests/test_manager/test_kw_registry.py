@@ -0,0 +1,110 @@
+import os
+import sys
+import shutil
+import tempfile
+import importlib
+import unittest
+from uitester.test_manager import kw_runner
+from uitester.test_manager import kw_registry
+
+BASE_LIB = '''
+from keywords import keyword
+
+
+@keyword('reg_base_hello')
+def hello():
+    return 'hello'
+
+
+@keyword('reg_base_{name}')
+def extra():
+    return '{name}'
+'''
+
+PAGE_LIB = '''
+from keywords import keyword
+from reg_base import hello
+
+
+@keyword('reg_page_open')
+def open_page():
+    return hello() + ' page'
+'''
+
+
+class LibraryRegistryTest(unittest.TestCase):
+
+    def setUp(self):
+        self.dir = tempfile.mkdtemp()
+        sys.path.insert(0, self.dir)
+        self.write('reg_base', BASE_LIB.format(name='one'))
+        self.write('reg_page', PAGE_LIB)
+        self.registry = kw_registry.LibraryRegistry(self.dir)
+
+    def tearDown(self):
+        kw = importlib.import_module('keywords')
+        for name in [name for name, func in kw.kw_func.items() if func.__module__ in ('reg_base', 'reg_page')]:
+            del kw.kw_func[name]
+        for name in ('reg_base', 'reg_page'):
+            sys.modules.pop(name, None)
+        sys.path.remove(self.dir)
+        shutil.rmtree(self.dir)
+
+    def write(self, module_name, source, offset=0):
+        path = os.path.join(self.dir, module_name + '.py')
+        with open(path, 'w') as f:
+            f.write(source)
+        # mtime in the future so reload does not use a stale pyc
+        mtime = os.path.getmtime(path) + offset
+        os.utime(path, (mtime, mtime))
+        importlib.invalidate_caches()
+
+    def lib_keywords(self, module_name):
+        return sorted(name for name in self.registry.keywords(module_name) if name.startswith('reg_'))
+
+    def test_keywords_of_lib_and_deps(self):
+        self.assertEqual(self.lib_keywords('reg_base'), ['reg_base_hello', 'reg_base_one'])
+        self.assertEqual(self.lib_keywords('reg_page'),
+                         ['reg_base_hello', 'reg_base_one', 'reg_page_open'])
+        self.assertEqual([name for name, mtime in self.registry.mtimes('reg_page')], ['reg_base', 'reg_page'])
+        # keywords defined in keywords.py come with every lib
+        self.assertIn('activate_mock', self.registry.keywords('reg_base'))
+
+    def test_import_once(self):
+        module = self.registry.keywords('reg_page')['reg_page_open'].__globals__
+        self.registry.keywords('reg_page')
+        self.assertIs(self.registry.keywords('reg_page')['reg_page_open'].__globals__, module)
+
+    def test_reload_changed(self):
+        page_open = self.registry.keywords('reg_page')['reg_page_open']
+        self.write('reg_base', BASE_LIB.format(name='two'), offset=10)
+
+        keywords = self.registry.keywords('reg_page')
+        self.assertEqual(sorted(name for name in keywords if name.startswith('reg_')), ['reg_base_hello', 'reg_base_two', 'reg_page_open'])
+        self.assertNotIn('reg_base_one', importlib.import_module('keywords').kw_func)
+        self.assertEqual(keywords['reg_base_two'](), 'two')
+        # reg_page imports reg_base, it is reloaded too
+        self.assertIsNot(keywords['reg_page_open'], page_open)
+        self.assertIs(keywords['reg_page_open'].__globals__['hello'], keywords['reg_base_hello'])
+
+    def test_import_error(self):
+        with self.assertRaises(ImportError):
+            self.registry.keywords('reg_missing')
+
+
+class KWCoreImportTest(unittest.TestCase):
+
+    def test_import_lib_keywords(self):
+        core = kw_runner.KWCore()
+        core._import('device')
+        self.assertIn('launch_app', core.kw_func)
+        # keywords of libs not imported by device are not exposed
+        self.assertNotIn('switch_tab', core.kw_func)
+        core._import('common')
+        self.assertIn('switch_tab', core.kw_func)
+        self.assertIs(importlib.import_module('keywords').var_cache['proxy'], kw_runner.device_proxy)
+
+    def test_keywords_module_keywords(self):
+        core = kw_runner.KWCore()
+        core.parse('import device\nactivate_mock "interface"')
+        self.assertIs(core.kw_lines[1].func, importlib.import_module('keywords').kw_func['activate_mock'])
@@ -1,5 +1,7 @@
 import unittest
-from uitester.test_manager import kw_runner
+import threading
+import importlib
+from uitester.test_manager import kw_runner, kw_cache, rpc_stats, context, reflection_proxy
 import time
 
 class Msg:
@@ -113,3 +115,342 @@ class KWRunnerTest(unittest.TestCase):
             time.sleep(0.5)
             time_count += 0.5
 
+
+
+class RecordListener:
+    def __init__(self):
+        self.msgs = []
+
+    def update(self, msg):
+        self.msgs.append(msg)
+
+    def errors(self):
+        return [msg for msg in self.msgs if msg.status == kw_runner.StatusMsg.ERROR]
+
+
+class KWCoreCompileTest(unittest.TestCase):
+
+    def setUp(self):
+        self.agent = Agent()
+        self.listener = RecordListener()
+        self.core = kw_runner.KWCore()
+        kw_cache.programs.clear()
+
+    def run_rows(self, program, rows):
+        for row in kw_runner.DataRow.from_list(['a', 'b'], rows):
+            self.core.reset()
+            self.core.load(program)
+            self.core.set_data(row)
+            self.core.execute(self.agent, self.listener)
+
+    def test_program_runs_all_rows(self):
+        program = self.core.compile('assert_equal $data.a $data.b\nassert_is_none $data.a as r', with_data=True)
+        self.assertEqual(self.core.kw_lines, [])
+        self.run_rows(program, [[1, 1], [1, 2], [None, None]])
+        errors = self.listener.errors()
+        self.assertEqual([msg.line_number for msg in errors], [2, 1])
+        self.assertEqual(len(program.lines), 2)
+        self.assertIsNone(self.core.kw_var['r'])
+
+    def test_parse_once(self):
+        parsed = []
+
+        class CountCore(kw_runner.KWCore):
+            def _parse_line(self, kw_line, line_number=0):
+                parsed.append(kw_line)
+                return super()._parse_line(kw_line, line_number)
+
+        program = CountCore().compile('assert_true $data.a\n\nassert_false $data.b', with_data=True)
+        self.run_rows(program, [[True, False]] * 10)
+        self.assertEqual(len(parsed), 2)
+        self.assertEqual(self.listener.errors(), [])
+
+    def test_compile_error(self):
+        with self.assertRaises(ValueError):
+            self.core.compile('assert_true 1\nnot_defined $x')
+        self.assertEqual(self.core.line_count, 2)
+
+
+class KWParseLineTest(unittest.TestCase):
+
+    def setUp(self):
+        self.core = kw_runner.KWCore()
+        self.core.kw_var['v'] = None
+
+    def test_tokens(self):
+        line = self.core._parse_line('enter_text $v "hello world" -12 $v.text abc"d e"f as r', line_number=3)
+        self.assertEqual(line.items, ['enter_text', '$v', 'hello world', -12, '$v.text', 'abcd ef'])
+        self.assertEqual([kind for kind, value in line.tokens],
+                         [kw_runner.TOKEN_WORD, kw_runner.TOKEN_VAR, kw_runner.TOKEN_STRING, kw_runner.TOKEN_INT,
+                          kw_runner.TOKEN_ATTR, kw_runner.TOKEN_STRING])
+        self.assertEqual((line.var, line.line_number), ('r', 3))
+
+    def test_quoted_int_and_as(self):
+        line = self.core._parse_line('check "12" "as"')
+        self.assertEqual(line.items, ['check', '12', 'as'])
+        self.assertIsNone(line.var)
+
+    def test_errors(self):
+        for script, message in [('check "abc', 'Missing quote. check "abc'),
+                                ('check $x', 'Var x not defined'),
+                                ('check $x.text', 'Var x.text not defined'),
+                                ('check as', 'Keywords "as" need one variable after it'),
+                                ('check as a b', 'Keywords "as" should only set one variable')]:
+            with self.assertRaises(ValueError) as cm:
+                self.core._parse_line(script)
+            self.assertEqual(cm.exception.args[0], message)
+
+
+class KWExecuteLineTest(unittest.TestCase):
+
+    def setUp(self):
+        kw_cache.programs.clear()
+        self.core = kw_runner.KWCore()
+        self.listener = RecordListener()
+
+    def test_slots(self):
+        self.core.kw_func['make'] = lambda text: kw_runner.DataRow.from_row(['text'], [text])
+        self.core.kw_func['echo'] = lambda *args: args
+        self.core.parse('make "hello world" as v\necho $v.text "$v" 3 $v as r')
+        line = self.core.kw_lines[1]
+        self.assertEqual(self.core.kw_var.slots, {'v': 0, 'r': 1})
+        self.assertEqual(line.var_slot, 1)
+        self.core.execute(Agent(), self.listener)
+        self.assertEqual(self.listener.errors(), [])
+        # quoted "$v" is a string, not a var
+        self.assertEqual(self.core.kw_var['r'][:3], ('hello world', '$v', 3))
+        self.assertIs(self.core.kw_var['r'][3], self.core.kw_var['v'])
+
+    def test_program_var_names_in_slot_order(self):
+        kw_vars = kw_runner.KWVars(['a', 'b', 'c'])
+        # dict order is arbitrary before python 3.6
+        kw_vars.slots = {'c': 2, 'a': 0, 'b': 1}
+        program = kw_runner.KWProgram([], {}, kw_vars, 0)
+        self.assertEqual(program.var_names, ('a', 'b', 'c'))
+
+    def test_rows_have_own_values(self):
+        program = self.core.compile('assert_true $data.a as r', with_data=True)
+        first, second = kw_runner.KWCore(), kw_runner.KWCore()
+        for core, value in [(first, 1), (second, 0)]:
+            core.load(program)
+            core.set_data(kw_runner.DataRow.from_row(['a'], [value]))
+            core.execute(Agent(), self.listener)
+        self.assertEqual(len(self.listener.errors()), 1)
+        self.assertEqual(first.kw_var.values[0].a, 1)
+        self.assertEqual(second.kw_var.values[0].a, 0)
+
+
+class ShardAgent(Agent):
+    def __init__(self, device_id):
+        super().__init__()
+        self.device_id = device_id
+        self.capabilities = {}
+        self.is_closed = False
+        self.dead_callbacks = []
+        self.stats = rpc_stats.RPCStats()
+
+    def close(self):
+        self.is_closed = True
+
+
+class ShardDeviceManager:
+    def __init__(self, device_ids):
+        self.agents = {device_id: ShardAgent(device_id) for device_id in device_ids}
+        # seconds before agent of device registers
+        self.delays = {}
+
+    def clear_agent(self, device):
+        pass
+
+    def wait_agent(self, device, timeout=None):
+        time.sleep(self.delays.get(device.id, 0))
+        return self.agents[device.id]
+
+
+class ShardRunner(kw_runner.KWRunner):
+    def _setup_agent(self, device):
+        pass
+
+
+class Device:
+    def __init__(self, device_id):
+        self.id = device_id
+
+
+class Case:
+    def __init__(self, case_id, content, data):
+        self.id = case_id
+        self.content = content
+        self.data = data
+
+
+class Recorder:
+    def __init__(self):
+        self.records = []
+
+    def add_record(self, case_id, device_id, start_time, status, **kwargs):
+        self.records.append((case_id, kwargs['data_row'], status))
+
+
+class RowOrderListenerTest(unittest.TestCase):
+
+    def msg(self, status, row, device_id='A'):
+        return kw_runner.StatusMsg(status, device_id=device_id, case_id=7, data_row=row)
+
+    def test_rows_forwarded_in_order(self):
+        listener = RecordListener()
+        recorder = Recorder()
+        ordered = kw_runner.RowOrderListener(listener, recorder)
+        StatusMsg = kw_runner.StatusMsg
+        ordered.update(self.msg(StatusMsg.CASE_START, 1, 'A'))
+        ordered.update(self.msg(StatusMsg.CASE_START, 2, 'B'))
+        ordered.update(self.msg(StatusMsg.ERROR, 2, 'B'))
+        ordered.update(self.msg(StatusMsg.CASE_END, 2, 'B'))
+        ordered.update(StatusMsg(StatusMsg.TEST_END, device_id='B'))
+        self.assertEqual(listener.msgs, [])
+
+        ordered.update(self.msg(StatusMsg.CASE_END, 1, 'A'))
+        self.assertEqual([(msg.status, msg.data_row) for msg in listener.msgs],
+                         [(101, 1), (102, 1), (101, 2), (500, 2), (102, 2), (2, 0)])
+        self.assertEqual(recorder.records, [(7, 1, 0), (7, 2, -1)])
+        self.assertEqual(ordered.results[7][2].device_id, 'B')
+
+    def test_flush(self):
+        listener = RecordListener()
+        ordered = kw_runner.RowOrderListener(listener)
+        ordered.update(self.msg(kw_runner.StatusMsg.CASE_START, 2))
+        ordered.update(self.msg(kw_runner.StatusMsg.CASE_END, 2))
+        self.assertEqual(listener.msgs, [])
+        ordered.flush()
+        self.assertEqual([msg.data_row for msg in listener.msgs], [2, 2])
+
+
+class KWRunnerShardTest(unittest.TestCase):
+
+    def setUp(self):
+        kw_cache.programs.clear()
+
+    def run_cases(self, cases, device_ids):
+        listener = RecordListener()
+        runner = ShardRunner(listener, ShardDeviceManager(device_ids), shard_rows=True, recorder=Recorder())
+        runner.execute(cases, [Device(device_id) for device_id in device_ids])
+        for _ in range(100):
+            if len([msg for msg in listener.msgs if msg.status == kw_runner.StatusMsg.TEST_END]) == len(device_ids):
+                break
+            time.sleep(0.05)
+        return listener, runner.recorder
+
+    def test_rows_run_once(self):
+        rows = [[i, i if i % 3 else -1] for i in range(1, 31)]
+        case = Case(1, 'assert_equal $data.a $data.b', [['a', 'b']] + rows)
+        listener, recorder = self.run_cases([case], ['A', 'B', 'C'])
+
+        starts = [msg for msg in listener.msgs if msg.status == kw_runner.StatusMsg.CASE_START]
+        self.assertEqual([msg.data_row for msg in starts], list(range(1, 31)))
+        self.assertEqual([row for case_id, row, status in recorder.records], list(range(1, 31)))
+        failed = [row for case_id, row, status in recorder.records if status != 0]
+        self.assertEqual(failed, [3, 6, 9, 12, 15, 18, 21, 24, 27, 30])
+        self.assertEqual([msg.data_row for msg in listener.errors()], failed)
+        # all rows are reported before last TEST_END
+        self.assertEqual(listener.msgs[-1].status, kw_runner.StatusMsg.TEST_END)
+
+    def test_dead_device_leaves_rows(self):
+        case = Case(3, 'assert_equal $data.a $data.b', [['a', 'b']] + [[i, i] for i in range(20)])
+        listener = RecordListener()
+        dm = ShardDeviceManager(['A', 'B'])
+        dm.agents['B'].is_closed = True
+        # dead B is ready first
+        dm.delays['A'] = 0.2
+        runner = ShardRunner(listener, dm, shard_rows=True, recorder=Recorder())
+        runner.execute([case], [Device('A'), Device('B')])
+        for _ in range(100):
+            if len([msg for msg in listener.msgs if msg.status == kw_runner.StatusMsg.TEST_END]) == 2:
+                break
+            time.sleep(0.05)
+        self.assertEqual([row for case_id, row, status in runner.recorder.records], list(range(1, 21)))
+        self.assertEqual({msg.device_id for msg in listener.msgs if msg.data_row}, {'A'})
+        self.assertEqual(listener.errors(), [])
+
+    def test_rows_fail_without_live_device(self):
+        case = Case(4, 'assert_true 1', [['a']] + [[i] for i in range(20)])
+        listener = RecordListener()
+        dm = ShardDeviceManager(['A'])
+        dm.agents['A'].is_closed = True
+        runner = ShardRunner(listener, dm, shard_rows=True, recorder=Recorder())
+        runner.execute([case], [Device('A')])
+        for _ in range(100):
+            if len(runner.recorder.records) == 20:
+                break
+            time.sleep(0.05)
+        self.assertEqual(runner.recorder.records, [(4, row, -1) for row in range(1, 21)])
+        self.assertEqual([msg.data_row for msg in listener.errors()], list(range(1, 21)))
+
+    def test_case_without_data_runs_on_every_device(self):
+        case = Case(2, 'assert_true 1', [])
+        listener, recorder = self.run_cases([case], ['A', 'B'])
+        ends = [msg for msg in listener.msgs if msg.status == kw_runner.StatusMsg.CASE_END]
+        self.assertEqual(sorted(msg.device_id for msg in ends), ['A', 'B'])
+        self.assertEqual(recorder.records, [])
+
+
+class ContextAgentTest(unittest.TestCase):
+
+    def test_var_cache_per_thread(self):
+        var_cache = importlib.import_module('keywords').var_cache
+        seen = {}
+
+        def run(solo):
+            var_cache['solo'] = solo
+            time.sleep(0.05)
+            seen[solo] = var_cache['solo']
+
+        threads = [threading.Thread(target=run, args=(name,)) for name in ('A', 'B')]
+        for t in threads:
+            t.start()
+        for t in threads:
+            t.join()
+        self.assertEqual(seen, {'A': 'A', 'B': 'B'})
+        # thread which never set solo gets the last one
+        self.assertIn(var_cache['solo'], ('A', 'B'))
+        del var_cache['solo']
+        self.assertNotIn('solo', var_cache)
+
+
+    def test_agent_per_thread(self):
+        seen = {}
+
+        def run(agent):
+            context.agent = agent
+            time.sleep(0.05)
+            seen[agent] = context.agent
+
+        threads = [threading.Thread(target=run, args=(name,)) for name in ('A', 'B')]
+        for t in threads:
+            t.start()
+        for t in threads:
+            t.join()
+        self.assertEqual(seen, {'A': 'A', 'B': 'B'})
+
+
+class KWDebugRunnerTest(unittest.TestCase):
+
+    def test_execute_on_new_thread(self):
+        context.agent = None
+        # no agent, nothing to release
+        reflection_proxy.release_handles()
+        agent = ShardAgent('A')
+        runner = kw_runner.KWDebugRunner(ShardDeviceManager(['A']), status_listener=RecordListener())
+        program = runner.core.compile('assert_true 1', with_data=True)
+        errors = []
+
+        def run():
+            try:
+                runner._execute(agent, program=program)
+            except Exception as e:
+                errors.append(e)
+
+        t = threading.Thread(target=run)
+        t.start()
+        t.join()
+        self.assertEqual(errors, [])
+        self.assertEqual(runner.listener.errors(), [])
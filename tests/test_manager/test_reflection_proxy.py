@@ -0,0 +1,406 @@
+import gc
+import unittest
+import socket
+from uitester.test_manager import rpc_server, rpc_agent, reflection_proxy, context
+
+
+class ReflectionAgent(rpc_agent.Agent):
+    """
+    Agent with a fake reflection api. Objects are dicts with hash and class_name, the agent counts every call.
+    """
+    def __init__(self, device_id, pipeline=True, typed_args=False):
+        super().__init__(device_id)
+        self.capabilities['typed_args'] = typed_args
+        self.calls = []
+        self.next_hash = 1000
+        self.plans = {}
+        for name in ('call', 'call_static', 'new', 'delete', 'get', 'set'):
+            self.add_func(name, self._reflection(name))
+        if pipeline:
+            self.capabilities['pipeline'] = True
+            self.capabilities['plans'] = True
+            self.add_func('pipeline', self.pipeline)
+            self.add_func('define_plan', self.define_plan)
+
+    def handle_call(self, call_obj):
+        if call_obj['name'] != 'run_plan':
+            return super().handle_call(call_obj)
+        plan_id, params = call_obj['args'][0], call_obj['args'][1:]
+        response = {'msg_type': 2, 'msg_id': call_obj['msg_id'], 'version': 1, 'name': 'response', 'args': []}
+        if plan_id not in self.plans:
+            response['name'] = 'Fail'
+            response['args'] = [reflection_proxy.PLAN_NOT_FOUND]
+            return response
+        steps = [[step[0]] + [params[ref_index(arg, reflection_proxy.PARAM)]
+                              if ref_index(arg, reflection_proxy.PARAM) is not None else arg
+                              for arg in step[1:]] for step in self.plans[plan_id]]
+        response['args'] = [self.pipeline(*steps)]
+        return response
+
+    def define_plan(self, plan_id, *steps):
+        self.plans[plan_id] = steps
+        return True
+
+    def _reflection(self, name):
+        def func(*args):
+            self.calls.append((name,) + args)
+            if name == 'delete':
+                return True
+            self.next_hash += 1
+            return {'hash': self.next_hash, 'class_name': 'java.lang.Object', 'remote_type': '04'}
+        return func
+
+    def pipeline(self, *steps):
+        results = []
+        for step in steps:
+            args = []
+            for arg in step[1:]:
+                index = ref_index(arg, reflection_proxy.SLOT)
+                if index is not None:
+                    result = results[index]
+                    if self.capabilities['typed_args']:
+                        arg = [reflection_proxy.OBJECT, result['hash'], result['class_name']]
+                    else:
+                        arg = '{}{}:{}'.format(reflection_proxy.OBJECT, result['hash'], result['class_name'])
+                args.append(arg)
+            results.append(self.real_func[step[0]](*args))
+        return results[-1]
+
+
+def ref_index(arg, code):
+    """
+    :return: index of a SLOT or PARAM arg in legacy or typed encoding, None for other args
+    """
+    if type(arg) == list and arg[0] == code:
+        return arg[1]
+    if type(arg) == str and arg.startswith(code):
+        return int(arg[2:])
+    return None
+
+
+class ArgEncodingTest(unittest.TestCase):
+
+    def test_legacy_args(self):
+        view = reflection_proxy.RemoteObject.from_dict({'hash': 12, 'class_name': 'android.view.View'})
+        self.assertEqual(
+            [reflection_proxy._make_arg(arg) for arg in ('text', 1, True, view)],
+            ['01text', '021', '06True', '0412:android.view.View'])
+        # null, long and double are only sent to agents with typed_args
+        for arg in ([1, 2], None, 1.5, reflection_proxy.RemoteObject.from_long(2 ** 40)):
+            with self.assertRaises(TypeError):
+                reflection_proxy._make_arg(arg)
+
+    def test_typed_args(self):
+        view = reflection_proxy.RemoteObject.from_dict({'hash': 12, 'class_name': 'android.view.View'})
+        points = reflection_proxy.RemoteObject.from_array(reflection_proxy.FLOAT, (1.0, 2.5))
+        self.assertEqual(
+            [reflection_proxy._make_typed_arg(arg) for arg in (1.5, None, 2 ** 40, view, points, ['a', view])],
+            [['11', 1.5], ['09'], ['10', 2 ** 40], ['04', 12, 'android.view.View'],
+             ['13', '05', [1.0, 2.5]], ['14', [['01', 'a'], ['04', 12, 'android.view.View']]]])
+        self.assertEqual(reflection_proxy._make_typed_arg(b'ab'), ['13', '12', b'ab'])
+
+    def test_libs_remote_object(self):
+        class LibRemoteObject:
+            def __init__(self, remote_type, **attrs):
+                self.remote_type = remote_type
+                self.__dict__.update(attrs)
+        self.assertEqual(reflection_proxy._make_arg(LibRemoteObject('06', value=False)), '06False')
+        self.assertEqual(reflection_proxy._make_typed_arg(LibRemoteObject('05', value=1)), ['05', 1.0])
+        with self.assertRaises(TypeError):
+            reflection_proxy._make_arg(LibRemoteObject('99'))
+        with self.assertRaises(TypeError):
+            reflection_proxy._make_arg(object())
+        # classes of libs are not kept, a reloaded lib has new classes
+        self.assertNotIn(LibRemoteObject, reflection_proxy._LEGACY_ENCODERS)
+        self.assertNotIn(LibRemoteObject, reflection_proxy._TYPED_ENCODERS)
+
+
+class ReflectionProxyTest(unittest.TestCase):
+
+    def setUp(self):
+        self.server = rpc_server.start(0)
+        self.test_agent = self.connect()
+
+    def tearDown(self):
+        self.disconnect(self.test_agent)
+        self.server.shutdown()
+        self.server.server_close()
+        reflection_proxy.clear_session_cache()
+
+    def connect(self):
+        test_agent = ReflectionAgent('device-reflection')
+        test_agent.start('localhost', self.server.server_address[1])
+        context.agent = self.server.wait_agent('device-reflection', timeout=5)
+        return test_agent
+
+    def disconnect(self, test_agent):
+        test_agent.sock.shutdown(socket.SHUT_RDWR)
+        test_agent.sock.close()
+
+    def wait_new_agent(self, old_agent):
+        while context.agent is old_agent or context.agent is None:
+            context.agent = self.server.wait_agent('device-reflection', timeout=5)
+
+    def test_session_cache(self):
+        registry = reflection_proxy.RemoteObject.from_class_name('android.support.test.InstrumentationRegistry')
+        first = reflection_proxy.remote_call_static_cached(registry, 'getInstrumentation')
+        first.class_name = 'android.app.Instrumentation'
+        second = reflection_proxy.remote_call_static_cached(registry, 'getInstrumentation')
+        self.assertEqual(len(self.test_agent.calls), 1)
+        self.assertEqual(second.hash, first.hash)
+        # cached object is not shared with callers
+        self.assertEqual(second.class_name, 'java.lang.Object')
+
+        reflection_proxy.remote_call_static(registry, 'getInstrumentation')
+        self.assertEqual(len(self.test_agent.calls), 2)
+
+    def test_session_cache_invalidated_on_reconnect(self):
+        registry = reflection_proxy.RemoteObject.from_class_name('android.support.test.InstrumentationRegistry')
+        reflection_proxy.remote_call_static_cached(registry, 'getInstrumentation')
+        old_agent = context.agent
+        self.disconnect(self.test_agent)
+        self.server.rm_agent('device-reflection')
+        self.test_agent = self.connect()
+        self.wait_new_agent(old_agent)
+        reflection_proxy.remote_call_static_cached(registry, 'getInstrumentation')
+        # new agent is asked again
+        self.assertEqual(len(self.test_agent.calls), 1)
+
+    def test_pipeline(self):
+        view = reflection_proxy.RemoteObject.from_dict({'hash': 1, 'class_name': 'android.view.View'})
+        chain = reflection_proxy.remote_ref(view).get_field('mSeekBarView').call('getProgress')
+        self.assertEqual(self.test_agent.calls, [])
+        progress = chain.value()
+        self.assertEqual(len(self.test_agent.calls), 2)
+        self.assertEqual(self.test_agent.calls[0], ('get', '041:android.view.View', '01mSeekBarView'))
+        # second step runs on the result of the first one
+        self.assertEqual(self.test_agent.calls[1][1], '04{}:java.lang.Object'.format(progress.hash - 1))
+        stats = context.agent.stats.snapshot()
+        self.assertEqual(stats['pipeline']['calls'], 1)
+        self.assertNotIn('get', stats)
+
+    def test_pipeline_ref_args(self):
+        solo = reflection_proxy.RemoteObject.from_dict({'hash': 1, 'class_name': 'com.robotium.solo.Solo'})
+        view = reflection_proxy.remote_ref(solo).call('getView', 'id-1')
+        reflection_proxy.remote_ref(solo).call('clickOnView', view).value()
+        self.assertEqual([call[2] for call in self.test_agent.calls], ['01getView', '01clickOnView'])
+        self.assertEqual(self.test_agent.calls[1][3], '04{}:java.lang.Object'.format(self.test_agent.next_hash - 1))
+
+    def test_plan(self):
+        @reflection_proxy.remote_plan
+        def click_id(plan, solo, view_id):
+            view = plan.call(solo, 'getView', view_id)
+            plan.call(solo, 'clickOnView', view)
+
+        solo = reflection_proxy.RemoteObject.from_dict({'hash': 1, 'class_name': 'com.robotium.solo.Solo'})
+        for view_id in ('id-1', 'id-2', 'id-3'):
+            click_id(solo, view_id)
+        self.assertEqual([call[3] for call in self.test_agent.calls if call[2] == '01getView'],
+                         ['01id-1', '01id-2', '01id-3'])
+        self.assertEqual(self.test_agent.calls[-1][3], '04{}:java.lang.Object'.format(self.test_agent.next_hash - 1))
+        if context.agent.capabilities.get('plans'):
+            stats = context.agent.stats.snapshot()
+            self.assertEqual(stats['define_plan']['calls'], 1)
+            self.assertEqual(stats['run_plan']['calls'], 3)
+
+            # agent lost its plans, plan is defined again
+            self.test_agent.plans.clear()
+            click_id(solo, 'id-4')
+            self.assertEqual(context.agent.stats.snapshot()['define_plan']['calls'], 2)
+        with self.assertRaises(TypeError):
+            click_id(solo)
+
+    def deleted(self):
+        return [call[1] for call in self.test_agent.calls if call[0] == 'delete']
+
+    def test_release_handles(self):
+        remote_class = reflection_proxy.RemoteObject.from_class_name('java.lang.Object')
+        dropped = reflection_proxy.remote_new(remote_class)
+        kept = reflection_proxy.remote_new(remote_class)
+        # libs wrappers share __dict__ of the remote object, see RemoteObject.from_object
+        wrapper = reflection_proxy.RemoteObject()
+        wrapper.__dict__ = kept.__dict__
+        dropped_arg = '04{}:java.lang.Object'.format(dropped.hash)
+        del dropped, kept
+        reflection_proxy.release_handles()
+        self.assertEqual(self.deleted(), [dropped_arg])
+
+        reflection_proxy.remote_delete(wrapper)
+        del wrapper
+        reflection_proxy.release_handles()
+        self.assertEqual(len(self.deleted()), 2)
+
+    def test_release_batch_size(self):
+        remote_class = reflection_proxy.RemoteObject.from_class_name('java.lang.Object')
+        for _ in range(reflection_proxy.RELEASE_BATCH_SIZE):
+            reflection_proxy.remote_new(remote_class)
+        self.assertEqual(self.deleted(), [])
+        reflection_proxy.remote_new(remote_class)
+        self.assertEqual(len(self.deleted()), reflection_proxy.RELEASE_BATCH_SIZE)
+        self.assertEqual(context.agent.stats.snapshot()['batch']['calls'], 1)
+
+    def test_release_by_hash(self):
+        # two calls returning the same java object
+        first = reflection_proxy._make_remote_object({'hash': 7, 'class_name': 'java.lang.Object'})
+        second = reflection_proxy._make_remote_object({'hash': 7, 'class_name': 'java.lang.Object'})
+        del first
+        reflection_proxy.release_handles()
+        self.assertEqual(self.deleted(), [])
+        del second
+        reflection_proxy.release_handles()
+        self.assertEqual(self.deleted(), ['047:java.lang.Object'])
+
+    def test_same_hash_back_after_release(self):
+        solo = reflection_proxy.RemoteObject.from_dict({'hash': 1, 'class_name': 'com.robotium.solo.Solo'})
+        # agent returns the same view object on every lookup
+        self.test_agent.next_hash = 122
+        first = reflection_proxy.remote_call(solo, 'getView', 'id-1')
+        del first
+        gc.collect()
+        self.test_agent.next_hash = 122
+        second = reflection_proxy.remote_call(solo, 'getView', 'id-1')
+        self.assertEqual(second.hash, 123)
+        reflection_proxy.release_handles()
+        self.assertEqual(self.deleted(), [])
+        del second
+        reflection_proxy.release_handles()
+        self.assertEqual(self.deleted(), ['04123:java.lang.Object'])
+
+    def test_cached_hash_never_released(self):
+        registry = reflection_proxy.RemoteObject.from_class_name('android.support.test.InstrumentationRegistry')
+        cached = reflection_proxy.remote_call_static_cached(registry, 'getInstrumentation')
+        same = reflection_proxy._make_remote_object({'hash': cached.hash, 'class_name': 'java.lang.Object'})
+        del same
+        reflection_proxy.release_handles()
+        self.assertEqual(self.deleted(), [])
+
+    def test_cached_results_pinned(self):
+        registry = reflection_proxy.RemoteObject.from_class_name('android.support.test.InstrumentationRegistry')
+        reflection_proxy.remote_call_static_cached(registry, 'getInstrumentation')
+        reflection_proxy.release_handles()
+        self.assertEqual(self.deleted(), [])
+
+
+class ReflectionProxyNoPipelineTest(ReflectionProxyTest):
+
+    def connect(self):
+        test_agent = ReflectionAgent('device-reflection', pipeline=False)
+        test_agent.start('localhost', self.server.server_address[1])
+        context.agent = self.server.wait_agent('device-reflection', timeout=5)
+        return test_agent
+
+    def test_pipeline(self):
+        view = reflection_proxy.RemoteObject.from_dict({'hash': 1, 'class_name': 'android.view.View'})
+        progress = reflection_proxy.remote_ref(view).get_field('mSeekBarView').call('getProgress').value()
+        self.assertEqual(self.test_agent.calls[1][1], '04{}:java.lang.Object'.format(progress.hash - 1))
+        self.assertEqual(context.agent.stats.snapshot()['call']['calls'], 1)
+
+
+class ReflectionProxyTypedArgsTest(unittest.TestCase):
+
+    def setUp(self):
+        self.server = rpc_server.start(0)
+        self.test_agent = ReflectionAgent('device-typed', typed_args=True)
+        self.test_agent.start('localhost', self.server.server_address[1])
+        context.agent = self.server.wait_agent('device-typed', timeout=5)
+
+    def tearDown(self):
+        self.test_agent.sock.shutdown(socket.SHUT_RDWR)
+        self.test_agent.sock.close()
+        self.server.shutdown()
+        self.server.server_close()
+        reflection_proxy.clear_session_cache()
+
+    def test_typed_call(self):
+        solo = reflection_proxy.RemoteObject.from_dict({'hash': 1, 'class_name': 'com.robotium.solo.Solo'})
+        reflection_proxy.remote_call(solo, 'drag', 1.0, 2.0, 300, None, [1, 2])
+        self.assertEqual(self.test_agent.calls[0],
+                         ('call', ['04', 1, 'com.robotium.solo.Solo'], ['01', 'drag'], ['11', 1.0], ['11', 2.0],
+                          ['02', 300], ['09'], ['14', [['02', 1], ['02', 2]]]))
+
+    def test_typed_plan(self):
+        @reflection_proxy.remote_plan
+        def click_id(plan, solo, view_id):
+            view = plan.call(solo, 'getView', view_id)
+            plan.call(solo, 'clickOnView', view)
+
+        solo = reflection_proxy.RemoteObject.from_dict({'hash': 1, 'class_name': 'com.robotium.solo.Solo'})
+        click_id(solo, 'id-1')
+        self.assertEqual(self.test_agent.calls[0][3], ['01', 'id-1'])
+        self.assertEqual(self.test_agent.calls[1][3], ['04', self.test_agent.next_hash - 1, 'java.lang.Object'])
+
+
+class LazyReflectionAgent(ReflectionAgent):
+    """
+    Agent which returns objects with hash and class_name only, other attrs are read by get_attrs.
+    getCurrentViews returns 3 TextViews as a multi args response.
+    """
+    def __init__(self, device_id):
+        super().__init__(device_id)
+        self.capabilities['lazy_attrs'] = True
+        self.add_func('get_attrs', self.get_attrs)
+
+    def get_attrs(self, obj, *names):
+        self.calls.append(('get_attrs', obj) + names)
+        attrs = {'text': 'text of {}'.format(obj), 'resource_id': 'id-1', 'class_name': 'android.view.View'}
+        if names:
+            return {name[2:]: attrs[name[2:]] for name in names}
+        return attrs
+
+    def handle_call(self, call_obj):
+        if call_obj['name'] != 'call' or call_obj['args'][1] != '01getCurrentViews':
+            return super().handle_call(call_obj)
+        self.calls.append(('call',) + tuple(call_obj['args']))
+        views = [{'hash': 2000 + i, 'class_name': 'android.widget.TextView'} for i in range(3)]
+        return {'msg_type': 2, 'msg_id': call_obj['msg_id'], 'version': 1, 'name': 'response', 'args': views}
+
+
+class ReflectionProxyLazyAttrsTest(unittest.TestCase):
+
+    def setUp(self):
+        self.server = rpc_server.start(0)
+        self.test_agent = LazyReflectionAgent('device-lazy')
+        self.test_agent.start('localhost', self.server.server_address[1])
+        context.agent = self.server.wait_agent('device-lazy', timeout=5)
+        self.solo = reflection_proxy.RemoteObject.from_dict({'hash': 1, 'class_name': 'com.robotium.solo.Solo'})
+
+    def tearDown(self):
+        self.test_agent.sock.shutdown(socket.SHUT_RDWR)
+        self.test_agent.sock.close()
+        self.server.shutdown()
+        self.server.server_close()
+        reflection_proxy.clear_session_cache()
+        reflection_proxy.PREFETCH_HINTS.clear()
+
+    def attr_calls(self):
+        return [call for call in self.test_agent.calls if call[0] == 'get_attrs']
+
+    def test_lazy_attr(self):
+        view = reflection_proxy.remote_call(self.solo, 'getView', 'id-1')
+        self.assertEqual(self.attr_calls(), [])
+        self.assertEqual(view.text, 'text of 04{}:java.lang.Object'.format(view.hash))
+        self.assertEqual(view.resource_id, 'id-1')
+        # fetched once, attrs set by host are kept
+        self.assertEqual(len(self.attr_calls()), 1)
+        self.assertEqual(view.class_name, 'java.lang.Object')
+        with self.assertRaises(AttributeError):
+            view.not_exist
+        self.assertEqual(len(self.attr_calls()), 1)
+
+    def test_prefetch(self):
+        views = reflection_proxy.remote_call(self.solo, 'getCurrentViews')
+        reflection_proxy.prefetch(views, 'text')
+        self.assertEqual([view.text for view in views],
+                         ['text of 04{}:android.widget.TextView'.format(view.hash) for view in views])
+        self.assertEqual(len(self.attr_calls()), 3)
+        self.assertEqual(context.agent.stats.snapshot()['reflection.get_attrs']['calls'], 1)
+        # attrs which are not prefetched are still lazy
+        self.assertEqual(views[0].resource_id, 'id-1')
+        self.assertEqual(len(self.attr_calls()), 4)
+
+    def test_prefetch_hint(self):
+        reflection_proxy.set_prefetch_hint('android.widget.TextView', 'text')
+        views = reflection_proxy.remote_call(self.solo, 'getCurrentViews')
+        self.assertEqual(len(self.attr_calls()), 3)
+        self.assertEqual(views[2].text, 'text of 04{}:android.widget.TextView'.format(views[2].hash))
+        self.assertEqual(len(self.attr_calls()), 3)
@@ -0,0 +1,436 @@
+import unittest
+import socket
+import json
+import time
+import asyncio
+import os
+import tempfile
+from threading import Thread
+from uitester.test_manager import rpc_server, rpc_agent, rpc_trace
+
+
+class RawAgent:
+    """
+    Socket agent which lets the test decide when and in which order responses are sent
+    """
+    def __init__(self, device_id, port):
+        self.device_id = device_id
+        self.sock = socket.create_connection(('localhost', port))
+        self.rfile = self.sock.makefile(mode='r')
+
+    def send(self, msg_dict):
+        self.sock.sendall((json.dumps(msg_dict) + '\n').encode())
+
+    def register(self):
+        self.send({'msg_type': 1, 'msg_id': 1, 'version': 1, 'name': 'register', 'args': [self.device_id]})
+        return json.loads(self.rfile.readline())
+
+    def read_call(self):
+        return json.loads(self.rfile.readline())
+
+    def respond(self, msg_id, *args):
+        self.send({'msg_type': 2, 'msg_id': msg_id, 'version': 1, 'name': 'response', 'args': list(args)})
+
+    def close(self):
+        self.rfile.close()
+        self.sock.close()
+
+
+def wait_for_agent(server, device_id, timeout=5):
+    agent = server.wait_agent(device_id, timeout=timeout)
+    if agent is None:
+        raise TimeoutError('agent {} not registered'.format(device_id))
+    return agent
+
+
+class RPCServerTest(unittest.TestCase):
+    mode = rpc_server.THREAD_MODE
+
+    def setUp(self):
+        self.server = rpc_server.start(0, mode=self.mode)
+        self.port = self.server.server_address[1]
+        self.raw_agent = RawAgent('device-1', self.port)
+        self.assertTrue(self.raw_agent.register()['args'][0])
+        self.agent = wait_for_agent(self.server, 'device-1')
+
+    def tearDown(self):
+        self.raw_agent.close()
+        self.server.shutdown()
+        self.server.server_close()
+
+    def test_wait_agent(self):
+        self.assertIsNone(self.server.wait_agent('device-2', timeout=0.1))
+        res = {}
+        t = Thread(target=lambda: res.update(agent=self.server.wait_agent('device-2', timeout=5)))
+        t.start()
+        raw_agent = RawAgent('device-2', self.port)
+        raw_agent.register()
+        t.join(5)
+        self.assertEqual(res['agent'].device_id, 'device-2')
+        raw_agent.close()
+
+    def test_old_connection_keeps_new_agent(self):
+        new_raw_agent = RawAgent('device-1', self.port)
+        new_raw_agent.register()
+        start = time.time()
+        while self.server.get_agent('device-1') is self.agent and time.time() - start < 5:
+            time.sleep(0.01)
+        new_agent = self.server.get_agent('device-1')
+        self.assertIsNot(new_agent, self.agent)
+        # old connection closed after the new agent registered
+        self.raw_agent.close()
+        time.sleep(0.2)
+        self.assertIs(self.server.get_agent('device-1'), new_agent)
+        new_raw_agent.close()
+
+    def test_responses_matched_by_msg_id(self):
+        first = self.agent.call_async('GetView', 'id-1')
+        second = self.agent.call_async('GetView', 'id-2')
+        calls = [self.raw_agent.read_call(), self.raw_agent.read_call()]
+        # answer in reverse order
+        for call in reversed(calls):
+            self.raw_agent.respond(call['msg_id'], call['args'][0])
+        self.assertEqual(self.agent.result(second, timeout=5).args, ['id-2'])
+        self.assertEqual(self.agent.result(first, timeout=5).args, ['id-1'])
+
+    def test_late_response_dropped(self):
+        with self.assertRaises(TimeoutError):
+            self.agent.call('GetView', 'slow', timeout=0.2)
+        self.assertEqual(self.agent.stats.snapshot()['GetView']['timeouts'], 1)
+        slow_call = self.raw_agent.read_call()
+
+        res = {}
+        t = Thread(target=lambda: res.update(msg=self.agent.call('GetView', 'fast', timeout=5)))
+        t.start()
+        fast_call = self.raw_agent.read_call()
+        self.raw_agent.respond(slow_call['msg_id'], 'slow')
+        self.raw_agent.respond(fast_call['msg_id'], 'fast')
+        t.join(5)
+        self.assertEqual(res['msg'].args, ['fast'])
+
+    def test_concurrent_callers(self):
+        results = {}
+
+        def caller(index):
+            results[index] = self.agent.call('Echo', index, timeout=5).args[0]
+
+        threads = [Thread(target=caller, args=(i,)) for i in range(5)]
+        for t in threads:
+            t.start()
+        for _ in threads:
+            call = self.raw_agent.read_call()
+            self.raw_agent.respond(call['msg_id'], call['args'][0])
+        for t in threads:
+            t.join(5)
+        self.assertEqual(results, {i: i for i in range(5)})
+
+    def test_batch_fallback_pipelines_calls(self):
+        res = {}
+        t = Thread(target=lambda: res.update(msgs=self.agent.call_batch([('GetView', 'a'), ('GetView', 'b')])))
+        t.start()
+        calls = [self.raw_agent.read_call(), self.raw_agent.read_call()]
+        self.assertEqual([call['msg_type'] for call in calls], [rpc_server.RPCMessage.RPC_CALL] * 2)
+        for call in calls:
+            self.raw_agent.respond(call['msg_id'], call['args'][0])
+        t.join(5)
+        self.assertEqual([msg.args for msg in res['msgs']], [['a'], ['b']])
+
+    def test_batch_fallback_timeout_drops_pending(self):
+        with self.assertRaises(TimeoutError):
+            self.agent.call_batch([('GetView', 'a'), ('GetView', 'b')], timeout=0.2)
+        self.assertEqual(self.agent._pending, {})
+
+    def test_acall(self):
+        async def call_both():
+            return await asyncio.gather(
+                self.agent.acall('GetView', 'a', timeout=5),
+                self.agent.acall('GetView', 'b', timeout=5))
+
+        res = {}
+        t = Thread(target=lambda: res.update(msgs=asyncio.new_event_loop().run_until_complete(call_both())))
+        t.start()
+        calls = [self.raw_agent.read_call(), self.raw_agent.read_call()]
+        for call in calls:
+            self.raw_agent.respond(call['msg_id'], call['args'][0])
+        t.join(5)
+        self.assertEqual(sorted(msg.args[0] for msg in res['msgs']), ['a', 'b'])
+
+
+class AsyncRPCServerTest(RPCServerTest):
+    mode = rpc_server.ASYNCIO_MODE
+
+
+class RPCTestAgentTest(unittest.TestCase):
+    mode = rpc_server.THREAD_MODE
+    framing = rpc_server.FRAMING_VERSIONS
+    codecs = ['compact', 'json']
+    compression = ['zlib']
+
+    def setUp(self):
+        self.server = rpc_server.start(0, mode=self.mode)
+        self.test_agent = rpc_agent.get_test_agent('device-batch')
+        self.test_agent.supported_framing = list(self.framing)
+        self.test_agent.supported_codecs = list(self.codecs)
+        self.test_agent.supported_compression = list(self.compression)
+        self.test_agent.add_func('Echo', lambda text: text)
+        self.test_agent.start('localhost', self.server.server_address[1])
+        self.agent = wait_for_agent(self.server, 'device-batch')
+
+    def tearDown(self):
+        self.test_agent.sock.shutdown(socket.SHUT_RDWR)
+        self.test_agent.sock.close()
+        self.server.shutdown()
+        self.server.server_close()
+
+    def test_batch_in_one_frame(self):
+        self.assertTrue(self.agent.capabilities.get('batch'))
+        results = self.agent.call_batch([('hello',), ('GetView', 'id-1'), ('NotFound',)], timeout=5)
+        self.assertEqual(len(results), 3)
+        self.assertEqual(results[0].args, [True])
+        self.assertEqual(results[1].args[0]['id'], 'id-1')
+        self.assertEqual(results[2].name, 'error')
+
+    def test_negotiated_framing(self):
+        self.assertEqual(self.agent.framing, max(self.framing))
+        if self.agent.framing == rpc_server.FRAMING_LENGTH:
+            self.assertEqual(self.agent.codec.name, self.test_agent.supported_codecs[0])
+        else:
+            self.assertEqual(self.agent.codec.name, 'json')
+
+    def test_large_payload(self):
+        text = '%n 100% \n line\n' * 20000
+        self.assertEqual(self.agent.call('Echo', text, timeout=5).args, [text])
+        self.assertEqual(self.agent.call('Echo', 'small', timeout=5).args, ['small'])
+
+    def test_oversized_frame_drops_connection(self):
+        if self.agent.framing != rpc_server.FRAMING_LENGTH:
+            return
+        self.test_agent.sock.sendall(rpc_server.FRAME_HEADER.pack(rpc_server.MAX_FRAME_SIZE + 1, 0))
+        start = time.time()
+        while not self.agent.is_closed and time.time() - start < 5:
+            time.sleep(0.05)
+        self.assertTrue(self.agent.is_closed)
+        self.assertIsNone(self.server.get_agent('device-batch'))
+
+    def test_call_stats(self):
+        self.agent.call('Echo', 'text', timeout=5)
+        self.agent.call('NotFound', timeout=5)
+        stats = self.server.stats_snapshot()['device-batch']
+        self.assertEqual(stats['Echo']['calls'], 1)
+        self.assertGreater(stats['Echo']['bytes_out'], 0)
+        self.assertGreater(stats['Echo']['bytes_in'], 0)
+        self.assertGreater(stats['Echo']['latency']['p50'], 0)
+        self.assertEqual(stats['NotFound']['errors'], 1)
+
+    def test_compression(self):
+        text = 'view tree ' * 10000
+        self.assertEqual(self.agent.call('Echo', text, timeout=5).args, [text])
+        self.agent.call('Echo', 'small', timeout=5)
+        stats = self.agent.compression_stats.snapshot()
+        if self.agent.framing == rpc_server.FRAMING_LENGTH:
+            # request and response of Echo were compressed
+            self.assertEqual(stats['Echo']['frames'], 2)
+            self.assertGreater(self.agent.compression_stats.saved_bytes('Echo'), len(text))
+        else:
+            self.assertEqual(stats, {})
+
+
+class RPCJsonCodecTest(RPCTestAgentTest):
+    codecs = ['json']
+
+
+class RPCLZMACompressionTest(RPCTestAgentTest):
+    compression = ['lzma']
+
+
+class RPCLineFramingTest(RPCTestAgentTest):
+    framing = [rpc_server.FRAMING_LINE]
+
+
+class AsyncRPCTestAgentTest(RPCTestAgentTest):
+    mode = rpc_server.ASYNCIO_MODE
+
+
+class AsyncRPCLineFramingTest(RPCTestAgentTest):
+    mode = rpc_server.ASYNCIO_MODE
+    framing = [rpc_server.FRAMING_LINE]
+
+
+class HeartbeatTest(unittest.TestCase):
+
+    def setUp(self):
+        self.server = rpc_server.start(0, heartbeat_interval=0.1, heartbeat_miss_count=2,
+                                       heartbeat_busy_miss_count=10)
+        self.test_agent = rpc_agent.get_test_agent('device-heartbeat')
+        self.test_agent.add_func('Sleep', lambda seconds: time.sleep(seconds))
+        self.test_agent.start('localhost', self.server.server_address[1])
+        self.agent = wait_for_agent(self.server, 'device-heartbeat')
+
+    def tearDown(self):
+        try:
+            self.test_agent.sock.shutdown(socket.SHUT_RDWR)
+        except OSError:
+            pass
+        self.test_agent.sock.close()
+        self.server.shutdown()
+        self.server.server_close()
+
+    def test_alive_agent(self):
+        time.sleep(0.5)
+        self.assertFalse(self.agent.is_closed)
+        self.assertTrue(self.agent.call('hello', timeout=5).args[0])
+
+    def test_dead_agent(self):
+        reasons = []
+        self.agent.dead_callbacks.append(reasons.append)
+        self.test_agent.respond_ping = False
+        start = time.time()
+        while not self.agent.is_closed and time.time() - start < 2:
+            time.sleep(0.05)
+        self.assertTrue(self.agent.is_closed)
+        self.assertEqual(len(reasons), 1)
+        self.assertIsNone(self.server.get_agent('device-heartbeat'))
+        with self.assertRaises(ConnectionError):
+            self.agent.call('hello')
+
+    def test_slow_call(self):
+        # agent answers pings after the call, longer than interval * miss_count but within busy budget
+        self.agent.call('Sleep', 0.5, timeout=5)
+        self.assertFalse(self.agent.is_closed)
+        self.assertTrue(self.agent.call('hello', timeout=5).args[0])
+
+    def test_hung_call_fails(self):
+        self.test_agent.respond_ping = False
+        msg_id = self.agent.call_async('Sleep', 3)
+        start = time.time()
+        with self.assertRaises(ConnectionError):
+            self.agent.result(msg_id, timeout=10)
+        self.assertLess(time.time() - start, 2.5)
+        self.assertIsNone(self.server.get_agent('device-heartbeat'))
+
+    def test_connection_lost_fails_pending_calls(self):
+        msg_id = self.agent.call_async('Sleep', 0.5)
+        self.test_agent.sock.shutdown(socket.SHUT_RDWR)
+        with self.assertRaises(ConnectionError):
+            self.agent.result(msg_id, timeout=5)
+
+
+class RecordReplayTest(unittest.TestCase):
+
+    def setUp(self):
+        fd, self.trace_path = tempfile.mkstemp(suffix='.trace')
+        os.close(fd)
+        self.servers = []
+        self.test_agents = []
+
+    def tearDown(self):
+        for test_agent in self.test_agents:
+            test_agent.sock.shutdown(socket.SHUT_RDWR)
+            test_agent.sock.close()
+        for server in self.servers:
+            server.shutdown()
+            server.server_close()
+        os.remove(self.trace_path)
+
+    def connect(self, test_agent):
+        server = rpc_server.start(0)
+        self.servers.append(server)
+        self.test_agents.append(test_agent)
+        test_agent.start('localhost', server.server_address[1])
+        return wait_for_agent(server, test_agent.device_id)
+
+    def test_record_and_replay(self):
+        test_agent = rpc_agent.get_test_agent('device-record')
+        test_agent.add_func('Sleep', lambda seconds: time.sleep(seconds) or seconds)
+        agent = self.connect(test_agent)
+        agent.start_recording(self.trace_path)
+        agent.call('GetView', 'id-1', timeout=5)
+        agent.call('Sleep', 0.2, timeout=5)
+        agent.call_batch([('hello',), ('GetView', 'id-2')], timeout=5)
+        agent.stop_recording()
+
+        records = rpc_trace.read_trace(self.trace_path)
+        self.assertEqual([record['name'] for record in records], ['GetView', 'Sleep', 'hello', 'GetView'])
+        self.assertGreaterEqual(records[1]['latency'], 0.2)
+
+        replay_agent = self.connect(rpc_agent.ReplayAgent('device-replay', self.trace_path, latency_scale=0.5))
+        self.assertEqual(replay_agent.call('GetView', 'id-2', timeout=5).args[0]['id'], 'id-2')
+        self.assertEqual(replay_agent.call('GetView', 'id-1', timeout=5).args[0]['id'], 'id-1')
+        start = time.time()
+        self.assertEqual(replay_agent.call('Sleep', 0.2, timeout=5).args, [0.2])
+        self.assertGreaterEqual(time.time() - start, 0.1)
+        self.assertEqual(replay_agent.call('NotRecorded', timeout=5).name, 'error')
+
+
+class SwarmTest(unittest.TestCase):
+
+    def setUp(self):
+        self.server = rpc_server.start(0)
+
+    def tearDown(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+    def test_thread_swarm(self):
+        report = rpc_agent.run_swarm(self.server, agent_count=4, duration=0.5, payload_size=1000, processes=0)
+        self.assertEqual(report['errors'], 0)
+        self.assertGreater(report['calls'], 4)
+        self.assertGreater(report['latency']['p99'], 0)
+        self.assertIn('calls/s', rpc_agent.format_swarm_report(report))
+
+    def test_process_swarm(self):
+        report = rpc_agent.run_swarm(self.server, agent_count=4, duration=0.5, think_time=0.01, processes=2)
+        self.assertEqual(report['errors'], 0)
+        self.assertGreater(report['calls_per_second'], 0)
+
+
+class EventTest(unittest.TestCase):
+
+    def setUp(self):
+        self.server = rpc_server.start(0)
+        self.test_agent = rpc_agent.get_test_agent('device-event')
+        self.test_agent.start('localhost', self.server.server_address[1])
+        self.agent = wait_for_agent(self.server, 'device-event')
+
+    def tearDown(self):
+        try:
+            self.test_agent.sock.shutdown(socket.SHUT_RDWR)
+        except OSError:
+            pass
+        self.test_agent.sock.close()
+        self.server.shutdown()
+        self.server.server_close()
+
+    def test_subscribe(self):
+        self.assertTrue(self.agent.supports_events)
+        with self.agent.subscribe('view_appeared', match=lambda data: data['text'] == 'OK') as subscription:
+            self.test_agent.push_event('view_appeared', {'text': 'Cancel'})
+            self.test_agent.push_event('toast_shown', {'text': 'OK'})
+            self.test_agent.push_event('view_appeared', {'text': 'OK', 'class_name': 'Button'})
+            self.assertEqual(subscription.wait(timeout=5)['class_name'], 'Button')
+
+    def test_wait_event_timeout(self):
+        start = time.time()
+        with self.assertRaises(TimeoutError):
+            self.agent.wait_event('toast_shown', timeout=0.2)
+        self.assertLess(time.time() - start, 1)
+
+    def test_replay_last_state(self):
+        with self.agent.subscribe('dialog') as subscription:
+            self.test_agent.push_event('dialog', {'open': True})
+            subscription.wait(timeout=5)
+        self.assertEqual(self.agent.wait_event('dialog', timeout=0, replay_last=True), {'open': True})
+        with self.assertRaises(TimeoutError):
+            self.agent.wait_event('dialog', match=lambda data: not data['open'], timeout=0.1, replay_last=True)
+
+    def test_await_event(self):
+        subscription = self.agent.subscribe('activity')
+        self.test_agent.push_event('activity', {'name': 'MainActivity'})
+        data = asyncio.new_event_loop().run_until_complete(subscription.await_event(timeout=5))
+        self.assertEqual(data['name'], 'MainActivity')
+
+    def test_dead_agent_fails_subscription(self):
+        subscription = self.agent.subscribe('activity')
+        self.test_agent.sock.shutdown(socket.SHUT_RDWR)
+        with self.assertRaises(ConnectionError):
+            subscription.wait(timeout=5)
@@ -0,0 +1,43 @@
+import unittest
+import json
+from uitester.test_manager import rpc_codec
+
+
+class CompactCodecTest(unittest.TestCase):
+
+    def setUp(self):
+        self.codec = rpc_codec.get_codec('compact')
+
+    def test_round_trip(self):
+        obj = {
+            'msg_type': 2,
+            'msg_id': 70000,
+            'name': 'response',
+            'args': [None, True, False, -1, -200, 2 ** 40, -2 ** 40, 1.5, '', 'x' * 40, 'y' * 300,
+                     '中文', [], [1] * 20, {'k' + str(i): i for i in range(20)}, 'z' * 70000],
+        }
+        self.assertEqual(self.codec.loads(self.codec.dumps(obj)), obj)
+
+    def test_tuple_and_bytes(self):
+        self.assertEqual(self.codec.loads(self.codec.dumps((1, 'a'))), [1, 'a'])
+        self.assertEqual(self.codec.loads(self.codec.dumps(b'\x00\x01' * 200)), b'\x00\x01' * 200)
+
+    def test_repeated_keys_interned(self):
+        views = [{'hash': 123456 + i, 'class_name': 'android.widget.TextView',
+                  'resource_id': 'com.ifeng.newvideo:id/title', 'remote_type': '04'} for i in range(50)]
+        obj = {'msg_type': 2, 'msg_id': 1, 'name': 'response', 'args': views}
+        payload = self.codec.dumps(obj)
+        self.assertEqual(self.codec.loads(payload), obj)
+        self.assertLess(len(payload), len(json.dumps(obj).encode()) * 0.7)
+
+    def test_memoryview_payload(self):
+        payload = self.codec.dumps({'a': [1, 2]})
+        self.assertEqual(self.codec.loads(memoryview(bytearray(payload))), {'a': [1, 2]})
+
+    def test_unsupported_type(self):
+        with self.assertRaises(TypeError):
+            self.codec.dumps(object())
+
+    def test_registry(self):
+        self.assertIs(rpc_codec.get_codec('json'), rpc_codec.JSON)
+        self.assertIsNone(rpc_codec.get_codec('unknown'))
@@ -0,0 +1,47 @@
+import unittest
+from uitester.test_manager import rpc_stats
+
+
+class LatencyHistogramTest(unittest.TestCase):
+
+    def test_percentiles(self):
+        histogram = rpc_stats.LatencyHistogram()
+        for ms in range(1, 101):
+            histogram.record(ms / 1000)
+        snapshot = histogram.snapshot()
+        self.assertEqual(snapshot['count'], 100)
+        # bucket error is below 1 / SUB_BUCKETS
+        self.assertAlmostEqual(snapshot['p50'], 0.050, delta=0.050 / rpc_stats.SUB_BUCKETS)
+        self.assertAlmostEqual(snapshot['p99'], 0.099, delta=0.099 / rpc_stats.SUB_BUCKETS)
+        self.assertEqual(snapshot['max'], 0.1)
+        self.assertEqual(snapshot['min'], 0.001)
+
+    def test_wide_range(self):
+        histogram = rpc_stats.LatencyHistogram()
+        histogram.record(0.000001)
+        histogram.record(100)
+        self.assertEqual(histogram.percentile(50), 0.000001)
+        self.assertEqual(histogram.percentile(100), 100)
+        self.assertLess(len(histogram.counts), 3)
+
+    def test_empty(self):
+        self.assertEqual(rpc_stats.LatencyHistogram().snapshot()['p99'], 0)
+
+
+class RPCStatsTest(unittest.TestCase):
+
+    def test_timer(self):
+        stats = rpc_stats.RPCStats()
+        with stats.timer('ok'):
+            pass
+        with self.assertRaises(TimeoutError):
+            with stats.timer('slow'):
+                raise TimeoutError()
+        with self.assertRaises(ValueError):
+            with stats.timer('fail'):
+                raise ValueError()
+        snapshot = stats.snapshot()
+        self.assertEqual((snapshot['ok']['calls'], snapshot['ok']['errors']), (1, 0))
+        self.assertEqual(snapshot['slow']['timeouts'], 1)
+        self.assertEqual(snapshot['fail']['errors'], 1)
+        self.assertIn('slow', rpc_stats.format_snapshot(snapshot))
@@ -1,9 +1,23 @@
+import os
+import shutil
+import tempfile
 import unittest
-from uitester.test_manager import tester
+from uitester.test_manager import tester, kw_cache
 
 
 class TesterTest(unittest.TestCase):
 
+    def setUp(self):
+        self.tmp_dir = tempfile.mkdtemp()
+        self.old_cache_file = tester.kw_cache_file
+        self.old_programs = kw_cache.programs
+        tester.kw_cache_file = os.path.join(self.tmp_dir, 'kw_cache.json')
+
+    def tearDown(self):
+        tester.kw_cache_file = self.old_cache_file
+        kw_cache.programs = self.old_programs
+        shutil.rmtree(self.tmp_dir)
+
     def test_debug(self):
         t = tester.Tester()
         _debug = t.get_debug_runner()
@@ -0,0 +1,114 @@
+import unittest
+import socket
+from uitester.test_manager import rpc_server, rpc_agent, device_proxy, reflection_proxy, view_tree, context
+
+
+class ViewTreeTest(unittest.TestCase):
+
+    def setUp(self):
+        self.tree = view_tree.ViewTree.from_response(rpc_agent.get_view_tree())
+
+    def test_index(self):
+        self.assertEqual(self.tree.find_by_id('id-1').hash, 1001)
+        self.assertEqual(self.tree.find_by_class('android.widget.TextView', 1).hash, 1003)
+        self.assertEqual(self.tree.find_by_text('Item').hash, 1003)
+        self.assertEqual(self.tree.find_by_text('Ite', contains=True).hash, 1003)
+        self.assertIsNone(self.tree.find_by_id('id-1', 1))
+        self.assertIsNone(self.tree.find_by_id('not-exist'))
+
+    def test_parent(self):
+        list_view = self.tree.find_by_id('list')
+        self.assertEqual(self.tree.find_by_class('android.widget.TextView', parent=list_view).hash, 1003)
+        self.assertIsNone(self.tree.find_by_id('id-1', parent=list_view))
+        self.assertEqual([child.hash for child in self.tree.get(1000).children], [1001, 1002])
+
+    def test_shown(self):
+        # visible, but parent list is not
+        self.assertFalse(self.tree.get(1003).is_shown)
+        self.assertTrue(self.tree.get(1001).is_shown)
+        self.assertIsNone(self.tree.find_by_text('Item', shown_only=True))
+
+
+class ViewTreeSnapshotTest(unittest.TestCase):
+
+    def setUp(self):
+        self.server = rpc_server.start(0)
+        self.test_agent = rpc_agent.get_test_agent('device-view-tree')
+        self.tree_calls = []
+        self.test_agent.add_func('GetViewTree', self.get_view_tree)
+        self.test_agent.start('localhost', self.server.server_address[1])
+        context.agent = self.server.wait_agent('device-view-tree', timeout=5)
+
+    def tearDown(self):
+        self.test_agent.sock.shutdown(socket.SHUT_RDWR)
+        self.test_agent.sock.close()
+        self.server.shutdown()
+        self.server.server_close()
+
+    def get_view_tree(self):
+        self.tree_calls.append(True)
+        return rpc_agent.get_view_tree()
+
+    def test_queries_share_snapshot(self):
+        view = device_proxy.get_view('id-1')
+        self.assertEqual((view.hash, view.text), (1001, 'Hello'))
+        list_view = device_proxy.get_view('list')
+        self.assertEqual(device_proxy.find_view_by_id(list_view, 'title').hash, 1003)
+        self.assertEqual(len(self.tree_calls), 1)
+
+    def test_not_in_snapshot(self):
+        # agent waits for views which are not on screen yet
+        self.assertEqual(device_proxy.get_view('id-2').hash, 123456)
+
+    def test_invalidate_on_action(self):
+        view = device_proxy.get_view('id-1')
+        device_proxy.click_on_view(view)
+        device_proxy.get_view('id-1')
+        self.assertEqual(len(self.tree_calls), 2)
+
+    def test_invalidate_on_mutating_reflection_call(self):
+        self.test_agent.add_func('call', lambda *args: True)
+        device_proxy.get_view_tree()
+        view = reflection_proxy.RemoteObject.from_dict({'hash': 1001, 'class_name': 'android.widget.TextView'})
+        reflection_proxy.remote_call(view, 'getText')
+        device_proxy.get_view_tree()
+        self.assertEqual(len(self.tree_calls), 1)
+        reflection_proxy.remote_call(view, 'performClick')
+        device_proxy.get_view_tree()
+        self.assertEqual(len(self.tree_calls), 2)
+
+    def test_invalidate_on_mutating_batch(self):
+        self.test_agent.add_func('call', lambda *args: True)
+        device_proxy.get_view_tree()
+        view = reflection_proxy.RemoteObject.from_dict({'hash': 1001, 'class_name': 'android.widget.TextView'})
+        version = context.agent.ui_version
+        reflection_proxy.remote_batch(('call', view, 'performClick'), ('call', view, 'getText'))
+        self.assertEqual(context.agent.ui_version, version + 1)
+        device_proxy.get_view_tree()
+        self.assertEqual(len(self.tree_calls), 2)
+
+    def test_invalidate_on_event(self):
+        device_proxy.get_view_tree()
+        with context.agent.subscribe('activity') as subscription:
+            self.test_agent.push_event('activity', {'name': 'MainActivity'})
+            subscription.wait(5)
+        device_proxy.get_view_tree()
+        self.assertEqual(len(self.tree_calls), 2)
+
+    def test_unsupported(self):
+        context.agent.capabilities['view_tree'] = False
+        self.assertIsNone(device_proxy.get_view_tree())
+        self.assertEqual(device_proxy.get_view('id-1').hash, 123456)
+
+    def test_lazy_view(self):
+        context.agent.capabilities['view_tree'] = False
+        context.agent.capabilities['lazy_attrs'] = True
+        attr_calls = []
+        self.test_agent.add_func('GetView', lambda view_id: {'hash': 1001, 'class': 'android.widget.TextView'})
+        self.test_agent.add_func('GetAttrs', lambda view_hash: attr_calls.append(view_hash) or {'text': 'Hello'})
+        view = device_proxy.get_view('id-1')
+        self.assertEqual(attr_calls, [])
+        self.assertEqual(view.text, 'Hello')
+        with self.assertRaises(AttributeError):
+            view.bounds
+        self.assertEqual(attr_calls, [1001])
@@ -17,6 +17,19 @@ class Config:
         self.target_package = "com.ifeng.at.testagent"
         self.libs = os.path.abspath(os.path.join(app_dir, 'libs'))
         self.port = 11800
+        # rpc server mode: 'thread' or 'asyncio'
+        self.rpc_server_mode = 'thread'
+        # agent heartbeat interval in seconds, 0 to disable
+        self.heartbeat_interval = 5
+        self.heartbeat_miss_count = 3
+        # pings an agent may miss while a call is running, agent may answer pings after the call
+        self.heartbeat_busy_miss_count = 12
+        # max compiled kw scripts kept in memory, see kw_cache
+        self.parse_cache_size = 256
+        # save compiled kw scripts to kw_cache.json, next to casetest.db
+        self.persist_parse_cache = True
+        # run each data row of a case once on the first idle selected device, instead of all rows on every device
+        self.shard_data_rows = False
         self.images = os.path.abspath(os.path.join(app_dir, 'images'))
 
     @classmethod
@@ -1,9 +1,30 @@
+import sys
 import threading
+import types
 
 local_context = threading.local()
 local_context.agent = None
 
-agent = local_context.agent
+
+class _ContextModule(types.ModuleType):
+    """
+    context.agent is per thread, every device runs cases in its own thread.
+    A thread which never set agent gets the last agent set by any thread.
+    """
+    _shared_agent = None
+
+    @property
+    def agent(self):
+        agent = getattr(local_context, 'agent', None)
+        return agent if agent is not None else _ContextModule._shared_agent
+
+    @agent.setter
+    def agent(self, agent):
+        local_context.agent = agent
+        _ContextModule._shared_agent = agent
+
+
+sys.modules[__name__].__class__ = _ContextModule
 
 
 class Context:
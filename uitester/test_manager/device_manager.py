@@ -1,5 +1,6 @@
 from uitester.test_manager import adb
 from uitester.test_manager import rpc_server
+from uitester.test_manager import reflection_proxy
 from threading import Thread
 from queue import Queue
 
@@ -76,8 +77,41 @@ class DeviceManager:
         else:
             device.status = Device.OFFLINE
 
+    def wait_agent(self, device, timeout=None):
+        """
+        Wait for the agent of device to register on rpc server.
+        :return: agent, None if timeout
+        """
+        agent = self.server.wait_agent(device.id, timeout=timeout)
+        device.agent = agent
+        return agent
+
+    def clear_agent(self, device):
+        """
+        Forget the registered agent of device, a new agent is going to register.
+        """
+        device.agent = None
+        reflection_proxy.clear_session_cache(device.id)
+        if self.server:
+            self.server.rm_agent(device.id)
+
+    def rpc_stats(self):
+        """
+        :return: rpc call stats of all devices, {device_id: {method: stats dict}}
+        """
+        if self.server is None:
+            return {}
+        return self.server.stats_snapshot()
+
     def start_rpc_server(self):
-        self.server = rpc_server.get_server(self.context.config.port)
+        conf = self.context.config
+        self.server = rpc_server.get_server(
+            conf.port,
+            mode=conf.rpc_server_mode,
+            heartbeat_interval=conf.heartbeat_interval,
+            heartbeat_miss_count=conf.heartbeat_miss_count,
+            heartbeat_busy_miss_count=conf.heartbeat_busy_miss_count
+        )
         self.server_thread = Thread(target=self.server.serve_forever, daemon=True)
         self.server_thread.start()
 
@@ -1,32 +1,81 @@
 import logging
 from uitester.test_manager import context
+from uitester.test_manager import view_tree
+from uitester.test_manager.reflection_proxy import LAZY_KEY, lazy_attr
 
 logger = logging.getLogger('Tester')
 
 
 class View:
-    pass
+    """
+    View returned by agent. Agent with lazy_attrs capability only returns hash and class,
+    other attrs are fetched by GetAttrs on first access.
+    """
+    def __getattr__(self, name):
+        return lazy_attr(self, name, fetch=_fetch_view_attrs)
+
+
+def _fetch_view_attrs(view):
+    attrs = view.__dict__
+    response = context.agent.call('GetAttrs', attrs['hash'])
+    if response.name == 'Fail':
+        raise ValueError(*response.args)
+    for key, value in (response.args[0] if response.args else {}).items():
+        attrs.setdefault(key, value)
+    attrs.pop(LAZY_KEY)
+
+
+def _make_view(view_dict):
+    v = View()
+    v.__dict__ = view_dict
+    if 'hash' in view_dict and getattr(context.agent, 'capabilities', {}).get('lazy_attrs'):
+        view_dict[LAZY_KEY] = True
+    return v
+
+
+def _view_of_node(node):
+    v = View()
+    v.__dict__ = {
+        'id': node.resource_id,
+        'class': node.class_name,
+        'text': node.text,
+        'hash': node.hash,
+        'bounds': node.bounds,
+        'visible': node.visible
+    }
+    return v
+
+
+def get_view_tree(refresh=False):
+    """
+    Snapshot of current window view hierarchy, None if agent doesn't support it
+    :param refresh: fetch a new snapshot even if the cached one is still valid
+    :return: view_tree.ViewTree
+    """
+    return view_tree.get_view_tree(refresh=refresh)
 
 
 def get_view(view_id):
     """
     Get view by android id
+    Answered from view tree snapshot if view is in it, otherwise agent waits for the view.
     e.g.
     get_view android:id/list as v
 
     :param view_id:
     :return:view
     """
+    tree = view_tree.get_view_tree()
+    node = tree.find_by_id(view_id) if tree else None
+    if node:
+        return _view_of_node(node)
     response = context.agent.call('GetView', view_id)
     if response.name == 'Fail':
         raise ValueError(*response.args)
     if len(response.args) == 0:
         return None
 
-    view_dict = response.args[0]
-    v = View()
-    v.__dict__ = view_dict
-    return v
+    return _make_view(response.args[0])
 
 
 def launch_app(package_name):
@@ -35,6 +84,7 @@ def launch_app(package_name):
     :param package_name:
     :return:
     """
+    view_tree.invalidate()
     response = context.agent.call('LaunchApp', package_name)
     if response.name == 'Fail':
         raise ValueError(*response.args)
@@ -49,6 +99,7 @@ def finish_app():
     Finish all activity
     :return:
     """
+    view_tree.invalidate()
     response = context.agent.call('FinishActivity')
     if response.name == 'Fail':
         raise ValueError(*response.args)
@@ -65,6 +116,7 @@ def click_on_text(text):
     :param text:
     :return:
     """
+    view_tree.invalidate()
     response = context.agent.call('ClickOnText', text)
     if response.name == 'Fail':
         raise ValueError(*response.args)
@@ -82,6 +134,7 @@ def enter_text(view, text):
     :param text:
     :return:
     """
+    view_tree.invalidate()
     response = context.agent.call('EnterText', view.hash, text)
     if response.name == 'Fail':
         raise ValueError(*response.args)
@@ -112,6 +165,7 @@ def click_on_view(view):
     :param view:
     :return:
     """
+    view_tree.invalidate()
     response = context.agent.call('ClickOnView', view.hash)
     if response.name == 'Fail':
         raise ValueError(*response.args)
@@ -134,10 +188,7 @@ def get_list_item(view, index):
     if len(response.args) == 0:
         return None
 
-    view_dict = response.args[0]
-    v = View()
-    v.__dict__ = view_dict
-    return v
+    return _make_view(response.args[0])
 
 
 def load_more(view):
@@ -146,6 +197,7 @@ def load_more(view):
     :param view:
     :return:
     """
+    view_tree.invalidate()
     response = context.agent.call('LoadMore', view.hash)
     if response.name == 'Fail':
         raise ValueError(*response.args)
@@ -160,6 +212,7 @@ def refresh_content(view):
     :param view:
     :return:
     """
+    view_tree.invalidate()
     response = context.agent.call('RefreshContent', view.hash)
     if response.name == 'Fail':
         raise ValueError(*response.args)
@@ -175,16 +228,18 @@ def find_view_by_id(parent_view, view_id):
     :param view_id:
     :return:
     """
+    tree = view_tree.get_view_tree()
+    parent = tree.get(parent_view.hash) if tree else None
+    node = tree.find_by_id(view_id, parent=parent) if parent else None
+    if node:
+        return _view_of_node(node)
     response = context.agent.call('FindViewById', parent_view.hash, view_id)
     if response.name == 'Fail':
         raise ValueError(*response.args)
     if len(response.args) == 0:
         return None
 
-    view_dict = response.args[0]
-    v = View()
-    v.__dict__ = view_dict
-    return v
+    return _make_view(response.args[0])
 
 
 def switch_to_tab(view, index):
@@ -194,6 +249,7 @@ def switch_to_tab(view, index):
     :param index:
     :return:
     """
+    view_tree.invalidate()
     response = context.agent.call('SwitchToTab', view.hash, index)
     if response.name == 'Fail':
         raise ValueError(*response.args)
@@ -213,10 +269,7 @@ def get_list_count(view):
         raise ValueError(*response.args)
     if len(response.args) == 0:
         return None
-    view_dict = response.args[0]
-    v = View()
-    v.__dict__ = view_dict
-    return v
+    return _make_view(response.args[0])
 
 
 
@@ -226,6 +279,7 @@ def change_video_state(player_name, state):
     :param state: play or pause
     :return:
     """
+    view_tree.invalidate()
     response = context.agent.call('ChangeVideoState', player_name, state)
     if response.name == 'Fail':
         raise ValueError(*response.args)
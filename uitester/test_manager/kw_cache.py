@@ -0,0 +1,109 @@
+"""
+LRU cache of compiled keywords scripts, see KWCore.compile.
+Key is a hash of script text and mtimes of the imported libs, so a changed script or lib is parsed again.
+Cache can be saved to a json file and loaded at next start, entries loaded from file are plain dicts
+(KWProgram.to_dict) until first use.
+"""
+import os
+import json
+import logging
+from collections import OrderedDict
+from threading import Lock
+
+logger = logging.getLogger('Tester')
+
+DEFAULT_SIZE = 256
+# bump when KWProgram.to_dict changes, older cache files are ignored
+FORMAT_VERSION = 2
+
+
+class ProgramCache:
+
+    def __init__(self, size=DEFAULT_SIZE, path=None):
+        self.size = size
+        self.path = path
+        self.hits = 0
+        self.misses = 0
+        self._entries = OrderedDict()
+        self._dirty = False
+        self._lock = Lock()
+        if path:
+            self.load()
+
+    def get(self, key):
+        """
+        :return: KWProgram, its dict if loaded from file, None if not cached
+        """
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return entry
+
+    def put(self, key, program):
+        with self._lock:
+            self._entries[key] = program
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.size:
+                self._entries.popitem(last=False)
+            self._dirty = True
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self._dirty = True
+
+    def __len__(self):
+        return len(self._entries)
+
+    def load(self):
+        if not os.path.exists(self.path):
+            return
+        try:
+            with open(self.path, 'r', encoding='utf-8') as f:
+                data = json.load(f)
+        except (OSError, ValueError) as e:
+            logger.warning('Load kw parse cache {} fail: {}'.format(self.path, e))
+            return
+        if data.get('version') != FORMAT_VERSION:
+            return
+        with self._lock:
+            for key, entry in data['programs']:
+                self._entries[key] = entry
+            while len(self._entries) > self.size:
+                self._entries.popitem(last=False)
+
+    def save(self):
+        """
+        Write cache to its file if it changed. No op for a memory only cache
+        """
+        with self._lock:
+            if not self.path or not self._dirty:
+                return
+            programs = [[key, entry if type(entry) == dict else entry.to_dict()]
+                        for key, entry in self._entries.items()]
+            self._dirty = False
+        tmp_path = self.path + '.tmp'
+        try:
+            with open(tmp_path, 'w', encoding='utf-8') as f:
+                json.dump({'version': FORMAT_VERSION, 'programs': programs}, f, ensure_ascii=False)
+            os.replace(tmp_path, self.path)
+        except (OSError, TypeError, ValueError) as e:
+            logger.warning('Save kw parse cache {} fail: {}'.format(self.path, e))
+
+
+# process wide cache used by KWCore.compile
+programs = ProgramCache()
+
+
+def configure(size=DEFAULT_SIZE, path=None):
+    """
+    Replace the process wide cache
+    :param path: json file to persist the cache, memory only if None
+    """
+    global programs
+    programs = ProgramCache(size, path)
+    return programs
@@ -0,0 +1,148 @@
+"""
+Process wide registry of keyword libraries in libs dir.
+Every lib is imported once, its keywords are the @keyword functions defined in it.
+A lib is reloaded when its file changes, or when a lib it imports is reloaded,
+so editor and runners pick up changed libs without restart.
+keywords.py itself is never reloaded, it holds var_cache and the keyword decorator,
+its keywords are exposed by every import.
+"""
+import os
+import sys
+import importlib
+from threading import RLock
+
+
+class _Library:
+
+    def __init__(self, module, mtime, keywords, deps, generation):
+        self.module = module
+        self.mtime = mtime
+        # keyword name -> function defined in this lib
+        self.keywords = keywords
+        # names of libs in libs dir imported by this lib
+        self.deps = deps
+        # increases on every load, a lib is reloaded when generation of one of its deps changed
+        self.generation = generation
+        self.dep_generations = None
+
+
+class LibraryRegistry:
+
+    def __init__(self, libs_dir, var_cache=None):
+        """
+        :param var_cache: values set to keywords.var_cache once, e.g. rpc proxies
+        """
+        self.libs_dir = os.path.abspath(libs_dir)
+        self.var_cache = var_cache or {}
+        self._libs = {}
+        self._generation = 0
+        self._kw = None
+        self._base_keywords = {}
+        self._lock = RLock()
+
+    def keywords(self, module_name):
+        """
+        :return: keywords of keywords.py, lib module_name and the libs it imports, name -> function
+        """
+        with self._lock:
+            self._keywords_module()
+            res = dict(self._base_keywords)
+            for name in self._closure(module_name):
+                res.update(self._libs[name].keywords)
+            return res
+
+    def mtimes(self, module_name):
+        """
+        :return: [(lib name, mtime)] of lib module_name and the libs it imports
+        """
+        with self._lock:
+            return [(name, self._libs[name].mtime) for name in sorted(self._closure(module_name))]
+
+    def _closure(self, module_name):
+        names = []
+        self._load(module_name, names, set())
+        return names
+
+    def _load(self, module_name, names, visiting):
+        """
+        Load lib and its deps if not loaded or changed, add their names to names
+        """
+        if module_name in visiting:
+            return
+        visiting.add(module_name)
+        lib = self._libs.get(module_name)
+        if lib is None:
+            lib = self._import(module_name)
+        else:
+            for dep in lib.deps:
+                self._load(dep, names, visiting)
+            if _mtime(lib.module) != lib.mtime or self._dep_generations(lib) != lib.dep_generations:
+                lib = self._reload(module_name, lib)
+        for dep in lib.deps:
+            self._load(dep, names, visiting)
+        if lib.dep_generations is None:
+            lib.dep_generations = self._dep_generations(lib)
+        names.append(module_name)
+
+    def _dep_generations(self, lib):
+        return {dep: self._libs[dep].generation for dep in lib.deps if dep in self._libs}
+
+    def _keywords_module(self):
+        if self._kw is None:
+            kw = importlib.import_module('keywords')
+            kw.var_cache.update(self.var_cache)
+            self._base_keywords = {name: func for name, func in kw.kw_func.items()
+                                   if getattr(func, '__module__', None) == 'keywords'}
+            self._kw = kw
+        return self._kw
+
+    def _import(self, module_name):
+        self._keywords_module()
+        module = importlib.import_module(module_name)
+        return self._register(module_name, module)
+
+    def _reload(self, module_name, lib):
+        kw = self._keywords_module()
+        # keywords removed from the lib must not stay in keywords.kw_func
+        for name, func in lib.keywords.items():
+            if kw.kw_func.get(name) is func:
+                del kw.kw_func[name]
+        module = importlib.reload(lib.module)
+        return self._register(module_name, module)
+
+    def _register(self, module_name, module):
+        kw = self._keywords_module()
+        keywords = {name: func for name, func in kw.kw_func.items()
+                    if getattr(func, '__module__', None) == module_name}
+        self._generation += 1
+        lib = _Library(module, _mtime(module), keywords, self._deps_of(module), self._generation)
+        self._libs[module_name] = lib
+        return lib
+
+    def _deps_of(self, module):
+        """
+        :return: names of libs in libs dir which module imports, by module or by name
+        """
+        deps = set()
+        for value in vars(module).values():
+            name = value.__name__ if type(value) == type(sys) else getattr(value, '__module__', None)
+            if type(name) != str or name in (module.__name__, 'keywords'):
+                continue
+            dep = sys.modules.get(name)
+            if dep is not None and self._in_libs(dep):
+                deps.add(name)
+        return sorted(deps)
+
+    def _in_libs(self, module):
+        path = getattr(module, '__file__', None)
+        return bool(path) and os.path.dirname(os.path.abspath(path)) == self.libs_dir
+
+
+def _mtime(module):
+    path = getattr(module, '__file__', None)
+    if not path:
+        return 0
+    try:
+        return os.path.getmtime(path)
+    except OSError:
+        return 0
@@ -1,6 +1,12 @@
 import threading
-import time
 import sys
+import re
+import hashlib
+import datetime
+from collections import deque
+from collections.abc import MutableMapping
+from operator import itemgetter
+from types import MappingProxyType
 from os.path import dirname, abspath, pardir, join
 import logging
 import socket
@@ -10,10 +16,16 @@ from uitester.test_manager import local_proxy
 from uitester.test_manager import context
 from uitester.test_manager import adb
 from uitester.test_manager import path_helper
+from uitester.test_manager import rpc_stats
+from uitester.test_manager import kw_cache
+from uitester.test_manager import kw_registry
 
 
 _MAX_LENGTH = 80
 
+# seconds to wait for agent register after instrumentation started
+AGENT_REGISTER_TIMEOUT = 30
+
 
 logger = logging.getLogger('Tester')
 
@@ -21,6 +33,13 @@ script_dir = dirname(abspath(__file__))
 libs_dir = join(join(join(script_dir, pardir), pardir), 'libs')
 sys.path.append(libs_dir)
 
+# keyword libs, imported once and reloaded when changed
+libraries = kw_registry.LibraryRegistry(libs_dir, var_cache={
+    'proxy': device_proxy,
+    'reflection': reflection_proxy,
+    'local': local_proxy
+})
+
 
 def get_local_ip():
     s = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
@@ -61,17 +80,22 @@ class StatusMsg:
         AGENT_ERROR: 'AGENT ERROR'
     }
 
-    def __init__(self, status, device_id=None, case_id=0, line_number=0, message=None):
+    def __init__(self, status, device_id=None, case_id=0, line_number=0, message=None, data_row=0):
+        """
+        :param data_row: number of data row the case runs with, from 1. 0 if case has no data
+        """
         self.device_id = device_id
         self.status = status
         self.case_id = case_id
         self.line_number = line_number
         self.message = message
+        self.data_row = data_row
 
     def __str__(self):
         message = self.message if self.message else ''
-        return '{} case_id={} line_number={} message:\n {}'\
-            .format(self.__status_str__[self.status], self.case_id, self.line_number, message)
+        row = ' data_row={}'.format(self.data_row) if self.data_row else ''
+        return '{} case_id={}{} line_number={} message:\n {}'\
+            .format(self.__status_str__[self.status], self.case_id, row, self.line_number, message)
 
 
 class KWRunningStatusListener:
@@ -110,20 +134,202 @@ class DataRow:
         return rows
 
 
+class RowShards:
+    """
+    Data rows of cases shared by device threads of a run.
+    A device takes next row of a case when it is idle, every row runs once.
+    """
+
+    def __init__(self, cases):
+        self._rows = [deque(enumerate(DataRow.from_list(_case.data[0], _case.data[1:]), 1))
+                      if len(_case.data) >= 2 else deque() for _case in cases]
+
+    def rows(self, case_index):
+        """
+        :param case_index: index of case in cases of the run
+        :return: iterator of (row number, DataRow) not taken by other devices
+        """
+        queue = self._rows[case_index]
+        while True:
+            try:
+                # popleft is atomic, a row is never taken twice
+                yield queue.popleft()
+            except IndexError:
+                return
+
+    def put_back(self, case_index, row):
+        """
+        Return a taken row, next idle device runs it
+        :param row: (row number, DataRow)
+        """
+        self._rows[case_index].appendleft(row)
+
+    def left(self):
+        """
+        Take all rows no device ran, e.g. every device died
+        :return: list of (case index, row number)
+        """
+        res = []
+        for case_index in range(len(self._rows)):
+            res.extend((case_index, row_number) for row_number, data_row in self.rows(case_index))
+        return res
+
+
+class RowResult:
+
+    def __init__(self, device_id):
+        self.device_id = device_id
+        self.start_time = datetime.datetime.now()
+        self.end_time = None
+        self.messages = []
+
+    @property
+    def passed(self):
+        return not any(msg.status == StatusMsg.ERROR for msg in self.messages)
+
+    @property
+    def errors(self):
+        return [str(msg.message) for msg in self.messages if msg.status == StatusMsg.ERROR]
+
+
+class RowOrderListener(KWRunningStatusListener):
+    """
+    Forward status of data rows to listener in row order.
+    Rows sharded across devices finish out of order, messages of a row are kept until rows before it finished.
+    Messages of cases without data are forwarded at once, TEST_END waits for kept rows.
+    """
+    # status of TaskRecord, same as TaskRecord.pass_flag and fail_flag
+    ROW_PASS = 0
+    ROW_FAIL = -1
+
+    def __init__(self, listener, recorder=None):
+        """
+        :param recorder: TaskRecorder, a record is added for every row in row order
+        """
+        self.listener = listener
+        self.recorder = recorder
+        # case_id -> {row number: RowResult} of forwarded rows
+        self.results = {}
+        self._rows = {}
+        self._done = set()
+        self._next_row = {}
+        self._held = []
+        self._lock = threading.Lock()
+
+    def update(self, msg):
+        with self._lock:
+            if msg.data_row and msg.data_row < self._next_row.get(msg.case_id, 1):
+                # error after its row finished, e.g. in finish_app
+                self._send(msg)
+            elif msg.data_row:
+                key = (msg.case_id, msg.data_row)
+                result = self._rows.get(key)
+                if result is None:
+                    result = self._rows[key] = RowResult(msg.device_id)
+                result.messages.append(msg)
+                if msg.status == StatusMsg.CASE_END:
+                    result.end_time = datetime.datetime.now()
+                    self._done.add(key)
+                    self._forward_done(msg.case_id)
+            elif msg.status == StatusMsg.TEST_END and self._rows:
+                self._held.append(msg)
+            else:
+                self._send(msg)
+            if not self._rows:
+                self._send_held()
+
+    def flush(self):
+        """
+        Forward all kept messages, call when all devices finished
+        """
+        with self._lock:
+            for key in sorted(self._rows):
+                self._forward(key)
+            self._done.clear()
+            self._send_held()
+
+    def _forward_done(self, case_id):
+        row = self._next_row.get(case_id, 1)
+        while (case_id, row) in self._done:
+            self._done.remove((case_id, row))
+            self._forward((case_id, row))
+            row += 1
+        self._next_row[case_id] = row
+
+    def _forward(self, key):
+        case_id, row = key
+        result = self._rows.pop(key)
+        for msg in result.messages:
+            self._send(msg)
+        self.results.setdefault(case_id, {})[row] = result
+        if self.recorder:
+            self.recorder.add_record(case_id, result.device_id, result.start_time,
+                                     self.ROW_PASS if result.passed else self.ROW_FAIL,
+                                     data_row=row, errors=result.errors)
+
+    def _send_held(self):
+        held, self._held = self._held, []
+        for msg in held:
+            self._send(msg)
+
+    def _send(self, msg):
+        if self.listener:
+            self.listener.update(msg)
+
+
+def watch_agent(agent, device, listener):
+    """
+    Report AGENT_ERROR to listener when agent connection is lost
+    """
+    def on_dead(reason):
+        if listener:
+            listener.update(StatusMsg(StatusMsg.AGENT_ERROR, device_id=device.id, message=reason))
+    agent.dead_callbacks.append(on_dead)
+
+
 class KWRunner:
-    def __init__(self, status_listener=None, device_manager=None):
+    def __init__(self, status_listener=None, device_manager=None, shard_rows=False, recorder=None):
+        """
+        :param shard_rows: run every data row of a case once, on the first idle device,
+        instead of all rows on every device
+        :param recorder: TaskRecorder, records a result per data row when shard_rows
+        """
         self.listener = status_listener
         self.run_signal = RunSignal()
         self.dm = device_manager
+        self.shard_rows = shard_rows
+        self.recorder = recorder
 
     def execute(self, cases, devices):
         self.run_signal.stop = False
-        self.dm.selected_devices[0].agent = None
+        listener = self.listener
+        shards = None
+        if self.shard_rows:
+            listener = RowOrderListener(self.listener, self.recorder)
+            shards = RowShards(cases)
+        threads = []
         for device in devices:
+            self.dm.clear_agent(device)
             instrument_thread = threading.Thread(target=self._setup_agent, args=(device,))
             instrument_thread.start()
-            t = threading.Thread(target=self._run_cases_on_device, args=(cases, device))
+            t = threading.Thread(target=self._run_cases_on_device, args=(cases, device, listener, shards))
             t.start()
+            threads.append(t)
+        if shards:
+            threading.Thread(target=self._flush_when_done, args=(threads, listener, shards, cases)).start()
+        return listener
+
+    @staticmethod
+    def _flush_when_done(threads, listener, shards, cases):
+        for t in threads:
+            t.join()
+        # rows left when no live device was left fail, as they did on their device before sharding
+        for case_index, row_number in shards.left():
+            case_id = cases[case_index].id
+            listener.update(StatusMsg(StatusMsg.ERROR, case_id=case_id, data_row=row_number,
+                                      message='No live device left to run data row'))
+            listener.update(StatusMsg(StatusMsg.CASE_END, case_id=case_id, data_row=row_number))
+        listener.flush()
 
     def _setup_agent(self, device):
         self.listener.update(StatusMsg(StatusMsg.INSTALL_START, device_id=device.id))
@@ -148,57 +354,74 @@ class KWRunner:
         else:
             self.listener.update(StatusMsg(StatusMsg.AGENT_ERROR, device_id=device.id, message=instrument_output))
 
-    def _run_cases_on_device(self, cases, device):
-
-        wait_count = 0
-        while True:
-            if wait_count > 30:
-                self.listener.update(
-                    StatusMsg(
-                        StatusMsg.AGENT_ERROR,
-                        device_id=device.id,
-                        message='agent not register'))
-                return
-            if self.dm.selected_devices[0].agent:
-                break
-            else:
-                time.sleep(1)
-                wait_count += 1
+    def _run_cases_on_device(self, cases, device, listener=None, shards=None):
+        """
+        :param shards: RowShards, data rows are taken from it instead of running all rows
+        """
+        listener = listener or self.listener
+        agent = self.dm.wait_agent(device, timeout=AGENT_REGISTER_TIMEOUT)
+        if agent is None:
+            listener.update(
+                StatusMsg(
+                    StatusMsg.AGENT_ERROR,
+                    device_id=device.id,
+                    message='agent not register'))
+            return
+        watch_agent(agent, device, listener)
 
-        context.agent = self.dm.selected_devices[0].agent
+        context.agent = agent
 
-        self.listener.update(StatusMsg(
+        listener.update(StatusMsg(
                     StatusMsg.TEST_START,
                     device_id=device.id
                 ))
 
-        for _case in cases:
+        for index, _case in enumerate(cases):
+            if shards and agent.is_closed:
+                # rows left are run by other devices
+                break
             core = KWCore()
             core.case_id = _case.id
             try:
                 if len(_case.data) >= 2:
-                    data_rows = DataRow.from_list(_case.data[0], _case.data[1:])
-                    for data_row in data_rows:
+                    # parse once, every data row runs the same program
+                    program = core.compile(_case.content, with_data=True)
+                    if shards:
+                        data_rows = shards.rows(index)
+                    else:
+                        data_rows = enumerate(DataRow.from_list(_case.data[0], _case.data[1:]), 1)
+                    for row_number, data_row in data_rows:
+                        if shards and agent.is_closed:
+                            # dead device must not fail rows which other devices can run
+                            shards.put_back(index, (row_number, data_row))
+                            break
                         core.reset()
-                        core.set_data(data_row)
-                        core.parse(_case.content)
-                        core.execute(context.agent, self.listener)
+                        core.load(program)
+                        core.set_data(data_row, row_number)
+                        core.execute(context.agent, listener)
                 else:
-                    core.parse(_case.content)
-                    core.execute(context.agent, self.listener)
+                    core.load(core.compile(_case.content))
+                    core.execute(context.agent, listener)
             except Exception as e:
-                if self.listener:
-                    self.listener.update(StatusMsg(
+                if listener:
+                    listener.update(StatusMsg(
                         StatusMsg.ERROR,
                         device_id=device.id,
                         case_id=_case.id,
                         line_number=core.line_count,
-                        message=e
+                        message=e,
+                        data_row=core.data_row
                     ))
-        self.listener.update(StatusMsg(
+            # drop case vars and delete their remote objects on agent
+            core.reset()
+            reflection_proxy.release_handles(agent)
+        listener.update(StatusMsg(
             StatusMsg.TEST_END,
             device_id=device.id
         ))
+        logger.info('RPC stats of device {}:\n{}'.format(
+            device.id, rpc_stats.format_snapshot(agent.stats.snapshot())))
+        kw_cache.programs.save()
 
         context.agent.close()
 
@@ -232,18 +455,18 @@ class KWDebugRunner:
         self.run_signal.stop = False
 
     def parse(self, script_str):
-        self.core.parse(script_str)
+        self.core.load(self.core.compile(script_str, with_data=True))
+        kw_cache.programs.save()
 
     def execute(self, script_str=None, data_line=0):
-        self.dm.selected_devices[0].agent = None
-        setup_t = threading.Thread(target=self._setup_devices)
+        device = self.dm.selected_devices[0]
+        self.dm.clear_agent(device)
+        setup_t = threading.Thread(target=self._setup_devices, args=(device,))
         setup_t.start()
-        t = threading.Thread(target=self._thread_execute, args=(script_str, data_line))
+        t = threading.Thread(target=self._thread_execute, args=(device, script_str, data_line))
         t.start()
 
-    def _setup_devices(self):
-        device = self.dm.selected_devices[0]
-
+    def _setup_devices(self, device):
         self.listener.update(StatusMsg(
             StatusMsg.INSTALL_START,
             device_id=device.id
@@ -285,51 +508,47 @@ class KWDebugRunner:
                 message=instrument_output
             ))
 
-    def _thread_execute(self, script_str=None, data_line=0):
+    def _thread_execute(self, device, script_str=None, data_line=0):
         try:
-            wait_agent_time_count = 0
-            while True:
-                if wait_agent_time_count > 30:
-                    self.listener.update(StatusMsg(
-                        StatusMsg.AGENT_ERROR,
-                        device_id=self.dm.selected_devices[0].id,
-                        message='Start test failed, Not found agent, timeout'
-                    ))
-                    return
-                if self.dm.selected_devices[0].agent:
-                    break
-                else:
-                    time.sleep(1)
-                    wait_agent_time_count += 1
+            agent = self.dm.wait_agent(device, timeout=AGENT_REGISTER_TIMEOUT)
+            if agent is None:
+                self.listener.update(StatusMsg(
+                    StatusMsg.AGENT_ERROR,
+                    device_id=device.id,
+                    message='Start test failed, Not found agent, timeout'
+                ))
+                return
+            watch_agent(agent, device, self.listener)
 
+            program = self.core.compile(script_str, with_data=True) if script_str else None
             if data_line == 0:
                 if self.data is None or len(self.data) < 2:
-                    self._execute(script_str=script_str)
+                    self._execute(agent, program=program)
                 else:
                     for data_row in self.data:
-                        self._execute(script_str=script_str, data_row=data_row)
+                        self._execute(agent, program=program, data_row=data_row)
             else:
                 # data_line_number = data_line-1
                 # run single data line
-                self._execute(script_str=script_str, data_row=self.data[data_line-1])
+                self._execute(agent, program=program, data_row=self.data[data_line-1])
         except Exception as e:
             if self.listener:
                 self.listener.update(StatusMsg(
                     StatusMsg.ERROR,
-                    device_id=context.agent.device_id,
+                    device_id=device.id,
                     line_number=self.core.line_count,
                     message=e
                 ))
 
-        self.dm.selected_devices[0].agent.close()
+        device.agent.close()
 
-    def _execute(self, script_str=None, data_row=None):
+    def _execute(self, agent, program=None, data_row=None):
         self.run_signal.stop = False
-        if script_str:
+        if program:
             self.core.reset()
+            reflection_proxy.release_handles(agent)
+            self.core.load(program)
             self.core.set_data(data_row)
-            self.core.parse(script_str)
-        agent = self.dm.selected_devices[0].agent
         self.core.execute(agent, self.listener)
 
     def stop(self):
@@ -385,11 +604,12 @@ class KWCore:
             'assert_is_not_none': self.assert_is_not_none
         }
         self.kw_func = {**self.default_func}
-        self.kw_var = {}
+        self.kw_var = KWVars()
         self.kw_lines = []
         self.status_listener = None
         self.line_count = 0
         self.case_id = 0
+        self.data_row = 0
         self.run_signal = run_signal
 
     def reset(self):
@@ -397,15 +617,60 @@ class KWCore:
         reset core. clear all func\var\listener\line count.
         """
         self.kw_func = {**self.default_func}
-        self.kw_var = {}
+        self.kw_var = KWVars()
         self.kw_lines = []
         self.status_listener = None
         self.line_count = 0
+        self.data_row = 0
         if self.run_signal:
             self.run_signal.stop = False
 
-    def set_data(self, data_row):
+    def set_data(self, data_row, row_number=0):
+        """
+        :param row_number: number of data_row in case data from 1, reported in StatusMsg.data_row
+        """
         self.kw_var[self.DATA] = data_row
+        self.data_row = row_number
+
+    def compile(self, script_str, with_data=False):
+        """
+        Parse script into a KWProgram, load it to run it. Parse state of this core is not changed.
+        Programs are cached by script content and imported libs mtime, see kw_cache.
+        :param with_data: script may use $data, program runs with data rows
+        :return: KWProgram
+        """
+        key = _program_key(script_str, with_data)
+        program = kw_cache.programs.get(key)
+        if type(program) == dict:
+            # loaded from cache file, only imports run again
+            program = KWProgram.from_dict(program, type(self)())
+            kw_cache.programs.put(key, program)
+        if program is None:
+            program = self._compile(script_str, with_data)
+            kw_cache.programs.put(key, program)
+        return program
+
+    def _compile(self, script_str, with_data):
+        core = type(self)()
+        if with_data:
+            core.kw_var[self.DATA] = None
+        try:
+            core.parse(script_str)
+        except Exception:
+            # runner reports the line which failed to parse
+            self.line_count = core.line_count
+            raise
+        return KWProgram(core.kw_lines, core.kw_func, core.kw_var, core.line_count)
+
+    def load(self, program):
+        """
+        Load compiled program, call set_data and execute after it.
+        Vars are replaced by the program vars, lines of program access them by slot.
+        """
+        self.kw_func = dict(program.kw_func)
+        self.kw_lines = list(program.lines)
+        self.line_count = program.line_count
+        self.kw_var = KWVars(program.var_names)
 
     def parse(self, script_str):
         """
@@ -443,6 +708,10 @@ class KWCore:
         if kw_line.var:
             self.kw_var[kw_line.var] = None
 
+        # resolve keyword function and args, import of later lines can't change them
+        kw_line.func = self.kw_func.get(func)
+        kw_line.bind(self.kw_var)
+
         # add kw line to cache
         self.kw_lines.append(kw_line)
 
@@ -464,7 +733,8 @@ class KWCore:
             self.status_listener.update(StatusMsg(
                 StatusMsg.CASE_START,
                 device_id=agent.device_id,
-                case_id=self.case_id
+                case_id=self.case_id,
+                data_row=self.data_row
             ))
         for line in self.kw_lines:
             if self.status_listener:
@@ -473,7 +743,8 @@ class KWCore:
                     StatusMsg.KW_LINE_START,
                     device_id=agent.device_id,
                     line_number=line.line_number,
-                    case_id=self.case_id
+                    case_id=self.case_id,
+                    data_row=self.data_row
                 ))
             try:
                 if self.run_signal and self.run_signal.stop:
@@ -488,7 +759,8 @@ class KWCore:
                         device_id=agent.device_id,
                         line_number=line.line_number,
                         case_id=self.case_id,
-                        message=e
+                        message=e,
+                        data_row=self.data_row
                     ))
                 # if case line execute failed. stop this case and run next one
                 if self.status_listener:
@@ -497,7 +769,8 @@ class KWCore:
                         StatusMsg.KW_LINE_END,
                         device_id=agent.device_id,
                         line_number=line.line_number,
-                        case_id=self.case_id
+                        case_id=self.case_id,
+                        data_row=self.data_row
                     ))
                 break
             if self.status_listener:
@@ -506,14 +779,16 @@ class KWCore:
                     StatusMsg.KW_LINE_END,
                     device_id=agent.device_id,
                     line_number=line.line_number,
-                    case_id=self.case_id
+                    case_id=self.case_id,
+                    data_row=self.data_row
                 ))
         if self.status_listener:
             # -- Case end --
             self.status_listener.update(StatusMsg(
                 StatusMsg.CASE_END,
                 device_id=agent.device_id,
-                case_id=self.case_id
+                case_id=self.case_id,
+                data_row=self.data_row
             ))
 
     def _import(self, module_name):
@@ -529,16 +804,8 @@ class KWCore:
         line 2. call function test_str() in custom_lib.
 
         """
-        # load keywords
-        kw = __import__('keywords')
-        # set real rpc proxy
-        kw.var_cache['proxy'] = device_proxy
-        kw.var_cache['reflection'] = reflection_proxy
-        kw.var_cache['local'] = local_proxy
-        # load script
-        __import__(module_name)
-        # register all kw func from keywords.kw_func
-        self.kw_func.update(kw.kw_func)
+        # keywords of the lib and libs it imports, lib is reloaded if changed
+        self.kw_func.update(libraries.keywords(module_name))
 
     def _check(self, expected, actual):
         """
@@ -613,27 +880,16 @@ class KWCore:
             return
         logger.debug('exec items {}'.format(kw_line.items))
 
-        # make args, change var name to var object
-        args = []
-        for item in kw_line.items[1:]:
-            if type(item) is int:
-                args.append(item)
-            elif type(item) is str and item.startswith(self.VAR):
-                arg_str = item[1:]
-                index = arg_str.find(self.DOT)
-                if index == -1:
-                    args.append(self.kw_var[arg_str])
-                else:
-                    var = self.kw_var[arg_str[:index]]
-                    args.append(getattr(var, arg_str[index+1:]))
-            else:
-                args.append(item)
+        # make args by accessors resolved while parsing
+        values = self.kw_var.values
+        args = [accessor(values) for accessor in kw_line.accessors]
 
         # execute keyword function
-        res = self.kw_func[kw_line.items[0]](*args)
+        func = kw_line.func or self.kw_func[kw_line.items[0]]
+        res = func(*args)
         # set response as var
         if kw_line.var:
-            self.kw_var[kw_line.var] = res
+            values[kw_line.var_slot] = res
 
     def _parse_line(self, kw_line, line_number=0):
         line = KWLine(raw=kw_line, line_number=line_number)
@@ -641,69 +897,213 @@ class KWCore:
             line.is_comment = True
             return line
 
-        kw_items = []
-        cache = ''
-        in_quotation = False
-        var = None
-        for char in kw_line:
-            if char == self.SPACE and not in_quotation and cache:
-                kw_items.append(cache.strip())
-                cache = ''
-            elif char == self.QUOTE:
-                in_quotation = not in_quotation
-                cache += char
-            else:
-                if not cache:
-                    cache = char
-                else:
-                    cache += char
-        if len(cache) > 0:
-            kw_items.append(cache.strip())
-
-        if in_quotation:
+        if kw_line.count(self.QUOTE) % 2:
             raise ValueError('Missing quote. {}'.format(kw_line), line_number)
 
-        if self.AS in kw_items:
-            as_index = kw_items.index(self.AS)
-            if as_index < (len(kw_items) - 2):
+        # split by space (not in quotes)
+        items = [item.strip() for item in _TOKEN_PATTERN.findall(kw_line)]
+        var = None
+        if self.AS in items:
+            as_index = items.index(self.AS)
+            if as_index < (len(items) - 2):
                 raise ValueError('Keywords "as" should only set one variable', line_number)
-            elif as_index == (len(kw_items) - 1):
+            elif as_index == (len(items) - 1):
                 raise ValueError('Keywords "as" need one variable after it', line_number)
-            else:
-                var = kw_items[as_index + 1]
-                if var.find(self.QUOTE) != -1:
-                    raise ValueError('Keywords "as" parse error. var name should not have any " in it.')
-                kw_items = kw_items[:as_index]
-
-        for index, item in enumerate(kw_items):
-            if item.startswith(self.VAR) and len(item) > 1 and item[1:] not in self.kw_var:
-                if '.' in item:
-                    split_item = item[1:].split('.')
-                    if split_item[0] not in self.kw_var:
-                        raise ValueError('Var {} not defined'.format(item[1:]))
-                else:
-                    if item[1:] not in self.kw_var:
-                        raise ValueError('Var {} not defined'.format(item[1:]))
-            elif item.find('"') == -1:
-                # if kw item is int
-                try:
-                    kw_items[index] = int(item)
-                except ValueError:
-                    pass
-            else:
-                item = item.replace('"', '')
-                kw_items[index] = item
-
-        line.items = kw_items
+            var = items[as_index + 1]
+            if var.find(self.QUOTE) != -1:
+                raise ValueError('Keywords "as" parse error. var name should not have any " in it.')
+            items = items[:as_index]
+
+        tokens = [self._make_token(item) for item in items]
+        line.tokens = tokens
+        line.items = [value for kind, value in tokens]
         line.var = var
         return line
 
+    def _make_token(self, item):
+        """
+        :return: (token kind, value). Var and attr tokens keep their $ prefix, quotes are removed from strings
+        """
+        first = item[:1]
+        if first == self.VAR and len(item) > 1:
+            if item[1:] in self.kw_var:
+                return TOKEN_VAR, item
+            if item[1:].partition(self.DOT)[0] not in self.kw_var:
+                raise ValueError('Var {} not defined'.format(item[1:]))
+            return TOKEN_ATTR, item
+        if self.QUOTE in item:
+            return TOKEN_STRING, item.replace(self.QUOTE, '')
+        if item.isdecimal() or (first in '+-' and item[1:].isdecimal()):
+            return TOKEN_INT, int(item)
+        return TOKEN_WORD, item
+
+
+# token kinds of a parsed kw line
+TOKEN_WORD = 'word'
+TOKEN_STRING = 'string'
+TOKEN_INT = 'int'
+TOKEN_VAR = 'var'
+TOKEN_ATTR = 'attr'
+
+# a token is a run of non space chars and quoted strings, e.g. abc"d e f"g
+_TOKEN_PATTERN = re.compile(r'(?:[^ "]|"[^"]*")+')
+
+
+class KWVars(MutableMapping):
+    """
+    Vars of a case by name. Every var has a fixed slot in values,
+    parsed lines read args and write results by slot index instead of name.
+    """
+    def __init__(self, names=()):
+        self.slots = {}
+        self.values = []
+        for name in names:
+            self.slot(name)
+
+    def slot(self, name):
+        """
+        :return: slot index of var, a new slot if var is not defined
+        """
+        index = self.slots.get(name)
+        if index is None:
+            index = self.slots[name] = len(self.values)
+            self.values.append(None)
+        return index
+
+    def __getitem__(self, name):
+        return self.values[self.slots[name]]
+
+    def __setitem__(self, name, value):
+        self.values[self.slot(name)] = value
+
+    def __delitem__(self, name):
+        raise TypeError('Var {} can\'t be deleted, parsed lines may use its slot'.format(name))
+
+    def __iter__(self):
+        return iter(self.slots)
+
+    def __len__(self):
+        return len(self.slots)
+
+
+def _constant(value):
+    return lambda values: value
+
+
+def _attr_getter(index, attr):
+    return lambda values: getattr(values[index], attr)
+
+
+def _make_accessor(token, kw_vars):
+    """
+    :return: function which makes the arg of token from var values
+    """
+    kind, value = token
+    if kind == TOKEN_VAR:
+        return itemgetter(kw_vars.slot(value[1:]))
+    elif kind == TOKEN_ATTR:
+        name, _, attr = value[1:].partition(KWCore.DOT)
+        return _attr_getter(kw_vars.slot(name), attr)
+    return _constant(value)
+
 
 class KWLine:
     def __init__(self, raw=None, line_number=0):
         self.is_comment = False
         self.items = []
+        # typed (kind, value) tokens of items
+        self.tokens = []
         self.raw = raw
         self.line_number = line_number
         self.var = None
+        # keyword function resolved while parsing
+        self.func = None
+        # arg accessors and result var slot, see bind
+        self.accessors = ()
+        self.var_slot = None
+
+    def bind(self, kw_vars):
+        """
+        Resolve args and result var to slots of kw_vars
+        """
+        self.accessors = tuple(_make_accessor(token, kw_vars) for token in self.tokens[1:])
+        if self.var:
+            self.var_slot = kw_vars.slot(self.var)
+
+    def to_dict(self):
+        return {
+            'raw': self.raw,
+            'line_number': self.line_number,
+            'tokens': [list(token) for token in self.tokens],
+            'var': self.var
+        }
+
+    @classmethod
+    def from_dict(cls, line_dict, kw_func, kw_vars):
+        line = cls(raw=line_dict['raw'], line_number=line_dict['line_number'])
+        line.tokens = [tuple(token) for token in line_dict['tokens']]
+        line.items = [value for kind, value in line.tokens]
+        line.var = line_dict['var']
+        line.func = kw_func.get(line.items[0])
+        line.bind(kw_vars)
+        return line
+
+
+class KWProgram:
+    """
+    Compiled keywords script, see KWCore.compile.
+    Program is never changed by execution, so one program runs all data rows of a case.
+    """
+    def __init__(self, lines, kw_func, kw_vars, line_count):
+        """
+        :param kw_vars: KWVars which lines are bound to
+        """
+        self.lines = tuple(lines)
+        self.kw_func = MappingProxyType(dict(kw_func))
+        # in slot order, dict order is not kept before python 3.6
+        self.var_names = tuple(sorted(kw_vars.slots, key=kw_vars.slots.get))
+        self.line_count = line_count
+
+    def to_dict(self):
+        return {
+            'lines': [line.to_dict() for line in self.lines],
+            'var_names': list(self.var_names),
+            'line_count': self.line_count
+        }
+
+    @classmethod
+    def from_dict(cls, program_dict, core):
+        """
+        :param core: new KWCore, imports of program run on it to resolve keyword functions
+        """
+        lines = program_dict['lines']
+        for line in lines:
+            if line['tokens'][0][1] == 'import':
+                core._import(*[value for kind, value in line['tokens'][1:]])
+        kw_vars = KWVars(program_dict['var_names'])
+        kw_lines = [KWLine.from_dict(line, core.kw_func, kw_vars) for line in lines]
+        return cls(kw_lines, core.kw_func, kw_vars, program_dict['line_count'])
+
+
+_IMPORT_PATTERN = re.compile(r'^\s*import\s+(\S+)', re.MULTILINE)
+
+
+def _lib_mtimes(module_name):
+    try:
+        return libraries.mtimes(module_name)
+    except Exception:
+        # not importable, compile raises the import error
+        return [(module_name, 0)]
+
+
+def _program_key(script_str, with_data):
+    """
+    Cache key of a compiled script: hash of script content and mtimes of libs it imports, and their deps
+    """
+    mtimes = [with_data]
+    for name in _IMPORT_PATTERN.findall(script_str):
+        mtimes.extend(_lib_mtimes(name))
+    digest = hashlib.sha1(script_str.encode('utf-8'))
+    digest.update(repr(mtimes).encode('utf-8'))
+    return digest.hexdigest()
 
@@ -1,5 +1,13 @@
 import logging
+import hashlib
+import inspect
+import json
+import weakref
+import functools
+from collections import deque
+from threading import Lock, RLock
 from uitester.test_manager import context
+from uitester.test_manager import view_tree
 
 logger = logging.getLogger('Tester')
 
@@ -9,6 +17,25 @@ CLASS = '03'
 OBJECT = '04'
 FLOAT = '05'
 BOOL = '06'
+# result of an earlier step in a pipeline, see RemoteRef
+SLOT = '07'
+# parameter of a remote plan, see RemotePlan
+PARAM = '08'
+NULL = '09'
+LONG = '10'
+DOUBLE = '11'
+BYTE = '12'
+# primitive array: element type is one of INT, LONG, FLOAT, DOUBLE, BOOL, BYTE
+ARRAY = '13'
+# java.util.List of typed args
+LIST = '14'
+
+# reflection call versions. version 3 args are typed lists, see _make_typed_arg
+LEGACY_ARGS_VERSION = 2
+TYPED_ARGS_VERSION = 3
+
+# released remote objects are deleted on agent in batches of this size, see HandleTracker
+RELEASE_BATCH_SIZE = 100
 
 
 class RemoteObject:
@@ -28,10 +55,15 @@ class RemoteObject:
     =TextView= ----------
     text
 
+    Objects returned by an agent with lazy_attrs capability only carry hash and class_name,
+    other attrs are fetched on first access, see fetch_attrs and prefetch.
     """
     def __init__(self):
         self.remote_type = OBJECT
 
+    def __getattr__(self, name):
+        return lazy_attr(self, name)
+
     @classmethod
     def from_float(cls, float_input):
         obj = cls()
@@ -39,6 +71,31 @@ class RemoteObject:
         obj.value = float_input
         return obj
 
+    @classmethod
+    def from_long(cls, long_input):
+        obj = cls()
+        obj.remote_type = LONG
+        obj.value = long_input
+        return obj
+
+    @classmethod
+    def from_double(cls, double_input):
+        obj = cls()
+        obj.remote_type = DOUBLE
+        obj.value = double_input
+        return obj
+
+    @classmethod
+    def from_array(cls, element_type, values):
+        """
+        Primitive array, e.g. RemoteObject.from_array(INT, [1, 2, 3]) is int[]{1, 2, 3}
+        """
+        obj = cls()
+        obj.remote_type = ARRAY
+        obj.element_type = element_type
+        obj.values = values
+        return obj
+
     @classmethod
     def from_dict(cls, attr_dict):
         obj = cls()
@@ -54,26 +111,132 @@ class RemoteObject:
         return obj
 
 
+# Arg encoders, dispatched by arg type.
+# Objects with attr remote_type (RemoteObject here and in libs) are dispatched by remote_type.
+# Legacy encoding (call version 2) is a type prefixed string, e.g. '01text', '04123456:android.view.View'.
+# Typed encoding (call version 3) is a list [type, *values], e.g. ['01', 'text'], ['04', 123456, 'android.view.View'],
+# it also supports null, long, double, primitive arrays and lists.
+
+_INT_MIN = -0x80000000
+_INT_MAX = 0x7fffffff
+
+# legacy agents only know the original codes, null, long, double and the rest need typed_args
+_LEGACY_REMOTE_ENCODERS = {
+    OBJECT: lambda arg: OBJECT+str(arg.hash)+':'+arg.class_name,
+    CLASS: lambda arg: CLASS+str(arg.class_name),
+    FLOAT: lambda arg: FLOAT+str(arg.value),
+    BOOL: lambda arg: BOOL+str(arg.value),
+}
+
+_LEGACY_ENCODERS = {
+    str: lambda arg: STRING+arg,
+    int: lambda arg: INT+str(arg),
+    bool: lambda arg: BOOL+str(arg),
+}
+
+
+def _typed_int(arg):
+    if _INT_MIN <= arg <= _INT_MAX:
+        return [INT, arg]
+    return [LONG, arg]
+
+
+_TYPED_REMOTE_ENCODERS = {
+    OBJECT: lambda arg: [OBJECT, arg.hash, arg.class_name],
+    CLASS: lambda arg: [CLASS, arg.class_name],
+    FLOAT: lambda arg: [FLOAT, float(arg.value)],
+    BOOL: lambda arg: [BOOL, bool(arg.value)],
+    LONG: lambda arg: [LONG, int(arg.value)],
+    DOUBLE: lambda arg: [DOUBLE, float(arg.value)],
+    ARRAY: lambda arg: [ARRAY, arg.element_type, list(arg.values)],
+}
+
+_TYPED_ENCODERS = {
+    str: lambda arg: [STRING, arg],
+    int: _typed_int,
+    bool: lambda arg: [BOOL, arg],
+    float: lambda arg: [DOUBLE, arg],
+    type(None): lambda arg: [NULL],
+    bytes: lambda arg: [ARRAY, BYTE, arg],
+    list: lambda arg: [LIST, [_make_typed_arg(item) for item in arg]],
+    tuple: lambda arg: [LIST, [_make_typed_arg(item) for item in arg]],
+}
+
+
+def _encode(arg, encoders, remote_encoders):
+    encoder = encoders.get(type(arg))
+    if encoder is not None:
+        return encoder(arg)
+    # remote objects of libs are not added to encoders, classes of reloaded libs must not be kept
+    if hasattr(arg, 'remote_type'):
+        return _encode_remote(arg, remote_encoders)
+    raise TypeError('Can\'t make remote call arg. Unknown arg type', type(arg), arg)
+
+
+def _encode_remote(arg, remote_encoders):
+    encoder = remote_encoders.get(arg.remote_type)
+    if encoder is None:
+        raise TypeError('Can\'t make remote call arg. Unsupported remote type', arg.remote_type, arg)
+    return encoder(arg)
+
+
+# RemoteObject goes to the remote type dispatcher directly
+_LEGACY_ENCODERS[RemoteObject] = functools.partial(_encode_remote, remote_encoders=_LEGACY_REMOTE_ENCODERS)
+_TYPED_ENCODERS[RemoteObject] = functools.partial(_encode_remote, remote_encoders=_TYPED_REMOTE_ENCODERS)
+
+
 def _make_arg(arg):
-    arg_type = type(arg)
-    if arg_type == str:
-        return STRING+arg
-    elif arg_type == int:
-        return INT+str(arg)
-    elif arg_type == bool:
-        return BOOL+str(arg)
-    elif hasattr(arg, 'remote_type') and arg.remote_type == OBJECT:
-        return OBJECT+str(arg.hash)+':'+arg.class_name
-    elif hasattr(arg, 'remote_type') and arg.remote_type == CLASS:
-        return CLASS+str(arg.class_name)
-    elif hasattr(arg, 'remote_type') and arg.remote_type == FLOAT:
-        return FLOAT+str(arg.value)
-    else:
-        raise TypeError('Can\'t make remote call arg. Unknown arg type', type(arg), arg)
+    return _encode(arg, _LEGACY_ENCODERS, _LEGACY_REMOTE_ENCODERS)
+
+
+def _make_typed_arg(arg):
+    return _encode(arg, _TYPED_ENCODERS, _TYPED_REMOTE_ENCODERS)
+
+
+def _arg_encoding(agent):
+    """
+    :return: (encode function, call version) supported by agent
+    """
+    if agent.capabilities.get('typed_args'):
+        return _make_typed_arg, TYPED_ARGS_VERSION
+    return _make_arg, LEGACY_ARGS_VERSION
+
+
+def _is_mutating(steps):
+    """
+    :return: True if any reflection step may change ui, e.g. call of clickOnView or set of a field
+    """
+    for step in steps:
+        if step[0] == 'set' or step[0] in ('call', 'call_static') and view_tree.is_mutating(step[2]):
+            return True
+    return False
 
 
 def _call(*args, **kwargs):
-    response = context.agent.call(args[0], *[_make_arg(arg) for arg in args[1:]], version=2, **kwargs)
+    agent = context.agent
+    if _is_mutating((args,)):
+        view_tree.invalidate(agent)
+    tracker = _session_tracker(agent)
+    if tracker and len(tracker.released) >= RELEASE_BATCH_SIZE:
+        tracker.flush()
+    # host side latency of reflection call, including arg encoding and response parsing
+    encode, version = _arg_encoding(agent)
+    with agent.stats.timer('reflection.' + args[0]):
+        response = agent.call(args[0], *[encode(arg) for arg in args[1:]], version=version, **kwargs)
+        return _parse_response(response)
+
+
+def _call_batch(calls, **kwargs):
+    agent = context.agent
+    if _is_mutating(calls):
+        view_tree.invalidate(agent)
+    encode, version = _arg_encoding(agent)
+    batch = [(call[0], *[encode(arg) for arg in call[1:]]) for call in calls]
+    responses = agent.call_batch(batch, version=version, **kwargs)
+    return [_parse_response(response) for response in responses]
+
+
+def _parse_response(response):
     if response.name == 'Fail':
         raise ValueError(*response.args)
     if len(response.args) == 0:
@@ -81,16 +244,441 @@ def _call(*args, **kwargs):
     elif len(response.args) == 1:
         return _make_remote_object(response.args[0])
     else:
-        return [_make_remote_object(arg) for arg in response.args]
+        objects = [_make_remote_object(arg) for arg in response.args]
+        if PREFETCH_HINTS:
+            _prefetch_hinted(objects)
+        return objects
 
 
 def _make_remote_object(arg):
     if type(arg) == dict:
-        return RemoteObject.from_dict(arg)
+        obj = RemoteObject.from_dict(arg)
+        tracker = _session_tracker() if 'hash' in arg and 'class_name' in arg else None
+        if tracker:
+            tracker.track(obj)
+            if tracker.agent.capabilities.get('lazy_attrs'):
+                arg[LAZY_KEY] = True
+        return obj
     else:
         return arg
 
 
+# attrs of lazy objects by class name, prefetched in one batch when a call returns a list of them
+PREFETCH_HINTS = {}
+
+# key in __dict__ of a remote object whose attrs are not fetched yet
+LAZY_KEY = '__lazy'
+
+
+def lazy_attr(obj, name, fetch=None):
+    """
+    __getattr__ of remote objects: fetch attrs of a lazy object once, then read from its __dict__
+
+    :param fetch: fetches all attrs of obj and clears LAZY_KEY, fetch_attrs if None
+    """
+    attrs = obj.__dict__
+    if not name.startswith('_') and attrs.get(LAZY_KEY):
+        (fetch or fetch_attrs)(obj)
+        if name in attrs:
+            return attrs[name]
+    raise AttributeError('{} has no attribute {}'.format(type(obj).__name__, name))
+
+
+def fetch_attrs(obj, *names):
+    """
+    Fetch attrs of a lazy remote object, all serialized attrs if names is empty
+    """
+    prefetch([obj], *names)
+
+
+def prefetch(objects, *names):
+    """
+    Fetch attrs of many lazy remote objects in one round trip, e.g. text of all items of a list
+    prefetch(items, 'text')
+
+    :param names: attr names to fetch, all serialized attrs if empty
+    """
+    lazy = [obj for obj in objects if isinstance(getattr(obj, '__dict__', None), dict) and obj.__dict__.get(LAZY_KEY)]
+    if not lazy:
+        return
+    agent = context.agent
+    encode, version = _arg_encoding(agent)
+    calls = [('get_attrs', encode(obj)) + tuple(encode(name) for name in names) for obj in lazy]
+    with agent.stats.timer('reflection.get_attrs'):
+        responses = agent.call_batch(calls, version=version)
+    for obj, response in zip(lazy, responses):
+        if response.name == 'Fail':
+            raise ValueError(*response.args)
+        attrs = response.args[0] if response.args else {}
+        for name, value in attrs.items():
+            # never overwrite attrs set by host, e.g. class_name
+            obj.__dict__.setdefault(name, value)
+        if not names:
+            obj.__dict__.pop(LAZY_KEY, None)
+
+
+def set_prefetch_hint(class_name, *names):
+    """
+    Prefetch attrs of class_name objects whenever a call returns a list of them, e.g.
+    set_prefetch_hint('android.widget.TextView', 'text')
+    """
+    PREFETCH_HINTS[class_name] = names
+
+
+def _prefetch_hinted(objects):
+    groups = {}
+    for obj in objects:
+        if isinstance(obj, RemoteObject) and obj.__dict__.get(LAZY_KEY):
+            names = PREFETCH_HINTS.get(obj.__dict__.get('class_name'))
+            if names is not None:
+                groups.setdefault(names, []).append(obj)
+    for names, group in groups.items():
+        prefetch(group, *names)
+
+
+class _Handle:
+    """
+    Host side handle of a remote object. It is kept in the object __dict__, so every object sharing
+    or copying that dict (e.g. RemoteObject.from_object in libs) keeps the remote object alive.
+    """
+    def __init__(self, key, encoded):
+        self.key = key
+        self.encoded = encoded
+        self.finalizer = None
+
+
+class HandleTracker:
+    """
+    Remote objects pin java objects in agent handle table until deleted.
+    Every call returning a java object makes a new host object, handles are counted by remote hash.
+    Tracker queues a delete when the last host object of a remote hash is garbage collected,
+    queued deletes are sent in one batch at case end (release_handles) or when RELEASE_BATCH_SIZE is reached.
+    """
+    KEY = '__handle'
+
+    def __init__(self, agent):
+        self.agent = agent
+        self.encode, self.version = _arg_encoding(agent)
+        # deque append is thread safe, finalizers run in any thread
+        self.released = deque()
+        # remote hash -> count of live handles
+        self.refs = {}
+        # remote hashes never released, e.g. session cached results
+        self.pinned = set()
+        # reentrant, a finalizer may run on gc inside track of the same thread
+        self._lock = RLock()
+
+    def track(self, obj):
+        key = obj.__dict__['hash']
+        with self._lock:
+            if key in self.pinned:
+                return
+            self.refs[key] = self.refs.get(key, 0) + 1
+        handle = _Handle(key, self.encode(obj))
+        handle.finalizer = weakref.finalize(handle, self._release, key, handle.encoded)
+        obj.__dict__[self.KEY] = handle
+
+    def _release(self, key, encoded):
+        with self._lock:
+            count = self.refs.get(key, 0) - 1
+            if count > 0:
+                self.refs[key] = count
+                return
+            self.refs.pop(key, None)
+            if key in self.pinned:
+                return
+        self.released.append((key, encoded))
+
+    def pin(self, obj):
+        """
+        Never release remote hash of obj, e.g. results cached for the session
+        """
+        handle = obj.__dict__.get(self.KEY) if hasattr(obj, '__dict__') else None
+        if handle:
+            with self._lock:
+                self.pinned.add(handle.key)
+
+    def flush(self):
+        """
+        Delete released remote objects on agent in one batch
+        """
+        encoded = []
+        keys = set()
+        while self.released:
+            key, arg = self.released.popleft()
+            with self._lock:
+                # same java object came back after release, e.g. robotium returns the same view again
+                if self.refs.get(key) or key in self.pinned or key in keys:
+                    continue
+            keys.add(key)
+            encoded.append(arg)
+        if not encoded or self.agent.is_closed:
+            return
+        try:
+            self.agent.call_batch([('delete', arg) for arg in encoded], version=self.version)
+        except (TimeoutError, ConnectionError, ValueError) as e:
+            logger.debug('Release remote objects fail {}'.format(e))
+
+
+def _session_tracker(agent=None):
+    """
+    :return: HandleTracker of agent session, None if there is no agent
+    """
+    agent = agent or context.agent
+    if agent is None:
+        return None
+    cache = _session_cache(agent)
+    tracker = cache.get(('handles',))
+    if tracker is None:
+        tracker = cache.setdefault(('handles',), HandleTracker(agent))
+    return tracker
+
+
+def release_handles(agent=None):
+    """
+    Delete remote objects which are not used any more by host. Runner calls it at case end.
+    :param agent: agent of the case, context.agent if None
+    """
+    tracker = _session_tracker(agent)
+    if tracker:
+        tracker.flush()
+
+
+class _Slot:
+    def __init__(self, index):
+        self.index = index
+
+
+class RemoteRef:
+    """
+    Lazy result of a chain of reflection calls. Nothing is sent until value() is called,
+    then the whole chain is sent as one pipeline and only the final value comes back.
+    e.g.
+    progress = remote_ref(view).get_field('mSeekBarView').call('getProgress').value()
+
+    A pipeline is a list of steps [reflection method name, *args]. An arg of a step may be the
+    result of an earlier step, encoded as SLOT + step index.
+    """
+    def __init__(self, steps=(), target=None):
+        self.steps = tuple(steps)
+        self.target = _Slot(len(self.steps) - 1) if self.steps else target
+
+    def _then(self, method, *args):
+        steps = list(self.steps)
+        step_args = [self.target]
+        for arg in args:
+            if isinstance(arg, RemoteRef):
+                # inline steps of arg ref, its slots move behind the steps of this chain
+                offset = len(steps)
+                steps.extend((step[0],) + tuple(_shift(a, offset) for a in step[1:]) for step in arg.steps)
+                arg = _shift(arg.target, offset)
+            step_args.append(arg)
+        steps.append((method,) + tuple(step_args))
+        return RemoteRef(steps)
+
+    def call(self, method_name, *args):
+        return self._then('call', method_name, *args)
+
+    def get_field(self, field_name):
+        return self._then('get', field_name)
+
+    def value(self, **kwargs):
+        """
+        Run the pipeline.
+        :return: result of the last step
+        """
+        if not self.steps:
+            return self.target
+        return _call_pipeline(self.steps, **kwargs)
+
+
+def _shift(arg, offset):
+    if type(arg) == _Slot:
+        return _Slot(arg.index + offset)
+    return arg
+
+
+def remote_ref(remote_object):
+    """
+    Start a lazy call chain on remote_object, see RemoteRef
+    """
+    return RemoteRef(target=remote_object)
+
+
+def _call_pipeline(steps, **kwargs):
+    agent = context.agent
+    if _is_mutating(steps):
+        view_tree.invalidate(agent)
+    if not agent.capabilities.get('pipeline'):
+        # agent can't resolve slots, run steps one by one
+        results = []
+        for step in steps:
+            args = [results[arg.index] if type(arg) == _Slot else arg for arg in step[1:]]
+            results.append(_call(step[0], *args, **kwargs))
+        return results[-1]
+    encode, version = _arg_encoding(agent)
+    encoded_steps = [[step[0]] + [encode(arg) for arg in step[1:]] for step in steps]
+    with agent.stats.timer('reflection.pipeline'):
+        response = agent.call('pipeline', *encoded_steps, version=version, **kwargs)
+        return _parse_response(response)
+
+
+class _Param:
+    def __init__(self, index):
+        self.index = index
+
+
+_LEGACY_ENCODERS[_Slot] = lambda arg: SLOT+str(arg.index)
+_LEGACY_ENCODERS[_Param] = lambda arg: PARAM+str(arg.index)
+_TYPED_ENCODERS[_Slot] = lambda arg: [SLOT, arg.index]
+_TYPED_ENCODERS[_Param] = lambda arg: [PARAM, arg.index]
+
+
+class RemotePlan:
+    """
+    A block of reflection operations compiled into a plan. The plan is sent to agent once,
+    agent caches it by id (hash of its steps) and runs it by id with parameters in one round trip.
+    Result of a plan is the result of its last step.
+    Use remote_plan decorator to define one:
+
+    @remote_plan
+    def click_id(plan, solo, view_id):
+        view = plan.call(solo, 'getView', view_id)
+        plan.call(solo, 'clickOnView', view)
+
+    click_id(solo, 'com.ifeng.newvideo:id/title')
+    """
+    def __init__(self, build):
+        self.name = build.__name__
+        self.steps = []
+        self.param_count = len(inspect.signature(build).parameters) - 1
+        build(self, *[_Param(index) for index in range(self.param_count)])
+        if not self.steps:
+            raise ValueError('Remote plan {} has no steps'.format(self.name))
+        typed_steps = self._encode_steps(_make_typed_arg)
+        self.plan_id = hashlib.sha1(json.dumps(typed_steps).encode()).hexdigest()[:16]
+        # encoded steps by call version
+        self.encoded_steps = {TYPED_ARGS_VERSION: typed_steps}
+        self.mutating = _is_mutating(self.steps)
+
+    def _encode_steps(self, encode):
+        return [[step[0]] + [encode(arg) for arg in step[1:]] for step in self.steps]
+
+    def _add(self, method, *args):
+        self.steps.append((method,) + args)
+        return _Slot(len(self.steps) - 1)
+
+    def call(self, remote_instance, method_name, *args):
+        return self._add('call', remote_instance, method_name, *args)
+
+    def call_static(self, remote_class, method_name, *args):
+        return self._add('call_static', remote_class, method_name, *args)
+
+    def new(self, remote_class, *args):
+        return self._add('new', remote_class, *args)
+
+    def get_field(self, remote_object, field_name):
+        return self._add('get', remote_object, field_name)
+
+    def set_field(self, remote_object, field_name, value):
+        return self._add('set', remote_object, field_name, value)
+
+    def __call__(self, *params, **kwargs):
+        if len(params) != self.param_count:
+            raise TypeError('Remote plan {} needs {} params, got {}'.format(self.name, self.param_count, len(params)))
+        agent = context.agent
+        if not agent.capabilities.get('plans'):
+            steps = [(step[0],) + tuple(params[arg.index] if type(arg) == _Param else arg for arg in step[1:])
+                     for step in self.steps]
+            return _call_pipeline(steps, **kwargs)
+        if self.mutating:
+            view_tree.invalidate(agent)
+        defined = _session_cache().setdefault(('plans',), set())
+        encode, version = _arg_encoding(agent)
+        encoded_params = [encode(param) for param in params]
+        with agent.stats.timer('reflection.plan.' + self.name):
+            if self.plan_id not in defined:
+                self._define(agent, encode, version)
+                defined.add(self.plan_id)
+            response = agent.call('run_plan', self.plan_id, *encoded_params, version=version, **kwargs)
+            if response.name == 'Fail' and response.args and response.args[0] == PLAN_NOT_FOUND:
+                # agent lost its plan cache
+                self._define(agent, encode, version)
+                response = agent.call('run_plan', self.plan_id, *encoded_params, version=version, **kwargs)
+            return _parse_response(response)
+
+    def _define(self, agent, encode, version):
+        if version not in self.encoded_steps:
+            self.encoded_steps[version] = self._encode_steps(encode)
+        _parse_response(agent.call('define_plan', self.plan_id, *self.encoded_steps[version], version=version))
+
+
+# error of run_plan when agent doesn't know the plan id
+PLAN_NOT_FOUND = 'plan not found'
+
+
+def remote_plan(build):
+    """
+    Decorator compiling build function into a RemotePlan, see RemotePlan
+    """
+    return RemotePlan(build)
+
+
+# session cache of stable remote results: device_id -> (agent, {call key: result}).
+# A reconnected agent is a new instrumentation process, it gets a new cache.
+_session_caches = {}
+_session_lock = Lock()
+
+
+def _session_cache(agent=None):
+    """
+    :return: session cache of agent, a throwaway dict if there is no agent
+    """
+    agent = agent or context.agent
+    if agent is None:
+        return {}
+    with _session_lock:
+        entry = _session_caches.get(agent.device_id)
+        if entry is None or entry[0] is not agent:
+            entry = (agent, {})
+            _session_caches[agent.device_id] = entry
+        return entry[1]
+
+
+def _cached_call(*args, **kwargs):
+    cache = _session_cache()
+    key = json.dumps([_make_typed_arg(arg) for arg in args])
+    if key not in cache:
+        result = _call(*args, **kwargs)
+        tracker = _session_tracker()
+        for obj in result if type(result) == list else [result]:
+            tracker.pin(obj)
+        cache[key] = result
+    return _copy_result(cache[key])
+
+
+def _copy_result(result):
+    # callers may change attrs of returned objects (e.g. class_name), never share the cached one
+    if isinstance(result, RemoteObject):
+        obj = RemoteObject()
+        obj.__dict__ = dict(result.__dict__)
+        return obj
+    elif type(result) == list:
+        return [_copy_result(item) for item in result]
+    return result
+
+
+def clear_session_cache(device_id=None):
+    """
+    Forget cached remote results of device, or of all devices if device_id is None
+    """
+    with _session_lock:
+        if device_id is None:
+            _session_caches.clear()
+        else:
+            _session_caches.pop(device_id, None)
+
+
 def remote_call(remote_instance, method_name, *args, **kwargs):
     return _call('call', remote_instance, method_name, *args, **kwargs)
 
@@ -104,6 +692,10 @@ def remote_new(class_name, *args, **kwargs):
 
 
 def remote_delete(remote_instance, **kwargs):
+    # deleted now, tracker must not delete it again
+    tracker = _session_tracker()
+    if tracker:
+        tracker.pin(remote_instance)
     return _call('delete', remote_instance, **kwargs)
 
 
@@ -113,3 +705,49 @@ def remote_set_field(remote_object, field_name, value):
 
 def remote_get_field(remote_object, field_name):
     return _call('get', remote_object, field_name)
+
+
+def remote_call_cached(remote_instance, method_name, *args, **kwargs):
+    """
+    remote_call whose result is cached for the agent session.
+    Only use it for results which never change while instrumentation runs, e.g. instrumentation.getContext()
+    """
+    return _cached_call('call', remote_instance, method_name, *args, **kwargs)
+
+
+def remote_call_static_cached(remote_class, method_name, *args, **kwargs):
+    """
+    remote_call_static whose result is cached for the agent session, e.g. singletons like
+    InstrumentationRegistry.getInstrumentation()
+    """
+    return _cached_call('call_static', remote_class, method_name, *args, **kwargs)
+
+
+def remote_batch(*calls, **kwargs):
+    """
+    Run independent reflection calls in one round trip.
+    e.g.
+    remote_batch(('get', view, 'mText'), ('call', view, 'isShown'))
+
+    :param calls: (reflection method name, *args) tuples. method name is one of
+    'call', 'call_static', 'new', 'delete', 'set', 'get'
+    :return: list of results in calls order
+    """
+    return _call_batch(calls, **kwargs)
+
+
+def supports_events():
+    """
+    :return: True if agent pushes ui events, see RPCAgent.subscribe
+    """
+    return context.agent.supports_events
+
+
+def subscribe(name, match=None, replay_last=False):
+    """
+    Subscribe ui event pushed by agent. Use as context manager and wait before deadline:
+
+    with subscribe('view_appeared', match=lambda data: data.get('text') == 'OK') as subscription:
+        subscription.wait(timeout=20)
+    """
+    return context.agent.subscribe(name, match=match, replay_last=replay_last)
@@ -3,19 +3,52 @@ Python rpc agent
 Use for test rpc server
 """
 import socket
-from threading import Thread
+import time
+import random
+import bisect
+import itertools
+import multiprocessing
+from collections import deque
+from threading import Thread, Event, Lock
 import logging
 import json
+from uitester.test_manager import rpc_server, rpc_codec, rpc_trace, rpc_stats
+
+try:
+    import resource
+except ImportError:
+    # not available on windows, swarm report has no max rss
+    resource = None
 
 
 logger = logging.getLogger('Tester')
 
 
 class Agent:
-    def __init__(self, device_id):
+    def __init__(self, device_id, framing=rpc_server.FRAMING_VERSIONS, codecs=('compact', 'json'),
+                 compression=('zlib',)):
         self.device_id = device_id
         self.sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
         self.real_func = {}
+        # framing versions advertised at register
+        self.supported_framing = list(framing)
+        self.framing = rpc_server.FRAMING_LINE
+        # codecs advertised at register, in preferred order
+        self.supported_codecs = list(codecs)
+        self.codec = rpc_codec.JSON
+        self.supported_compression = list(compression)
+        self.compressor = None
+        self.compress_threshold = rpc_server.COMPRESS_THRESHOLD
+        # set False to simulate a hanging agent
+        self.respond_ping = True
+        # advertised at register together with framing, codecs, compression and events
+        self.capabilities = {'batch': True, 'heartbeat': True}
+        # event names advertised at register, see push_event
+        self.events = ['activity', 'view_appeared', 'toast_shown', 'dialog']
+        self.rfile = None
+        self._send_lock = Lock()
+        # set when register result is received and negotiated settings are applied
+        self.registered = Event()
 
     def start(self, host, port):
         self.sock.connect((host, port))
@@ -32,48 +65,159 @@ class Agent:
             'name': 'unregister',
             'args': []
         }
-        self.sock.sendall((json.dumps(unregister_msg) + '\n').encode())
+        self.send_msg(unregister_msg)
         self.sock.close()
 
+    def send_msg(self, msg_dict):
+        if self.framing == rpc_server.FRAMING_LENGTH:
+            data = self.codec.dumps(msg_dict)
+            flags = 0
+            if self.compressor and len(data) > self.compress_threshold:
+                data = self.compressor.compress(data)
+                flags = rpc_server.FLAG_COMPRESSED
+            data = rpc_server.FRAME_HEADER.pack(len(data), flags) + data
+        else:
+            data = (rpc_server.encode(json.dumps(msg_dict)) + '\n').encode()
+        # events are pushed from other threads
+        with self._send_lock:
+            self.sock.sendall(data)
+
+    def push_event(self, name, data=None):
+        """
+        Push an event to server, e.g. push_event('activity', {'name': 'MainActivity'})
+        """
+        self.registered.wait()
+        self.send_msg({'msg_type': rpc_server.RPCMessage.RPC_EVENT, 'msg_id': None, 'version': 1,
+                       'name': name, 'args': [data]})
+
+    def read_msg(self):
+        """
+        :return: message dict, None if connection closed
+        """
+        if self.framing == rpc_server.FRAMING_LENGTH:
+            header = self.rfile.read(rpc_server.FRAME_HEADER.size)
+            if len(header) < rpc_server.FRAME_HEADER.size:
+                return None
+            length, flags = rpc_server.FRAME_HEADER.unpack(header)
+            payload = self.rfile.read(length)
+            if flags & rpc_server.FLAG_COMPRESSED:
+                payload = self.compressor.decompress(payload)
+            return self.codec.loads(payload)
+        line = self.rfile.readline()
+        if len(line) == 0:
+            return None
+        return json.loads(rpc_server.decode(line.decode()))
+
     def receive_msg(self):
         register_msg = {
             'msg_type': 1,
             'msg_id': 1,
             'version': 1,
             'name': 'register',
-            'args': [self.device_id]
+            'args': [self.device_id, dict(
+                self.capabilities,
+                framing=self.supported_framing,
+                codecs=self.supported_codecs,
+                compression=self.supported_compression,
+                events=self.events
+            )]
         }
+        self.send_msg(register_msg)
+        self.rfile = self.sock.makefile(mode='rb')
+        register_result = self.read_msg()
+        #register success
+        print(register_result)
+        if register_result and len(register_result['args']) > 1:
+            settings = register_result['args'][1]
+            self.framing = settings.get('framing', rpc_server.FRAMING_LINE)
+            self.codec = rpc_codec.get_codec(settings.get('codec', 'json'))
+            if 'compression' in settings:
+                self.compressor = rpc_codec.get_compressor(settings['compression'])
+                self.compress_threshold = settings['compress_threshold']
+        self.registered.set()
+        while True:
+            call_obj = self.read_msg()
+            if call_obj is None or call_obj['msg_type'] == rpc_server.RPCMessage.RPC_KILL_SIGNAL:
+                break
+            logger.debug('receive msg : {}'.format(call_obj))
+            if call_obj['msg_type'] == rpc_server.RPCMessage.RPC_PING:
+                if self.respond_ping:
+                    self.send_msg({'msg_type': rpc_server.RPCMessage.RPC_PONG, 'msg_id': call_obj['msg_id'],
+                                   'version': 1, 'name': 'pong', 'args': []})
+                continue
+            if call_obj['msg_type'] == rpc_server.RPCMessage.RPC_BATCH:
+                # batch call, respond all results in one message
+                response_msg = {
+                    'msg_type': 2,
+                    'msg_id': call_obj['msg_id'],
+                    'version': 1,
+                    'name': 'batch',
+                    'args': [self.handle_call(sub_call) for sub_call in call_obj['args']]
+                }
+            else:
+                response_msg = self.handle_call(call_obj)
+            self.send_msg(response_msg)
+
+    def handle_call(self, call_obj):
         response_msg = {
             'msg_type': 2,
-            'msg_id': 1,
+            'msg_id': call_obj['msg_id'],
             'version': 1,
             'name': 'response',
             'args': []
         }
-        self.sock.sendall((json.dumps(register_msg) + '\n').encode())
-        r_buffer = self.sock.makefile(mode='r')
-        register_result = r_buffer.readline()
-        #register success
-        print(register_result)
-        while True:
-            line = r_buffer.readline()
-            logger.debug('receive msg : {}'.format(line))
-            call_obj = json.loads(line)
-            method_name = call_obj['name']
-            func = self.real_func.get(method_name)
-            if func:
-                res = func(call_obj['args'])
-                response_msg['args'] = [res]
-                response_msg['msg_id'] = call_obj['msg_id']
-            else:
-                response_msg['name'] = 'error'
-                response_msg['args'] = ['{}: method not found'.format(method_name)]
-            self.sock.sendall((json.dumps(response_msg) + '\n').encode())
+        method_name = call_obj['name']
+        func = self.real_func.get(method_name)
+        if func:
+            res = func(*call_obj['args'])
+            response_msg['args'] = [res]
+        else:
+            response_msg['name'] = 'error'
+            response_msg['args'] = ['{}: method not found'.format(method_name)]
+        return response_msg
 
     def add_func(self, func_name, func):
         self.real_func[func_name] = func
 
 
+class ReplayAgent(Agent):
+    """
+    Agent serving responses from a trace recorded by RPCAgent.start_recording.
+    Calls are matched by name and args. Repeated calls get the recorded responses in order,
+    the last one is repeated when they run out.
+    """
+    def __init__(self, device_id, trace_path, latency_scale=1.0, **kwargs):
+        """
+        :param latency_scale: recorded latency multiplier. 0 responds immediately
+        """
+        super().__init__(device_id, **kwargs)
+        self.latency_scale = latency_scale
+        self.records = {}
+        for record in rpc_trace.read_trace(trace_path):
+            self.records.setdefault(self._key(record['name'], record['args']), deque()).append(record)
+
+    @staticmethod
+    def _key(name, args):
+        return json.dumps([name, args], sort_keys=True)
+
+    def handle_call(self, call_obj):
+        records = self.records.get(self._key(call_obj['name'], call_obj['args']))
+        if not records:
+            response_msg = {'msg_type': 2, 'msg_id': call_obj['msg_id'], 'version': 1, 'name': 'error',
+                            'args': ['{}: call not found in trace'.format(call_obj['name'])]}
+            return response_msg
+        record = records.popleft() if len(records) > 1 else records[0]
+        if self.latency_scale:
+            time.sleep(record['latency'] * self.latency_scale)
+        return {
+            'msg_type': 2,
+            'msg_id': call_obj['msg_id'],
+            'version': 1,
+            'name': record['result']['name'],
+            'args': record['result']['args']
+        }
+
+
 def hello():
     logger.info('Agent: Hello')
     return True
@@ -84,6 +228,19 @@ def get_view(view_id):
     return {'id': view_id, 'class': 'TextView', 'text': None, 'hash': 123456}
 
 
+def get_view_tree():
+    logger.info('Agent: GetViewTree')
+    return {
+        'fields': ['hash', 'parent', 'resource_id', 'class_name', 'text', 'bounds', 'visible'],
+        'nodes': [
+            [1000, -1, 'android:id/content', 'android.widget.FrameLayout', None, [0, 0, 1080, 1920], True],
+            [1001, 0, 'id-1', 'android.widget.TextView', 'Hello', [0, 0, 1080, 100], True],
+            [1002, 0, 'list', 'android.widget.ListView', None, [0, 100, 1080, 1920], False],
+            [1003, 2, 'title', 'android.widget.TextView', 'Item', [0, 100, 1080, 200], True]
+        ]
+    }
+
+
 def start_app(package_name):
     logger.info('Agent: StartApp bt package name [{}]'.format(package_name))
     return True
@@ -118,6 +275,8 @@ def get_test_agent(device_id):
     _agent = Agent(device_id)
     _agent.add_func('hello', hello)
     _agent.add_func('GetView', get_view)
+    _agent.add_func('GetViewTree', get_view_tree)
+    _agent.capabilities['view_tree'] = True
     _agent.add_func('LaunchApp', start_app)
     _agent.add_func('FinishApp', finish_app)
     _agent.add_func('ClickOnText', click_on_text)
@@ -125,3 +284,137 @@ def get_test_agent(device_id):
     _agent.add_func('WaitForText', wait_for_text)
     _agent.add_func('ClickOnView', click_on_view)
     return _agent
+
+
+# swarm calls: method name -> args maker, args are made from payload size
+SWARM_CALLS = {
+    'hello': lambda size: (),
+    'GetView': lambda size: ('id-1',),
+    'Echo': lambda size: ('x' * size,),
+    'Payload': lambda size: (size,),
+}
+DEFAULT_CALL_MIX = {'hello': 1, 'GetView': 4, 'Echo': 1, 'Payload': 1}
+
+
+def get_swarm_agent(device_id):
+    _agent = get_test_agent(device_id)
+    _agent.add_func('Echo', lambda text: text)
+    _agent.add_func('Payload', lambda size: 'x' * size)
+    return _agent
+
+
+def _run_swarm_agents(host, port, device_ids, stop_event):
+    """
+    Swarm agents of one process. Runs until stop_event is set.
+    """
+    logging.getLogger('Tester').setLevel(logging.WARNING)
+    _agents = [get_swarm_agent(device_id) for device_id in device_ids]
+    for _agent in _agents:
+        _agent.start(host, port)
+    stop_event.wait()
+    for _agent in _agents:
+        # shutdown first, reader thread keeps the socket open by its file object
+        _agent.sock.shutdown(socket.SHUT_RDWR)
+        _agent.sock.close()
+
+
+def run_swarm(server, agent_count=10, duration=10, call_mix=None, payload_size=100, think_time=0,
+              processes=1, register_timeout=30):
+    """
+    Load test rpc server with a swarm of simulated agents.
+    Agents run in separate processes, so cpu and memory of this process are the server side cost.
+    Every agent has one caller thread on the server side, it calls a random method of call_mix
+    and waits think_time between calls.
+
+    :param server: rpc server, e.g. rpc_server.start(port)
+    :param call_mix: {method name in SWARM_CALLS: weight}
+    :param payload_size: size of Echo argument and Payload response
+    :param processes: agent processes. 0 runs agents as threads of this process
+    :return: report dict, see format_swarm_report
+    """
+    call_mix = call_mix or DEFAULT_CALL_MIX
+    methods = list(call_mix)
+    cum_weights = list(itertools.accumulate(call_mix[method] for method in methods))
+    host, port = server.server_address[:2]
+    device_ids = ['swarm-{}'.format(index) for index in range(agent_count)]
+
+    workers = []
+    if processes:
+        stop_event = multiprocessing.Event()
+        for index in range(processes):
+            worker = multiprocessing.Process(
+                target=_run_swarm_agents, args=(host, port, device_ids[index::processes], stop_event), daemon=True)
+            worker.start()
+            workers.append(worker)
+    else:
+        stop_event = Event()
+        worker = Thread(target=_run_swarm_agents, args=(host, port, device_ids, stop_event), daemon=True)
+        worker.start()
+        workers.append(worker)
+
+    try:
+        agent_proxies = []
+        for device_id in device_ids:
+            agent_proxy = server.wait_agent(device_id, timeout=register_timeout)
+            if agent_proxy is None:
+                raise TimeoutError('Swarm agent {} not registered'.format(device_id))
+            agent_proxies.append(agent_proxy)
+
+        histograms = [rpc_stats.LatencyHistogram() for _ in agent_proxies]
+        errors = [0] * len(agent_proxies)
+        start_wall = time.perf_counter()
+        start_cpu = time.process_time()
+        deadline = start_wall + duration
+
+        def caller(index):
+            agent_proxy = agent_proxies[index]
+            rand = random.Random(index)
+            while time.perf_counter() < deadline:
+                method = methods[bisect.bisect(cum_weights, rand.random() * cum_weights[-1])]
+                call_start = time.perf_counter()
+                try:
+                    response = agent_proxy.call(method, *SWARM_CALLS[method](payload_size), timeout=duration)
+                    if response.name == 'error':
+                        errors[index] += 1
+                except (TimeoutError, ConnectionError):
+                    errors[index] += 1
+                histograms[index].record(time.perf_counter() - call_start)
+                if think_time:
+                    time.sleep(think_time)
+
+        callers = [Thread(target=caller, args=(index,), daemon=True) for index in range(len(agent_proxies))]
+        for t in callers:
+            t.start()
+        for t in callers:
+            t.join()
+        wall = time.perf_counter() - start_wall
+        cpu = time.process_time() - start_cpu
+    finally:
+        stop_event.set()
+        for worker in workers:
+            worker.join(5)
+
+    latency = rpc_stats.LatencyHistogram()
+    for histogram in histograms:
+        latency.merge(histogram)
+    return {
+        'agents': agent_count,
+        'duration': wall,
+        'calls': latency.total,
+        'errors': sum(errors),
+        'calls_per_second': latency.total / wall,
+        'latency': latency.snapshot(),
+        # cpu time of this process / wall time, 1.0 is one core fully used
+        'server_cpu': cpu / wall,
+        'server_max_rss_kb': resource.getrusage(resource.RUSAGE_SELF).ru_maxrss if resource else None
+    }
+
+
+def format_swarm_report(report):
+    latency = report['latency']
+    return ('agents: {agents}  calls: {calls}  errors: {errors}  duration: {duration:.1f}s\n'
+            'calls/s: {calls_per_second:.1f}\n'
+            'latency ms: p50 {p50:.2f}  p90 {p90:.2f}  p99 {p99:.2f}  max {max:.2f}\n'
+            'server cpu: {server_cpu:.0%}  max rss: {server_max_rss_kb} KB').format(
+        p50=latency['p50'] * 1000, p90=latency['p90'] * 1000, p99=latency['p99'] * 1000,
+        max=latency['max'] * 1000, **report)
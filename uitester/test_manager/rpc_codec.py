@@ -0,0 +1,279 @@
+"""
+RPC message payload codecs and compressors.
+Codec and compressor are negotiated at register, see RPCConnection.negotiate.
+
+json: baseline codec, every agent supports it.
+compact: MessagePack style binary codec. Map keys are interned per message,
+         a repeated key (e.g. hash, class_name, resource_id) is sent as a 2 byte reference.
+"""
+import json
+import lzma
+import struct
+import zlib
+
+
+class JSONCodec:
+    name = 'json'
+
+    def dumps(self, obj):
+        return json.dumps(obj).encode()
+
+    def loads(self, payload):
+        return json.loads(str(payload, 'utf-8'))
+
+
+class CompactCodec:
+    """
+    MessagePack subset plus interned key reference.
+
+    nil 0xc0, false 0xc2, true 0xc3
+    int: positive fixint, negative fixint, int8/16/32/64 0xd0-0xd3
+    float: float64 0xcb
+    str: fixstr 0xa0-0xbf, str8 0xd9, str16 0xda, str32 0xdb
+    bin: bin8 0xc4, bin16 0xc5, bin32 0xc6
+    array: fixarray 0x90-0x9f, array16 0xdc, array32 0xdd
+    map: fixmap 0x80-0x8f, map16 0xde, map32 0xdf
+    key reference: 0xc1 + uint8 index of the key in the order keys first appeared
+    """
+    name = 'compact'
+    KEY_REF = 0xc1
+    MAX_KEYS = 256
+
+    def dumps(self, obj):
+        out = bytearray()
+        self._pack(obj, out, {})
+        return bytes(out)
+
+    def loads(self, payload):
+        obj, pos = self._unpack(bytes(payload), 0, [])
+        return obj
+
+    def _pack(self, obj, out, keys):
+        obj_type = type(obj)
+        if obj is None:
+            out.append(0xc0)
+        elif obj_type is bool:
+            out.append(0xc3 if obj else 0xc2)
+        elif obj_type is int:
+            self._pack_int(obj, out)
+        elif obj_type is float:
+            out.append(0xcb)
+            out += _DOUBLE.pack(obj)
+        elif obj_type is str:
+            self._pack_str(obj, out)
+        elif obj_type is list or obj_type is tuple:
+            self._pack_header(len(obj), out, 0x90, 0xdc, 0xdd)
+            for item in obj:
+                self._pack(item, out, keys)
+        elif obj_type is dict:
+            self._pack_header(len(obj), out, 0x80, 0xde, 0xdf)
+            for key, value in obj.items():
+                index = keys.get(key)
+                if index is not None:
+                    out.append(self.KEY_REF)
+                    out.append(index)
+                else:
+                    if type(key) is str and len(keys) < self.MAX_KEYS:
+                        keys[key] = len(keys)
+                    self._pack(key, out, keys)
+                self._pack(value, out, keys)
+        elif obj_type is bytes or obj_type is bytearray:
+            length = len(obj)
+            if length < 0x100:
+                out.append(0xc4)
+                out.append(length)
+            elif length < 0x10000:
+                out.append(0xc5)
+                out += _UINT16.pack(length)
+            else:
+                out.append(0xc6)
+                out += _UINT32.pack(length)
+            out += obj
+        else:
+            raise TypeError('Object of type {} is not serializable by compact codec'.format(obj_type.__name__))
+
+    @staticmethod
+    def _pack_int(obj, out):
+        if 0 <= obj < 0x80:
+            out.append(obj)
+        elif -0x20 <= obj < 0:
+            out.append(obj & 0xff)
+        elif -0x80 <= obj < 0x80:
+            out.append(0xd0)
+            out += _INT8.pack(obj)
+        elif -0x8000 <= obj < 0x8000:
+            out.append(0xd1)
+            out += _INT16.pack(obj)
+        elif -0x80000000 <= obj < 0x80000000:
+            out.append(0xd2)
+            out += _INT32.pack(obj)
+        else:
+            out.append(0xd3)
+            out += _INT64.pack(obj)
+
+    @staticmethod
+    def _pack_str(obj, out):
+        data = obj.encode()
+        length = len(data)
+        if length < 0x20:
+            out.append(0xa0 | length)
+        elif length < 0x100:
+            out.append(0xd9)
+            out.append(length)
+        elif length < 0x10000:
+            out.append(0xda)
+            out += _UINT16.pack(length)
+        else:
+            out.append(0xdb)
+            out += _UINT32.pack(length)
+        out += data
+
+    @staticmethod
+    def _pack_header(length, out, fix_tag, tag16, tag32):
+        if length < 0x10:
+            out.append(fix_tag | length)
+        elif length < 0x10000:
+            out.append(tag16)
+            out += _UINT16.pack(length)
+        else:
+            out.append(tag32)
+            out += _UINT32.pack(length)
+
+    def _unpack(self, data, pos, keys):
+        tag = data[pos]
+        pos += 1
+        if tag < 0x80:
+            return tag, pos
+        elif tag >= 0xe0:
+            return tag - 0x100, pos
+        elif 0xa0 <= tag <= 0xbf:
+            end = pos + (tag & 0x1f)
+            return data[pos:end].decode(), end
+        elif 0x90 <= tag <= 0x9f:
+            return self._unpack_array(data, pos, tag & 0x0f, keys)
+        elif 0x80 <= tag <= 0x8f:
+            return self._unpack_map(data, pos, tag & 0x0f, keys)
+        elif tag == 0xc0:
+            return None, pos
+        elif tag == 0xc2:
+            return False, pos
+        elif tag == 0xc3:
+            return True, pos
+        elif tag == self.KEY_REF:
+            return keys[data[pos]], pos + 1
+        elif tag in _FIXED:
+            fmt = _FIXED[tag]
+            return fmt.unpack_from(data, pos)[0], pos + fmt.size
+        elif tag in _STR_LEN:
+            fmt = _STR_LEN[tag]
+            length = fmt.unpack_from(data, pos)[0]
+            pos += fmt.size
+            return data[pos:pos + length].decode(), pos + length
+        elif tag in _BIN_LEN:
+            fmt = _BIN_LEN[tag]
+            length = fmt.unpack_from(data, pos)[0]
+            pos += fmt.size
+            return data[pos:pos + length], pos + length
+        elif tag == 0xdc or tag == 0xdd:
+            fmt = _UINT16 if tag == 0xdc else _UINT32
+            return self._unpack_array(data, pos + fmt.size, fmt.unpack_from(data, pos)[0], keys)
+        elif tag == 0xde or tag == 0xdf:
+            fmt = _UINT16 if tag == 0xde else _UINT32
+            return self._unpack_map(data, pos + fmt.size, fmt.unpack_from(data, pos)[0], keys)
+        raise ValueError('Unknown compact codec tag 0x{:02x} at {}'.format(tag, pos - 1))
+
+    def _unpack_array(self, data, pos, length, keys):
+        items = []
+        for _ in range(length):
+            item, pos = self._unpack(data, pos, keys)
+            items.append(item)
+        return items, pos
+
+    def _unpack_map(self, data, pos, length, keys):
+        obj = {}
+        for _ in range(length):
+            if data[pos] == self.KEY_REF:
+                key = keys[data[pos + 1]]
+                pos += 2
+            else:
+                key, pos = self._unpack(data, pos, keys)
+                if type(key) is str and len(keys) < self.MAX_KEYS:
+                    keys.append(key)
+            obj[key], pos = self._unpack(data, pos, keys)
+        return obj, pos
+
+
+_INT8 = struct.Struct('>b')
+_INT16 = struct.Struct('>h')
+_INT32 = struct.Struct('>i')
+_INT64 = struct.Struct('>q')
+_UINT8 = struct.Struct('>B')
+_UINT16 = struct.Struct('>H')
+_UINT32 = struct.Struct('>I')
+_UINT64 = struct.Struct('>Q')
+_DOUBLE = struct.Struct('>d')
+_FLOAT = struct.Struct('>f')
+
+_FIXED = {
+    0xca: _FLOAT, 0xcb: _DOUBLE,
+    0xcc: _UINT8, 0xcd: _UINT16, 0xce: _UINT32, 0xcf: _UINT64,
+    0xd0: _INT8, 0xd1: _INT16, 0xd2: _INT32, 0xd3: _INT64,
+}
+_STR_LEN = {0xd9: _UINT8, 0xda: _UINT16, 0xdb: _UINT32}
+_BIN_LEN = {0xc4: _UINT8, 0xc5: _UINT16, 0xc6: _UINT32}
+
+
+class ZlibCompressor:
+    name = 'zlib'
+
+    def compress(self, data):
+        # fast level, payload compression is on the rpc latency path
+        return zlib.compress(data, 1)
+
+    def decompress(self, data):
+        return zlib.decompress(data)
+
+
+class LZMACompressor:
+    name = 'lzma'
+
+    def compress(self, data):
+        return lzma.compress(data, preset=0)
+
+    def decompress(self, data):
+        return lzma.decompress(data)
+
+
+JSON = JSONCodec()
+COMPACT = CompactCodec()
+
+codecs = {}
+compressors = {}
+
+
+def register_codec(codec):
+    """
+    Register a payload codec. Codec needs attr name and functions dumps(obj)->bytes, loads(bytes)->obj
+    """
+    codecs[codec.name] = codec
+
+
+def get_codec(name):
+    return codecs.get(name)
+
+
+def register_compressor(compressor):
+    """
+    Register a payload compressor. Compressor needs attr name and functions compress(bytes), decompress(bytes)
+    """
+    compressors[compressor.name] = compressor
+
+
+def get_compressor(name):
+    return compressors.get(name)
+
+
+register_codec(JSON)
+register_codec(COMPACT)
+register_compressor(ZlibCompressor())
+register_compressor(LZMACompressor())
@@ -1,8 +1,13 @@
 from socketserver import ThreadingTCPServer, StreamRequestHandler
+from concurrent.futures import Future, TimeoutError as FutureTimeoutError
+import asyncio
 import json
-from threading import Thread
+import socket
+import struct
+import time
+from threading import Thread, Lock, Event, Condition
 import logging
-import queue
+from uitester.test_manager import rpc_codec, rpc_stats, rpc_trace
 
 
 logger = logging.getLogger('Tester')
@@ -10,64 +15,293 @@ logger = logging.getLogger('Tester')
 Timeout = 120
 Port = 11800
 
+# server modes, see Config.rpc_server_mode
+THREAD_MODE = 'thread'
+ASYNCIO_MODE = 'asyncio'
+
+# max line length of asyncio stream reader, large view dumps need a big buffer
+_STREAM_LIMIT = 16 * 1024 * 1024
+
+# message framing, negotiated at register.
+# FRAMING_LINE: escaped json + '\n'. Default for agents which don't advertise framing.
+# FRAMING_LENGTH: frame header + raw utf-8 json payload
+FRAMING_LINE = 1
+FRAMING_LENGTH = 2
+FRAMING_VERSIONS = (FRAMING_LINE, FRAMING_LENGTH)
+# frame header: payload length, flags
+FRAME_HEADER = struct.Struct('>IB')
+# larger frames drop the connection, header length is not trusted
+MAX_FRAME_SIZE = 64 * 1024 * 1024
+# frame flag: payload is compressed by the compressor negotiated at register
+FLAG_COMPRESSED = 0x01
+# payloads larger than this are compressed, small calls stay uncompressed
+COMPRESS_THRESHOLD = 4096
+
+# heartbeat, only for agents which advertise heartbeat capability.
+# agent is dead after HEARTBEAT_MISS_COUNT pings without any message from it.
+HEARTBEAT_INTERVAL = 5
+HEARTBEAT_MISS_COUNT = 3
+# agent may answer pings and calls in one loop, it gets more pings while a call is running
+HEARTBEAT_BUSY_MISS_COUNT = 12
+
+
+class AgentRegistry:
+    """
+    Registered agents table. Shared by threaded and asyncio rpc server.
+    """
+    def init_agents(self, heartbeat_interval=HEARTBEAT_INTERVAL, heartbeat_miss_count=HEARTBEAT_MISS_COUNT,
+                    heartbeat_busy_miss_count=HEARTBEAT_BUSY_MISS_COUNT):
+        self._agents = {}
+        self._agents_changed = Condition()
+        self.heartbeat = HeartbeatMonitor(self, heartbeat_interval, heartbeat_miss_count, heartbeat_busy_miss_count)
+        self._stats = {}
 
-class RPCServer(ThreadingTCPServer):
+    def get_stats(self, device_id):
+        """
+        :return: RPCStats of device, kept across agent reconnects
+        """
+        with self._agents_changed:
+            return self._stats.setdefault(device_id, rpc_stats.RPCStats())
 
-    def __init__(self, server_address, RequestHandlerClass, bind_and_activate=True):
-        super().__init__(server_address, RequestHandlerClass, bind_and_activate)
-        self._agents = {}
+    def stats_snapshot(self):
+        """
+        :return: {device_id: {method: stats dict}}
+        """
+        with self._agents_changed:
+            stats = dict(self._stats)
+        return {device_id: device_stats.snapshot() for device_id, device_stats in stats.items()}
 
     def add_agent(self, agent):
-        self._agents[agent.device_id] = agent
+        with self._agents_changed:
+            self._agents[agent.device_id] = agent
+            self._agents_changed.notify_all()
+        if agent.capabilities.get('heartbeat'):
+            self.heartbeat.watch(agent)
 
-    def rm_agent(self, device_id):
-        self._agents.pop(device_id)
+    def rm_agent(self, device_id, agent=None):
+        """
+        :param agent: only remove the agent if it is still the registered one.
+        A closing connection must not remove the agent of a newer connection.
+        """
+        with self._agents_changed:
+            if agent is None or self._agents.get(device_id) is agent:
+                self._agents.pop(device_id, None)
 
     def get_agent(self, device_id):
         return self._agents.get(device_id)
 
+    def wait_agent(self, device_id, timeout=None):
+        """
+        Block until agent of device_id registers.
+        :return: agent, None if timeout
+        """
+        with self._agents_changed:
+            self._agents_changed.wait_for(lambda: device_id in self._agents, timeout)
+            return self._agents.get(device_id)
 
-class RPCHandler(StreamRequestHandler):
 
-    def __init__(self, request, client_address, server):
-        self.has_register = False
-        self.agent_proxy = None
-        super().__init__(request, client_address, server)
+class RPCServer(AgentRegistry, ThreadingTCPServer):
 
-    def handle(self):
-        while True:
-            line = self.rfile.readline().decode().strip()
-            if len(line) == 0:
-                break
-            try:
-                msg = RPCMessage.from_json(line)
-                if not self.has_register:
-                    self.handle_register(msg)
-                elif msg.msg_type == RPCMessage.RPC_KILL_SIGNAL:
-                    self.handle_unregister()
+    def __init__(self, server_address, RequestHandlerClass, bind_and_activate=True, **heartbeat):
+        self.init_agents(**heartbeat)
+        super().__init__(server_address, RequestHandlerClass, bind_and_activate)
+
+    def shutdown(self):
+        self.heartbeat.stop()
+        super().shutdown()
+
+
+class AsyncRPCServer(AgentRegistry):
+    """
+    RPC server running all agent connections on one asyncio event loop.
+    It has the same interface as RPCServer, serve_forever() runs the loop in current thread.
+    """
+    def __init__(self, server_address, **heartbeat):
+        self.init_agents(**heartbeat)
+        self.loop = asyncio.new_event_loop()
+        self._stopped = Event()
+        self._server = self.loop.run_until_complete(
+            asyncio.start_server(self.handle_connection, *server_address, limit=_STREAM_LIMIT))
+        self.server_address = self._server.sockets[0].getsockname()[:2]
+
+    async def handle_connection(self, reader, writer):
+        await AsyncRPCHandler(reader, writer, self).handle()
+
+    def serve_forever(self):
+        asyncio.set_event_loop(self.loop)
+        self._stopped.clear()
+        try:
+            self.loop.run_forever()
+        finally:
+            self._stopped.set()
+
+    def shutdown(self):
+        self.heartbeat.stop()
+        self.loop.call_soon_threadsafe(self.loop.stop)
+        self._stopped.wait()
+
+    def server_close(self):
+        self._server.close()
+        self.loop.run_until_complete(self._server.wait_closed())
+        self.loop.close()
+
+
+class HeartbeatMonitor:
+    """
+    Ping watched agents every interval. Agent which doesn't send anything for miss_count pings is dead:
+    all its pending calls fail immediately and it is removed from server.
+    Agent may answer pings and calls in one loop, so while a call is running it is dead after busy_miss_count pings.
+    """
+    def __init__(self, server, interval, miss_count, busy_miss_count=HEARTBEAT_BUSY_MISS_COUNT):
+        self.server = server
+        self.interval = interval
+        self.miss_count = miss_count
+        self.busy_miss_count = max(miss_count, busy_miss_count)
+        self._agents = set()
+        self._lock = Lock()
+        self._stopped = Event()
+        self._thread = None
+
+    def watch(self, agent):
+        if not self.interval:
+            return
+        with self._lock:
+            self._agents.add(agent)
+            if self._thread is None:
+                self._thread = Thread(target=self._run, daemon=True)
+                self._thread.start()
+
+    def stop(self):
+        self._stopped.set()
+
+    def _run(self):
+        while not self._stopped.wait(self.interval):
+            with self._lock:
+                agents = list(self._agents)
+            for agent in agents:
+                if agent.is_closed:
+                    self._forget(agent)
+                elif agent.missed_pings >= (self.busy_miss_count if agent.busy else self.miss_count):
+                    self._forget(agent)
+                    self.server.rm_agent(agent.device_id, agent)
+                    agent.set_dead('Agent heartbeat timeout, {} pings missed'.format(agent.missed_pings))
                 else:
-                    self.handle_message(msg)
-            except Exception as e:
-                print(e.args)
-                continue
+                    agent.ping()
+
+    def _forget(self, agent):
+        with self._lock:
+            self._agents.discard(agent)
+
+
+class RPCConnection:
+    """
+    Agent side protocol: register, unregister and dispatch responses.
+    Subclass should set self.server, self.wfile and implement close_connection()
+    """
+    has_register = False
+    agent_proxy = None
+    framing = FRAMING_LINE
+    codec = rpc_codec.JSON
+    compressor = None
+
+    def handle_line(self, line):
+        self.handle_msg(RPCMessage.from_json, line)
+
+    def handle_frame(self, payload, flags=0):
+        if flags & FLAG_COMPRESSED:
+            self.handle_msg(self._load_compressed_frame, payload)
+        else:
+            self.handle_msg(self._load_frame, payload)
+
+    def _load_frame(self, payload):
+        return RPCMessage.from_frame(payload, codec=self.codec)
+
+    def _load_compressed_frame(self, payload):
+        raw_payload = self.compressor.decompress(payload)
+        msg = self._load_frame(raw_payload)
+        if self.agent_proxy:
+            self.agent_proxy.compression_stats.add(
+                self.agent_proxy.method_of(msg), len(raw_payload), len(payload))
+        return msg
+
+    def handle_msg(self, loads, data):
+        try:
+            msg = loads(data)
+            if not self.has_register:
+                self.handle_register(msg)
+                return
+            # any message from agent proves it is alive
+            self.agent_proxy.missed_pings = 0
+            self.agent_proxy.stats.add_bytes_in(self.agent_proxy.method_of(msg), len(data))
+            if msg.msg_type == RPCMessage.RPC_KILL_SIGNAL:
+                self.handle_unregister()
+            elif msg.msg_type == RPCMessage.RPC_EVENT:
+                self.agent_proxy.handle_event(msg)
+            elif msg.msg_type != RPCMessage.RPC_PONG:
+                self.handle_message(msg)
+        except Exception as e:
+            print(e.args)
+
+    def handle_close(self):
         if self.has_register:
-            self.server.rm_agent(self.agent_proxy.device_id)
+            self.server.rm_agent(self.agent_proxy.device_id, self.agent_proxy)
+            if not self.agent_proxy.is_closed:
+                # connection lost without kill signal
+                self.agent_proxy.set_dead('Agent connection closed')
 
     def handle_register(self, msg):
         if msg.msg_type == RPCMessage.RPC_CALL and msg.name == 'register':
             if len(msg.args) < 1:
                 res = self._make_error_msg()
                 self.wfile.write(res.to_bytes())
+                return
             self.agent_proxy = RPCAgent()
             self.agent_proxy.device_id = msg.args[0]
+            self.agent_proxy.stats = self.server.get_stats(self.agent_proxy.device_id)
+            ok_msg = self._make_ok_msg()
+            if len(msg.args) > 1 and type(msg.args[1]) is dict:
+                # optional agent capabilities. e.g. {'batch': True, 'framing': [1, 2], 'codecs': ['compact', 'json']}
+                self.agent_proxy.capabilities = msg.args[1]
+                ok_msg.args.append(self.negotiate(msg.args[1]))
             self.agent_proxy.wfile = self.wfile
             self.agent_proxy.connection = self.connection
+            self.agent_proxy.close_connection = self.close_connection
+            # register result is always line framed, agent switches framing after it
+            self.wfile.write(ok_msg.to_bytes())
+            self.agent_proxy.framing = self.framing
+            self.agent_proxy.codec = self.codec
+            self.agent_proxy.compressor = self.compressor
             self.server.add_agent(self.agent_proxy)
             self.has_register = True
-            self.wfile.write(self._make_ok_msg().to_bytes())
         else:
             self.wfile.write(self._make_error_msg().to_bytes())
 
+    def negotiate(self, capabilities):
+        """
+        Choose protocol settings from agent capabilities.
+        :return: settings dict which is sent back to agent in register result
+        """
+        agent_framing = capabilities.get('framing', [FRAMING_LINE])
+        self.framing = max(set(agent_framing) & set(FRAMING_VERSIONS), default=FRAMING_LINE)
+        settings = {'framing': self.framing}
+        if self.framing == FRAMING_LENGTH:
+            # binary payload is only possible in length prefixed frames.
+            # agent lists codecs in its preferred order
+            for codec_name in capabilities.get('codecs', []):
+                codec = rpc_codec.get_codec(codec_name)
+                if codec:
+                    self.codec = codec
+                    break
+            settings['codec'] = self.codec.name
+            for compressor_name in capabilities.get('compression', []):
+                compressor = rpc_codec.get_compressor(compressor_name)
+                if compressor:
+                    self.compressor = compressor
+                    settings['compression'] = compressor.name
+                    settings['compress_threshold'] = COMPRESS_THRESHOLD
+                    break
+        return settings
+
     def _make_ok_msg(self):
         ok_msg = RPCMessage()
         ok_msg.msg_type = RPCMessage.RPC_RESULT
@@ -83,12 +317,121 @@ class RPCHandler(StreamRequestHandler):
         return err_msg
 
     def handle_unregister(self):
-        self.server.rm_agent(self.agent_proxy.device_id)
-        self.connection.close()
+        self.server.rm_agent(self.agent_proxy.device_id, self.agent_proxy)
+        self.close_connection()
         self.agent_proxy.is_closed = True
 
     def handle_message(self, msg):
-        self.agent_proxy.responses.put(msg)
+        self.agent_proxy.dispatch(msg)
+
+    def close_connection(self):
+        raise NotImplementedError
+
+
+class RPCHandler(RPCConnection, StreamRequestHandler):
+
+    def __init__(self, request, client_address, server):
+        self.has_register = False
+        self.agent_proxy = None
+        self.framing = FRAMING_LINE
+        self.codec = rpc_codec.JSON
+        self.compressor = None
+        self._flags = 0
+        # reusable frame buffer, grows to the largest frame received
+        self._buffer = bytearray(64 * 1024)
+        super().__init__(request, client_address, server)
+
+    def handle(self):
+        while True:
+            if self.framing == FRAMING_LENGTH:
+                payload = self.read_frame()
+                if payload is None:
+                    break
+                self.handle_frame(payload, self._flags)
+            else:
+                line = self.rfile.readline().decode().strip()
+                if len(line) == 0:
+                    break
+                self.handle_line(line)
+        self.handle_close()
+
+    def read_frame(self):
+        """
+        Read one length prefixed frame into the reusable buffer.
+        Frame flags are kept in self._flags
+        :return: memoryview of payload, None if connection closed
+        """
+        header = self.rfile.read(FRAME_HEADER.size)
+        if len(header) < FRAME_HEADER.size:
+            return None
+        length, self._flags = FRAME_HEADER.unpack(header)
+        if length > MAX_FRAME_SIZE:
+            logger.warning('Drop agent connection, frame size {} exceeds {}'.format(length, MAX_FRAME_SIZE))
+            return None
+        if length > len(self._buffer):
+            self._buffer = bytearray(length)
+        payload = memoryview(self._buffer)[:length]
+        received = 0
+        while received < length:
+            count = self.rfile.readinto(payload[received:])
+            if not count:
+                return None
+            received += count
+        return payload
+
+    def close_connection(self):
+        try:
+            # shutdown wakes up the handler thread blocked in read
+            self.connection.shutdown(socket.SHUT_RDWR)
+        except OSError:
+            pass
+        self.connection.close()
+
+
+class AsyncRPCHandler(RPCConnection):
+
+    def __init__(self, reader, writer, server):
+        self.reader = reader
+        self.writer = writer
+        self.server = server
+        self.wfile = _LoopWriter(server.loop, writer)
+        self.connection = writer.get_extra_info('socket')
+
+    async def handle(self):
+        while True:
+            try:
+                if self.framing == FRAMING_LENGTH:
+                    length, flags = FRAME_HEADER.unpack(await self.reader.readexactly(FRAME_HEADER.size))
+                    if length > MAX_FRAME_SIZE:
+                        raise ValueError('Frame size {} exceeds {}'.format(length, MAX_FRAME_SIZE))
+                    self.handle_frame(await self.reader.readexactly(length), flags)
+                    continue
+                line = (await self.reader.readline()).decode().strip()
+            except asyncio.IncompleteReadError:
+                break
+            except (ConnectionError, ValueError) as e:
+                logger.warning('Agent connection closed: {}'.format(e))
+                break
+            if len(line) == 0:
+                break
+            self.handle_line(line)
+        self.handle_close()
+        self.writer.close()
+
+    def close_connection(self):
+        self.server.loop.call_soon_threadsafe(self.writer.close)
+
+
+class _LoopWriter:
+    """
+    File like writer for asyncio stream. write() can be called from any thread.
+    """
+    def __init__(self, loop, writer):
+        self.loop = loop
+        self.writer = writer
+
+    def write(self, data):
+        self.loop.call_soon_threadsafe(self.writer.write, data)
 
 
 class RPCAgent:
@@ -99,7 +442,26 @@ class RPCAgent:
         self.msg_id = 0
         self.wfile = None
         self.connection = None
-        self.responses = queue.Queue()
+        self.capabilities = {}
+        self.framing = FRAMING_LINE
+        self.codec = rpc_codec.JSON
+        self.compressor = None
+        self.compression_stats = CompressionStats()
+        self.stats = rpc_stats.RPCStats()
+        # rpc_trace.TraceWriter, see start_recording
+        self.recorder = None
+        self._subscriptions = []
+        # last event data by event name
+        self.last_events = {}
+        # view_tree.ViewTree snapshot, valid while ui_version is unchanged
+        self.view_tree = None
+        self.ui_version = 0
+        self.missed_pings = 0
+        self.dead_reason = None
+        # callbacks called with dead reason when agent connection is lost
+        self.dead_callbacks = []
+        self._pending = {}
+        self._lock = Lock()
 
     def call(self, name, *args, timeout=Timeout, **kwargs):
         """
@@ -121,31 +483,359 @@ class RPCAgent:
         it have attr :'res-id' and 'content-des'. If remote object is TextView ,it have attr 'text'.
 
         Timeout:
-            RPC Call has 30 sec timeout by default. You'll get a TimeoutError after 30sec.
+            RPC Call has 120 sec timeout by default. You'll get a TimeoutError after timeout.
+        """
+        return self.result(self.call_async(name, *args, **kwargs), timeout=timeout)
+
+    def call_async(self, name, *args, **kwargs):
+        """
+        Send a rpc call without waiting for its response.
+        Calls are correlated by msg_id, so several calls can be in flight on one agent
+        and may be issued from different threads.
+        :return: msg_id of the call. Use RPCAgent.result(msg_id) to get the response.
         """
-        self.msg_id += 1
         msg = RPCMessage()
-        msg.msg_id = self.msg_id
         msg.msg_type = RPCMessage.RPC_CALL
         msg.name = name
         msg.args = args
         if 'version' in kwargs:
             msg.version = kwargs['version']
-        self.wfile.write(msg.to_bytes())
+        return self._send(msg)
+
+    def call_batch(self, calls, timeout=Timeout, **kwargs):
+        """
+        Send many independent calls in one round trip.
+        e.g.
+        agent.call_batch([('GetView', 'id-1'), ('GetView', 'id-2')])
+
+        :param calls: list of (name, *args) tuples
+        :return: list of response RPCMessage, in the same order as calls.
+        Agents which don't support batch frames get the calls pipelined instead.
+        """
+        if len(calls) == 0:
+            return []
+        if not self.capabilities.get('batch'):
+            msg_ids = []
+            try:
+                for call in calls:
+                    msg_ids.append(self.call_async(call[0], *call[1:], **kwargs))
+                return [self.result(msg_id, timeout=timeout) for msg_id in msg_ids]
+            finally:
+                # calls after a failed one are never waited for
+                with self._lock:
+                    for msg_id in msg_ids:
+                        future = self._pending.pop(msg_id, None)
+                        if future is not None:
+                            future.cancel()
+
+        msg = RPCMessage.make_batch(calls, version=kwargs.get('version', 1))
+        res = self.result(self._send(msg), timeout=timeout)
+        if res.name == 'Fail':
+            raise ValueError(*res.args)
+        return [RPCMessage.from_dict(sub_res) for sub_res in res.args]
+
+    def _send(self, msg):
+        with self._lock:
+            if self.dead_reason:
+                raise ConnectionError(self.dead_reason)
+            self.msg_id += 1
+            msg.msg_id = self.msg_id
+            future = Future()
+            future.method = msg.name
+            future.start = time.perf_counter()
+            future.msg = msg
+            self._pending[msg.msg_id] = future
+            data = self._pack(msg)
+            self.wfile.write(data)
+        self.stats.add_bytes_out(msg.name, len(data))
+        return msg.msg_id
+
+    def _pack(self, msg):
+        if self.framing != FRAMING_LENGTH:
+            return msg.to_bytes()
+        payload = self.codec.dumps(msg.__dict__)
+        flags = 0
+        if self.compressor and len(payload) > COMPRESS_THRESHOLD:
+            compressed = self.compressor.compress(payload)
+            if len(compressed) < len(payload):
+                self.compression_stats.add(msg.name, len(payload), len(compressed))
+                payload = compressed
+                flags = FLAG_COMPRESSED
+        return FRAME_HEADER.pack(len(payload), flags) + payload
+
+    def method_of(self, msg):
+        """
+        Method name of a message. Responses are named by the call which is waiting for them.
+        """
+        future = self._pending.get(getattr(msg, 'msg_id', None))
+        if future is not None:
+            return future.method
+        return msg.name
+
+    async def acall(self, name, *args, timeout=Timeout, **kwargs):
+        """
+        Awaitable version of call. Works with both server modes.
+        e.g.
+        res = await agent.acall('GetView', 'android:id/list')
+        """
+        msg_id = self.call_async(name, *args, **kwargs)
+        future = self._pending[msg_id]
+        try:
+            return self._record(future, await asyncio.wait_for(asyncio.wrap_future(future), timeout))
+        except asyncio.TimeoutError:
+            self.stats.add_timeout(future.method)
+            raise TimeoutError("RPC Call timeout")
+        except ConnectionError:
+            self.stats.add_call(future.method, time.perf_counter() - future.start, error=True)
+            raise
+        finally:
+            self._pending.pop(msg_id, None)
+
+    def result(self, msg_id, timeout=Timeout):
+        """
+        Wait for the response of a call sent by call_async.
+        A response which arrives after its call timed out is dropped.
+        """
+        future = self._pending.get(msg_id)
+        if future is None:
+            raise ValueError('No pending rpc call with msg_id {}'.format(msg_id))
         try:
-            res = self.responses.get(timeout=timeout)
-            return res
-        except queue.Empty:
+            return self._record(future, future.result(timeout=timeout))
+        except FutureTimeoutError:
+            self.stats.add_timeout(future.method)
             raise TimeoutError("RPC Call timeout")
+        except ConnectionError:
+            self.stats.add_call(future.method, time.perf_counter() - future.start, error=True)
+            raise
+        finally:
+            self._pending.pop(msg_id, None)
+
+    def _record(self, future, response):
+        latency = time.perf_counter() - future.start
+        self.stats.add_call(future.method, latency, error=response.name in ('Fail', 'error'))
+        recorder = self.recorder
+        if recorder:
+            self._write_trace(recorder, future.msg, response, latency)
+        return response
+
+    @staticmethod
+    def _write_trace(recorder, call, response, latency):
+        if call.msg_type != RPCMessage.RPC_BATCH or response.name == 'Fail':
+            recorder.write(call.name, call.version, call.args, response.name, response.args, latency)
+            return
+        # record every call of batch, batch latency is shared by its calls
+        sub_latency = latency / max(len(call.args), 1)
+        for sub_call, sub_res in zip(call.args, response.args):
+            recorder.write(sub_call['name'], sub_call['version'], sub_call['args'],
+                           sub_res['name'], sub_res['args'], sub_latency)
+
+    def start_recording(self, path):
+        """
+        Write every call and its response, with timings, to trace file path.
+        The trace can be served by rpc_agent.ReplayAgent without a device.
+        """
+        self.stop_recording()
+        self.recorder = rpc_trace.TraceWriter(path)
+
+    def stop_recording(self):
+        recorder, self.recorder = self.recorder, None
+        if recorder:
+            recorder.close()
+
+    def dispatch(self, msg):
+        """
+        Hand a response to the call waiting for it.
+        Responses without a pending call (e.g. a call already timed out) are dropped.
+        """
+        with self._lock:
+            future = self._pending.get(getattr(msg, 'msg_id', None))
+            if future is None or future.done():
+                logger.debug('Drop stale rpc response {}'.format(msg.to_json()))
+                return
+            future.set_result(msg)
+
+    def ping(self):
+        msg = RPCMessage()
+        msg.msg_type = RPCMessage.RPC_PING
+        msg.name = 'ping'
+        try:
+            with self._lock:
+                self.missed_pings += 1
+                self.wfile.write(self._pack(msg))
+        except OSError as e:
+            self.set_dead('Agent ping failed: {}'.format(e))
+
+    @property
+    def busy(self):
+        """
+        True while a call waits for its response
+        """
+        return any(not future.done() for future in list(self._pending.values()))
+
+    @property
+    def supports_events(self):
+        return bool(self.capabilities.get('events'))
+
+    def subscribe(self, name, match=None, replay_last=False):
+        """
+        Subscribe the next event pushed by agent.
+        Subscribe before the action which causes the event, then wait for it:
+
+        with agent.subscribe('view_appeared', match=lambda data: data.get('text') == 'OK') as subscription:
+            agent.call(...)
+            data = subscription.wait(timeout=20)
+
+        :param match: function(event data) -> bool, None matches every event of name
+        :param replay_last: match the last event of name received before subscribing too.
+        Use it for state events, e.g. 'activity' or 'dialog'
+        :return: EventSubscription
+        """
+        subscription = EventSubscription(self, name, match)
+        with self._lock:
+            if self.dead_reason:
+                raise ConnectionError(self.dead_reason)
+            if replay_last and name in self.last_events and subscription.matches(self.last_events[name]):
+                subscription.set_result(self.last_events[name])
+            else:
+                self._subscriptions.append(subscription)
+        return subscription
+
+    def unsubscribe(self, subscription):
+        with self._lock:
+            if subscription in self._subscriptions:
+                self._subscriptions.remove(subscription)
+
+    def wait_event(self, name, match=None, timeout=Timeout, replay_last=False):
+        """
+        Block until an event of name matches.
+        :return: event data
+        """
+        with self.subscribe(name, match, replay_last=replay_last) as subscription:
+            return subscription.wait(timeout)
+
+    def handle_event(self, msg):
+        data = msg.args[0] if len(msg.args) > 0 else None
+        with self._lock:
+            self.last_events[msg.name] = data
+            # ui events mean the view hierarchy changed
+            self.ui_version += 1
+            matched = [s for s in self._subscriptions if s.name == msg.name and s.matches(data)]
+            for subscription in matched:
+                self._subscriptions.remove(subscription)
+        for subscription in matched:
+            subscription.set_result(data)
+
+    def set_dead(self, reason):
+        """
+        Mark agent dead. Fail all pending calls and notify dead_callbacks.
+        """
+        with self._lock:
+            if self.is_closed:
+                return
+            self.is_closed = True
+            self.dead_reason = reason
+        logger.error('Agent {} dead: {}'.format(self.device_id, reason))
+        # report agent error before the failed calls are reported
+        for callback in self.dead_callbacks:
+            callback(reason)
+        with self._lock:
+            for future in list(self._pending.values()) + self._subscriptions:
+                if not future.done():
+                    future.set_exception(ConnectionError(reason))
+            self._subscriptions = []
+        self.close_connection()
+
+    def close_connection(self):
+        pass
 
     def close(self):
         msg = RPCMessage.get_kill_signal()
-        self.wfile.write(msg.to_bytes())
+        with self._lock:
+            if self.is_closed:
+                return
+            self.is_closed = True
+            self.wfile.write(self._pack(msg))
+
+
+class EventSubscription(Future):
+    """
+    Future of the first event matching a subscription, see RPCAgent.subscribe.
+    """
+    def __init__(self, agent, name, match=None):
+        super().__init__()
+        self.agent = agent
+        self.name = name
+        self.match = match
+
+    def matches(self, data):
+        try:
+            return self.match is None or bool(self.match(data))
+        except Exception as e:
+            logger.debug('Event {} match error {}'.format(self.name, e))
+            return False
+
+    def wait(self, timeout=Timeout):
+        """
+        :return: event data
+        :raise TimeoutError: no matching event before timeout
+        """
+        try:
+            return self.result(timeout=timeout)
+        except FutureTimeoutError:
+            raise TimeoutError('Wait event {} timeout'.format(self.name))
+
+    async def await_event(self, timeout=Timeout):
+        try:
+            return await asyncio.wait_for(asyncio.wrap_future(self), timeout)
+        except asyncio.TimeoutError:
+            raise TimeoutError('Wait event {} timeout'.format(self.name))
+
+    def close(self):
+        self.agent.unsubscribe(self)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
+
+
+class CompressionStats:
+    """
+    Per method counters of compressed frames, in both directions.
+    """
+    def __init__(self):
+        self.methods = {}
+        self._lock = Lock()
+
+    def add(self, method, raw_size, wire_size):
+        with self._lock:
+            counter = self.methods.setdefault(method, {'frames': 0, 'raw_bytes': 0, 'wire_bytes': 0})
+            counter['frames'] += 1
+            counter['raw_bytes'] += raw_size
+            counter['wire_bytes'] += wire_size
+
+    def saved_bytes(self, method=None):
+        with self._lock:
+            if method is not None:
+                counter = self.methods.get(method)
+                return counter['raw_bytes'] - counter['wire_bytes'] if counter else 0
+            return sum(c['raw_bytes'] - c['wire_bytes'] for c in self.methods.values())
+
+    def snapshot(self):
+        with self._lock:
+            return {method: dict(counter, saved_bytes=counter['raw_bytes'] - counter['wire_bytes'])
+                    for method, counter in self.methods.items()}
 
 
 class RPCMessage:
     RPC_CALL = 1
     RPC_RESULT = 2
+    RPC_BATCH = 3
+    RPC_PING = 4
+    RPC_PONG = 5
+    # pushed by agent without a call. name is event name, args[0] is event data
+    RPC_EVENT = 6
     RPC_KILL_SIGNAL = 99
 
     def __init__(self):
@@ -163,27 +853,72 @@ class RPCMessage:
         return msg
 
     @classmethod
-    def from_json(cls, json_str):
-        msg_dict = json.loads(decode(json_str))
+    def make_batch(cls, calls, version=1):
+        """
+        Make a batch message. Every call in batch is a RPC_CALL message dict in args.
+        Agent responds with one RPC_RESULT message, args are the result message dicts in order.
+        """
+        msg = cls()
+        msg.msg_type = RPCMessage.RPC_BATCH
+        msg.name = 'batch'
+        msg.version = version
+        for index, call in enumerate(calls):
+            sub_msg = cls()
+            sub_msg.msg_type = RPCMessage.RPC_CALL
+            sub_msg.msg_id = index
+            sub_msg.version = version
+            sub_msg.name = call[0]
+            sub_msg.args = call[1:]
+            msg.args.append(sub_msg.__dict__)
+        return msg
+
+    @classmethod
+    def from_dict(cls, msg_dict):
         if type(msg_dict) is not dict:
             raise TypeError('Json is not a dict, can\'t create rpc message')
         instance = cls()
         instance.__dict__ = msg_dict
         return instance
 
+    @classmethod
+    def from_json(cls, json_str):
+        return cls.from_dict(json.loads(decode(json_str)))
+
+    @classmethod
+    def from_frame(cls, payload, codec=rpc_codec.JSON):
+        """
+        :param payload: bytes or memoryview of a length prefixed frame
+        :param codec: payload codec negotiated at register
+        """
+        return cls.from_dict(codec.loads(payload))
+
     def to_json(self):
         return encode(json.dumps(self.__dict__))
 
     def to_bytes(self):
         return (self.to_json() + '\n').encode()
 
+    def to_frame(self, codec=rpc_codec.JSON):
+        payload = codec.dumps(self.__dict__)
+        return FRAME_HEADER.pack(len(payload), 0) + payload
+
 
-def get_server(port):
-    return RPCServer(('0.0.0.0', port), RPCHandler)
+def get_server(port, mode=THREAD_MODE, **heartbeat):
+    """
+    :param mode: THREAD_MODE use one thread per agent connection.
+                 ASYNCIO_MODE serve all agent connections on one asyncio event loop.
+    :param heartbeat: heartbeat_interval(sec, 0 to disable), heartbeat_miss_count and heartbeat_busy_miss_count
+    """
+    if mode == ASYNCIO_MODE:
+        return AsyncRPCServer(('0.0.0.0', port), **heartbeat)
+    elif mode == THREAD_MODE:
+        return RPCServer(('0.0.0.0', port), RPCHandler, **heartbeat)
+    else:
+        raise ValueError('Unknown rpc server mode {}'.format(mode))
 
 
-def start(port):
-    server = get_server(port)
+def start(port, mode=THREAD_MODE, **heartbeat):
+    server = get_server(port, mode=mode, **heartbeat)
     t = Thread(target=server.serve_forever)
     t.setDaemon(True)
     t.start()
@@ -0,0 +1,176 @@
+"""
+RPC call instrumentation.
+Every agent records per method latency, bytes in/out, timeouts and errors, see RPCAgent.stats.
+Stats are kept per device by rpc server, so they survive agent reconnects.
+
+Latency histogram is HDR style: values (in microseconds) are grouped in log2 buckets,
+every bucket is split into SUB_BUCKETS linear sub buckets. Relative error is below 1/SUB_BUCKETS.
+"""
+import time
+from contextlib import contextmanager
+from threading import Lock
+
+SUB_BUCKET_BITS = 5
+SUB_BUCKETS = 1 << SUB_BUCKET_BITS
+
+
+class LatencyHistogram:
+
+    def __init__(self):
+        self.counts = {}
+        self.total = 0
+        self.min = None
+        self.max = 0
+        self.sum = 0
+
+    @staticmethod
+    def bucket_of(value):
+        """
+        :return: (shift, sub bucket), bucket covers [sub bucket << shift, (sub bucket + 1) << shift)
+        """
+        shift = max(value.bit_length() - SUB_BUCKET_BITS, 0)
+        return shift, value >> shift
+
+    def record(self, seconds):
+        value = int(seconds * 1000000)
+        bucket = self.bucket_of(value)
+        self.counts[bucket] = self.counts.get(bucket, 0) + 1
+        self.total += 1
+        self.sum += value
+        self.max = max(self.max, value)
+        self.min = value if self.min is None else min(self.min, value)
+
+    def merge(self, other):
+        for bucket, count in other.counts.items():
+            self.counts[bucket] = self.counts.get(bucket, 0) + count
+        self.total += other.total
+        self.sum += other.sum
+        self.max = max(self.max, other.max)
+        if other.min is not None:
+            self.min = other.min if self.min is None else min(self.min, other.min)
+
+    def percentile(self, percent):
+        """
+        :return: latency in seconds, upper bound of the bucket holding the percentile
+        """
+        if self.total == 0:
+            return 0
+        rank = max(percent * self.total / 100, 1)
+        seen = 0
+        for shift, sub_bucket in sorted(self.counts, key=lambda b: b[1] << b[0]):
+            seen += self.counts[(shift, sub_bucket)]
+            if seen >= rank:
+                return min(((sub_bucket + 1) << shift) - 1, self.max) / 1000000
+        return self.max / 1000000
+
+    def snapshot(self):
+        return {
+            'count': self.total,
+            'min': (self.min or 0) / 1000000,
+            'mean': self.sum / self.total / 1000000 if self.total else 0,
+            'p50': self.percentile(50),
+            'p90': self.percentile(90),
+            'p99': self.percentile(99),
+            'max': self.max / 1000000
+        }
+
+
+class MethodStats:
+
+    def __init__(self):
+        self.latency = LatencyHistogram()
+        self.calls = 0
+        self.errors = 0
+        self.timeouts = 0
+        self.bytes_out = 0
+        self.bytes_in = 0
+
+    def snapshot(self):
+        return {
+            'calls': self.calls,
+            'errors': self.errors,
+            'timeouts': self.timeouts,
+            'bytes_out': self.bytes_out,
+            'bytes_in': self.bytes_in,
+            'latency': self.latency.snapshot()
+        }
+
+
+class RPCStats:
+    """
+    Per method stats of one device.
+    """
+    def __init__(self):
+        self.methods = {}
+        self._lock = Lock()
+
+    def _method(self, method):
+        stats = self.methods.get(method)
+        if stats is None:
+            stats = self.methods.setdefault(method, MethodStats())
+        return stats
+
+    def add_bytes_out(self, method, size):
+        with self._lock:
+            self._method(method).bytes_out += size
+
+    def add_bytes_in(self, method, size):
+        with self._lock:
+            self._method(method).bytes_in += size
+
+    def add_call(self, method, seconds, error=False):
+        with self._lock:
+            stats = self._method(method)
+            stats.calls += 1
+            stats.latency.record(seconds)
+            if error:
+                stats.errors += 1
+
+    def add_timeout(self, method):
+        with self._lock:
+            stats = self._method(method)
+            stats.calls += 1
+            stats.timeouts += 1
+
+    @contextmanager
+    def timer(self, method):
+        """
+        Record latency of a block. TimeoutError is counted as timeout, other exceptions as error.
+        e.g.
+        with agent.stats.timer('reflection.call'):
+            ...
+        """
+        start = time.perf_counter()
+        try:
+            yield
+        except TimeoutError:
+            self.add_timeout(method)
+            raise
+        except Exception:
+            self.add_call(method, time.perf_counter() - start, error=True)
+            raise
+        self.add_call(method, time.perf_counter() - start)
+
+    def snapshot(self):
+        with self._lock:
+            return {method: stats.snapshot() for method, stats in self.methods.items()}
+
+    def reset(self):
+        with self._lock:
+            self.methods = {}
+
+
+def format_snapshot(snapshot):
+    """
+    Format snapshot of one device as a text table, latency in ms
+    """
+    lines = ['{:<32}{:>8}{:>8}{:>8}{:>10}{:>10}{:>10}{:>12}{:>12}'.format(
+        'method', 'calls', 'errors', 'timeout', 'p50', 'p99', 'max', 'bytes out', 'bytes in')]
+    for method in sorted(snapshot):
+        stats = snapshot[method]
+        latency = stats['latency']
+        lines.append('{:<32}{:>8}{:>8}{:>8}{:>10.1f}{:>10.1f}{:>10.1f}{:>12}{:>12}'.format(
+            method, stats['calls'], stats['errors'], stats['timeouts'],
+            latency['p50'] * 1000, latency['p99'] * 1000, latency['max'] * 1000,
+            stats['bytes_out'], stats['bytes_in']))
+    return '\n'.join(lines)
@@ -0,0 +1,59 @@
+"""
+RPC call trace file. Written by RPCAgent.start_recording, served by rpc_agent.ReplayAgent.
+
+File: MAGIC, then one record per call. Record is a uint32 length + compact codec payload:
+{'name': call name, 'version': 1, 'args': call args, 'latency': seconds,
+ 'result': {'name': response name, 'args': response args}}
+"""
+import struct
+from threading import Lock
+from uitester.test_manager import rpc_codec
+
+MAGIC = b'UTRACE1\n'
+_LENGTH = struct.Struct('>I')
+
+
+class TraceWriter:
+
+    def __init__(self, path):
+        self.path = path
+        self._file = open(path, 'wb')
+        self._file.write(MAGIC)
+        self._lock = Lock()
+
+    def write(self, name, version, args, result_name, result_args, latency):
+        """
+        :param latency: seconds between call sent and response received
+        """
+        record = {
+            'name': name,
+            'version': version,
+            'args': list(args),
+            'latency': latency,
+            'result': {'name': result_name, 'args': list(result_args)}
+        }
+        payload = rpc_codec.COMPACT.dumps(record)
+        with self._lock:
+            if self._file.closed:
+                return
+            self._file.write(_LENGTH.pack(len(payload)) + payload)
+
+    def close(self):
+        with self._lock:
+            self._file.close()
+
+
+def read_trace(path):
+    """
+    :return: list of trace records in call order
+    """
+    records = []
+    with open(path, 'rb') as f:
+        if f.read(len(MAGIC)) != MAGIC:
+            raise ValueError('Not a rpc trace file: {}'.format(path))
+        while True:
+            header = f.read(_LENGTH.size)
+            if len(header) < _LENGTH.size:
+                break
+            records.append(rpc_codec.COMPACT.loads(f.read(_LENGTH.unpack(header)[0])))
+    return records
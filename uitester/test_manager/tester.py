@@ -1,18 +1,24 @@
 # coding=utf-8
 
 import logging
+import os
 
+from uitester import config
 from uitester.config import Config
 from uitester.error_handler import handle_error, error_handlers
 from uitester.test_manager.kw_runner import KWRunner, KWDebugRunner
 from uitester.test_manager.context import Context
 from uitester.test_manager.device_manager import DeviceManager
+from uitester.test_manager import kw_cache
 
 
 logging.basicConfig(level=logging.DEBUG)
 logger = logging.getLogger('Tester')
 logger.setLevel(logging.DEBUG)
 
+# compiled kw scripts saved between runs, see kw_cache
+kw_cache_file = os.path.abspath(os.path.join(config.app_dir, 'kw_cache.json'))
+
 
 class Tester:
     """
@@ -27,7 +33,8 @@ class Tester:
         error_handlers.append(DefaultErrorHandler())
         self.dm = DeviceManager(self.context)
         self.selected_device = None
-        self.runner = KWRunner(device_manager=self.dm)
+        self.runner = KWRunner(device_manager=self.dm, shard_rows=self.conf.shard_data_rows)
+        kw_cache.configure(self.conf.parse_cache_size, kw_cache_file if self.conf.persist_parse_cache else None)
 
     @handle_error
     def get_config(self):
@@ -56,6 +63,10 @@ class Tester:
 
     @handle_error
     def run(self, cases):
+        if self.runner.shard_rows:
+            # rows finish on different devices, results are recorded per row in one task
+            from uitester.task_redord_manager.task_record_manager import get_task_recorder
+            self.runner.recorder = get_task_recorder()
         self.runner.execute(cases, self.dm.selected_devices)
 
     @handle_error
@@ -74,6 +85,14 @@ class Tester:
         """
         self.dm.start_rpc_server()
 
+    @handle_error
+    def rpc_stats(self):
+        """
+        RPC call stats of all devices: latency percentiles, bytes in/out, errors and timeouts per method
+        :return: {device_id: {method: stats dict}}
+        """
+        return self.dm.rpc_stats()
+
     @handle_error
     def stop_server(self):
         pass
@@ -18,6 +18,12 @@ def start_agent(device_id):
     _agent.start('localhost', PORT)
 
 
+def start_replay_agent(device_id, trace_path, latency_scale=1.0):
+    _agent = rpc_agent.ReplayAgent(device_id, trace_path, latency_scale=latency_scale)
+    agents[device_id] = _agent
+    _agent.start('localhost', PORT)
+
+
 def close_agent(device_id):
     _agent = agents.get(device_id)
     if _agent:
@@ -38,6 +44,7 @@ def agent(*args):
     add [device_id] 'add agent with device_id'
     rm [device_id] 'remove agent with device_id'
     list 'list all agents'
+    replay [device_id] [trace_path] [latency_scale] 'add agent serving a recorded trace'
     """
     if len(args) < 1:
         print('Agent arg error. \nneed at least 1 args\n')
@@ -51,6 +58,11 @@ def agent(*args):
         close_agent(args[1])
     elif args[0] == 'list':
         show_agents()
+    elif args[0] == 'replay':
+        if len(args) < 3:
+            print('Agent replay need 3 args')
+            return
+        start_replay_agent(args[1], args[2], float(args[3]) if len(args) > 3 else 1.0)
     else:
         print('Unknown agent command')
 
@@ -67,6 +79,8 @@ def server(*args):
     connections 'list all connections'
     call [remote_method] 'call remote method on agent'
     select [device_id] 'select device_Id'
+    record [trace_path] 'record calls of selected device to trace file'
+    stop_record 'stop recording calls of selected device'
     """
     global selected_device_id
     if len(args) < 1:
@@ -100,10 +114,41 @@ def server(*args):
             response = agent_proxy.call(args[1], remote_call_args)
             print(response)
             print(response.to_json())
+    elif args[0] in ('record', 'stop_record'):
+        agent_proxy = test_server._agents.get(selected_device_id)
+        if not agent_proxy:
+            print('Not select any device')
+            return
+        if args[0] == 'stop_record':
+            agent_proxy.stop_recording()
+        elif len(args) < 2:
+            print('Record need a trace file path')
+        else:
+            agent_proxy.start_recording(args[1])
 
 commands['server'] = {'func': server, 'help': server.__doc__}
 
 
+def swarm(*args):
+    """
+    usage: swarm [agent_count] [duration] [payload_size] [think_time]
+
+    Load test rpc server with simulated agents, report calls/s, latency and server cpu/memory.
+    e.g. swarm 100 30 1000 0.1
+    """
+    options = [int, float, int, float]
+    try:
+        values = [option(arg) for option, arg in zip(options, args)]
+    except ValueError:
+        print('Swarm arg error.\n{}'.format(swarm.__doc__))
+        return
+    kwargs = dict(zip(['agent_count', 'duration', 'payload_size', 'think_time'], values))
+    report = rpc_agent.run_swarm(test_server, **kwargs)
+    print(rpc_agent.format_swarm_report(report))
+
+commands['swarm'] = {'func': swarm, 'help': swarm.__doc__}
+
+
 def parse_line(line):
     items = []
     cache = None
@@ -0,0 +1,162 @@
+"""
+Host side snapshot of the current window view hierarchy.
+Agent returns the whole hierarchy by GetViewTree in one response:
+
+{'fields': ['hash', 'parent', 'resource_id', 'class_name', 'text', 'bounds', 'visible'],
+ 'nodes': [[123456, -1, 'android:id/content', 'android.widget.FrameLayout', None, [0, 0, 1080, 1920], True], ...]}
+
+parent is the index of the parent node in nodes, -1 for root. Node hash can be used in reflection calls.
+A snapshot answers view queries until the next ui mutating action, see invalidate.
+"""
+import time
+from uitester.test_manager import context
+
+# snapshot older than this is fetched again, ui may change without any action (e.g. content loaded)
+SNAPSHOT_MAX_AGE = 2
+
+# remote methods with these name prefixes may change ui and invalidate the snapshot
+MUTATING_PREFIXES = ('click', 'enter', 'type', 'clear', 'drag', 'scroll', 'press', 'go', 'set', 'send',
+                     'start', 'finish', 'launch', 'swipe', 'pull', 'switch', 'refresh', 'load', 'change',
+                     'perform', 'request', 'hide', 'show', 'unlock')
+
+
+class ViewNode:
+
+    def __init__(self, index, hash, parent, resource_id, class_name, text, bounds, visible):
+        self.index = index
+        self.hash = hash
+        self.parent_index = parent
+        self.parent = None
+        self.children = []
+        self.resource_id = resource_id
+        self.class_name = class_name
+        self.text = text
+        self.bounds = bounds
+        self.visible = visible
+
+    @property
+    def is_shown(self):
+        """
+        Visible and all ancestors visible, same as android View.isShown
+        """
+        node = self
+        while node:
+            if not node.visible:
+                return False
+            node = node.parent
+        return True
+
+    def to_dict(self):
+        return {
+            'hash': self.hash,
+            'class_name': self.class_name,
+            'resource_id': self.resource_id,
+            'text': self.text,
+            'bounds': self.bounds,
+            'visible': self.visible
+        }
+
+
+class ViewTree:
+    """
+    Views of a snapshot indexed by resource id, class name, text and hash.
+    Lists of an index are in hierarchy pre-order, so index=0 is the first view on screen order.
+    """
+    def __init__(self, nodes):
+        self.nodes = nodes
+        self.by_hash = {}
+        self.by_id = {}
+        self.by_class = {}
+        self.by_text = {}
+        for node in nodes:
+            if node.parent_index >= 0:
+                node.parent = nodes[node.parent_index]
+                node.parent.children.append(node)
+            self.by_hash[node.hash] = node
+            if node.resource_id:
+                self.by_id.setdefault(node.resource_id, []).append(node)
+            self.by_class.setdefault(node.class_name, []).append(node)
+            if node.text:
+                self.by_text.setdefault(node.text, []).append(node)
+        self.created = time.time()
+        self.ui_version = 0
+
+    @classmethod
+    def from_response(cls, tree_dict):
+        fields = tree_dict['fields']
+        nodes = []
+        for index, values in enumerate(tree_dict['nodes']):
+            nodes.append(ViewNode(index, **dict(zip(fields, values))))
+        return cls(nodes)
+
+    def get(self, view_hash):
+        return self.by_hash.get(view_hash)
+
+    def find_by_id(self, resource_id, index=0, parent=None, shown_only=False):
+        return self._find(self.by_id.get(resource_id, []), index, parent, shown_only)
+
+    def find_by_class(self, class_name, index=0, parent=None, shown_only=False):
+        return self._find(self.by_class.get(class_name, []), index, parent, shown_only)
+
+    def find_by_text(self, text, index=0, parent=None, shown_only=False, contains=False):
+        if contains:
+            candidates = [node for node in self.nodes if node.text and text in node.text]
+        else:
+            candidates = self.by_text.get(text, [])
+        return self._find(candidates, index, parent, shown_only)
+
+    def _find(self, candidates, index, parent, shown_only):
+        """
+        :param parent: only search descendants of parent node
+        :param shown_only: skip views which are not shown, like robotium does
+        :return: index-th matched node, None if not found
+        """
+        if parent is not None:
+            candidates = [node for node in candidates if self.is_descendant(node, parent)]
+        if shown_only:
+            candidates = [node for node in candidates if node.is_shown]
+        if index < len(candidates):
+            return candidates[index]
+        return None
+
+    @staticmethod
+    def is_descendant(node, parent):
+        node = node.parent
+        while node:
+            if node is parent:
+                return True
+            node = node.parent
+        return False
+
+
+def is_mutating(method_name):
+    return type(method_name) == str and method_name.startswith(MUTATING_PREFIXES)
+
+
+def invalidate(agent=None):
+    """
+    UI may change, next query fetches a new snapshot
+    """
+    agent = agent or context.agent
+    if agent is not None:
+        agent.ui_version = getattr(agent, 'ui_version', 0) + 1
+
+
+def get_view_tree(agent=None, refresh=False):
+    """
+    :return: ViewTree snapshot of current window, None if agent doesn't support GetViewTree
+    """
+    agent = agent or context.agent
+    if not getattr(agent, 'capabilities', {}).get('view_tree'):
+        return None
+    tree = agent.view_tree
+    if refresh or tree is None or tree.ui_version != agent.ui_version \
+            or time.time() - tree.created > SNAPSHOT_MAX_AGE:
+        ui_version = agent.ui_version
+        response = agent.call('GetViewTree')
+        if response.name == 'Fail':
+            raise ValueError(*response.args)
+        tree = ViewTree.from_response(response.args[0])
+        tree.ui_version = ui_version
+        agent.view_tree = tree
+    return tree
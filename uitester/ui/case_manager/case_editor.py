@@ -518,7 +518,18 @@ class EditorWidget(QWidget):
         """
         self.debug_runner.core.kw_func.clear()
         self.debug_runner.core.kw_func = {**self.debug_runner.core.default_func}
-        content_list = self.dBCommandLineHelper.query_case_by_id(self.case_id).content.split("\n")
+        content = self.dBCommandLineHelper.query_case_by_id(self.case_id).content
+        try:
+            # compiled case is usually cached, no need to parse it again
+            program = self.debug_runner.core.compile(content, with_data=True)
+            self.debug_runner.core.kw_func = dict(program.kw_func)
+            for var_name in program.var_names:
+                self.debug_runner.core.kw_var.setdefault(var_name, None)
+            return
+        except Exception:
+            # parse line by line, so every error is shown
+            pass
+        content_list = content.split("\n")
         if not content_list:
             return
         for line in content_list: